@@ -6,19 +6,32 @@ Downloads Sentinel-2 images, processes them, runs ML models, and generates repor
 import os
 import json
 import yaml
+import hashlib
 from datetime import datetime, timedelta
 from pathlib import Path
 import schedule
 import time
+import cv2
 
 from src.image_processor import ImageProcessor
 from src.models import GrowthStageClassifier, NitrogenPredictor
+from src.tile_cache import TileCache, tile_key
+from src.mcp import MCPTrigger
+from src.zonal_stats import ZonalStatistics
+from src.instrumentation import StageProfiler
+from src.agentic_ai import RecommendationAgent
 import numpy as np
 
 class WeeklyPipeline:
     """Automated weekly processing pipeline"""
     
-    def __init__(self, config_path="config.yaml"):
+    def __init__(self, config_path="config.yaml", models=None):
+        """
+        Args:
+            config_path: Path to config.yaml
+            models: Optional already loaded (GrowthStageClassifier,
+                NitrogenPredictor), shared between pipelines (batch workers)
+        """
         with open(config_path, 'r') as f:
             self.config = yaml.safe_load(f)
         
@@ -28,12 +41,32 @@ class WeeklyPipeline:
         os.makedirs(self.data_dir, exist_ok=True)
         
         self.processor = ImageProcessor(config_path)
-        self.stage_classifier = GrowthStageClassifier(config_path)
-        self.nitrogen_predictor = NitrogenPredictor(config_path)
+        self.mcp = MCPTrigger(config_path)
+        self.zonal = ZonalStatistics(config_path)
+        self.recommendation_agent = RecommendationAgent(config_path)
+        
+        if models is not None:
+            self.stage_classifier, self.nitrogen_predictor = models
+        else:
+            self.stage_classifier = GrowthStageClassifier(config_path)
+            self.nitrogen_predictor = NitrogenPredictor(config_path)
+            
+            # Load models if available
+            self.stage_classifier.load_model()
+            self.nitrogen_predictor.load_model()
+        
+        # Change-aware runs reuse the outputs of unchanged tiles
+        incremental = self.config['pipeline'].get('incremental', {})
+        self.incremental = incremental.get('enabled', False)
+        self.ndvi_change_threshold = self.config['pipeline']['ndvi_change_threshold']
+        self.tile_cache = TileCache(incremental.get(
+            'state_path', os.path.join(self.output_dir, "tile_cache.json")))
         
-        # Load models if available
-        self.stage_classifier.load_model()
-        self.nitrogen_predictor.load_model()
+        # Per-stage wall/CPU time, peak RSS and I/O, also as a Prometheus text file
+        metrics = self.config['pipeline'].get('metrics', {})
+        self.metrics_enabled = metrics.get('enabled', True)
+        self.metrics_path = metrics.get('prometheus_path',
+                                        os.path.join(self.output_dir, "pipeline_metrics.prom"))
     
     def download_images(self, date=None):
         """
@@ -56,48 +89,101 @@ class WeeklyPipeline:
         """
         Classify growth stages using CNN
         Divides image into patches and classifies each
+        
+        Args:
+            stacked_bands: (H, W, C) array/memmap, or path to stacked_bands.npy
+                (opened memory-mapped, so patches are paged in on demand)
+            patch_size: Patch edge in pixels
         """
         print("Classifying growth stages...")
         
+        if isinstance(stacked_bands, (str, os.PathLike)):
+            stacked_bands = np.load(stacked_bands, mmap_mode='r')
+        
         if self.stage_classifier.model is None:
             print("Warning: CNN model not loaded. Using random predictions.")
+        
+        return self._classify_grid(stacked_bands, patch_size)
+    
+    def _classify_grid(self, stacked_bands, patch_size):
+        """Stage labels and probabilities for every full patch of an (H, W, C) array"""
+        h, w, c = stacked_bands.shape
+        n_patches_h = h // patch_size
+        n_patches_w = w // patch_size
+        
+        if self.stage_classifier.model is None:
             # Create dummy patches for demonstration
-            h, w, c = stacked_bands.shape
-            n_patches_h = h // patch_size
-            n_patches_w = w // patch_size
-            
-            stages = np.random.randint(0, 4, size=(n_patches_h, n_patches_w))
-            stage_probs = np.random.rand(n_patches_h, n_patches_w, 4)
+            n_classes = self.config['models']['cnn']['num_classes']
+            stages = np.random.randint(0, n_classes, size=(n_patches_h, n_patches_w))
+            stage_probs = np.random.rand(n_patches_h, n_patches_w, n_classes)
             stage_probs = stage_probs / stage_probs.sum(axis=2, keepdims=True)
             
             return stages, stage_probs
         
-        # Extract patches
-        h, w, c = stacked_bands.shape
-        patches = []
-        patch_coords = []
-        
-        for i in range(0, h - patch_size, patch_size):
-            for j in range(0, w - patch_size, patch_size):
-                patch = stacked_bands[i:i+patch_size, j:j+patch_size, :]
-                patches.append(patch)
-                patch_coords.append((i, j))
+        # Zero-copy (n_h, n_w, p, p, C) view of all full patches, last row/column included
+        patches = self.patch_grid(stacked_bands, patch_size)
         
-        patches = np.array(patches)
+        # Stream fixed-size batches through the CNN, filling the grid as we go
+        batch_size = self.config['models']['cnn'].get('batch_size', 256)
+        batch = np.empty((batch_size, patch_size, patch_size, c), dtype=np.float32)
+        stages = np.empty((n_patches_h, n_patches_w), dtype=np.int64)
+        stage_probs = None
         
-        # Predict
-        stage_labels, stage_probs = self.stage_classifier.predict(patches)
-        
-        # Reshape to grid
-        n_patches_h = len(range(0, h - patch_size, patch_size))
-        n_patches_w = len(range(0, w - patch_size, patch_size))
-        stages = stage_labels.reshape(n_patches_h, n_patches_w)
+        n_patches = n_patches_h * n_patches_w
+        for start in range(0, n_patches, batch_size):
+            stop = min(start + batch_size, n_patches)
+            
+            # Copy the batch row segment by row segment (no per-patch Python loop)
+            filled = 0
+            for row, col_start, col_stop in self._row_segments(start, stop, n_patches_w):
+                count = col_stop - col_start
+                batch[filled:filled + count] = patches[row, col_start:col_stop]
+                filled += count
+            
+            labels, probs = self.stage_classifier.predict(batch[:filled], verbose=0)
+            
+            if stage_probs is None:
+                stage_probs = np.empty((n_patches_h, n_patches_w, probs.shape[1]),
+                                       dtype=np.float32)
+            stages.reshape(-1)[start:stop] = labels
+            stage_probs.reshape(-1, probs.shape[1])[start:stop] = probs
         
         return stages, stage_probs
     
-    def predict_nitrogen(self, ndvi, ndre):
+    @staticmethod
+    def patch_grid(array, patch_size):
+        """
+        Non-overlapping patch view of an (H, W, C) array without copying
+        
+        Returns:
+            (H // p, W // p, p, p, C) strided view; works on memmaps too
+        """
+        c = array.shape[2]
+        windows = np.lib.stride_tricks.sliding_window_view(
+            array, (patch_size, patch_size, c))
+        return windows[::patch_size, ::patch_size, 0]
+    
+    @staticmethod
+    def _row_segments(start, stop, n_cols):
+        """Split flat patch indices [start, stop) into (row, col_start, col_stop) runs"""
+        while start < stop:
+            row, col = divmod(start, n_cols)
+            col_stop = min(n_cols, col + (stop - start))
+            yield row, col, col_stop
+            start += col_stop - col
+    
+    def predict_nitrogen(self, ndvi, ndre, stacked_bands=None, patch_size=64):
         """
         Predict Nitrogen levels using Random Forest
+        
+        A model trained on (NDVI, NDRE) pixels is applied per pixel; a model
+        trained on patch features (models.extract_patch_features, as in
+        `python -m src.models --train`) is applied per patch of stacked_bands.
+        
+        Pixel modes (pipeline.nitrogen.mode):
+            full: score every pixel in row chunks into a memory-mapped raster
+            grid: score a regular grid and interpolate bilinearly
+            sample: legacy 1-in-100 sampling, other pixels filled with the mean
         """
         print("Predicting Nitrogen levels...")
         
@@ -107,6 +193,41 @@ class WeeklyPipeline:
             nitrogen = 100 + ndvi * 100  # kg/ha
             return nitrogen
         
+        if getattr(self.nitrogen_predictor.model, 'n_features_in_', 2) != 2:
+            try:
+                return self._predict_nitrogen_patches(ndvi, stacked_bands, patch_size)
+            except ValueError as e:
+                print(f"Warning: {e}. Using NDVI-based estimation.")
+                return 100 + ndvi * 100
+        
+        settings = self.config['pipeline'].get('nitrogen', {})
+        mode = settings.get('mode', 'full')
+        chunk_rows = settings.get('chunk_rows', 256)
+        h, w = ndvi.shape
+        
+        if mode == 'full':
+            nitrogen_map = np.lib.format.open_memmap(
+                os.path.join(self.output_dir, "nitrogen.npy"),
+                mode='w+', dtype=np.float32, shape=(h, w))
+            self._predict_nitrogen_chunks(ndvi, ndre, nitrogen_map, chunk_rows)
+            nitrogen_map.flush()
+            return nitrogen_map
+        
+        if mode == 'grid':
+            step = settings.get('grid_step', 10)
+            offset = step // 2
+            ndvi_grid = np.ascontiguousarray(ndvi[offset::step, offset::step])
+            ndre_grid = np.ascontiguousarray(ndre[offset::step, offset::step])
+            
+            grid = np.empty(ndvi_grid.shape, dtype=np.float32)
+            self._predict_nitrogen_chunks(ndvi_grid, ndre_grid, grid, chunk_rows)
+            
+            # Fill invalid cells so they don't bleed NaN into the interpolation
+            grid[~np.isfinite(grid)] = np.nanmean(grid) if np.isfinite(grid).any() else 150.0
+            nitrogen_map = cv2.resize(grid, (w, h), interpolation=cv2.INTER_LINEAR)
+            nitrogen_map[~np.isfinite(ndvi)] = np.nan
+            return nitrogen_map
+        
         # Extract features (in production, use more sophisticated feature extraction)
         h, w = ndvi.shape
         features = []
@@ -132,7 +253,215 @@ class WeeklyPipeline:
         
         return nitrogen_map
     
-    def generate_report(self, results, stages, nitrogen_map):
+    def _predict_nitrogen_patches(self, ndvi, stacked_bands, patch_size):
+        """
+        Score a patch-feature model on every full patch of stacked_bands
+        
+        Each patch value is spread over its pixels; pixels in the partial
+        last row/column of patches take the nearest patch's value. Patches
+        without valid pixels (cloud, nodata) have non-finite features and get
+        NaN, as invalid pixels do in the pixel modes.
+        """
+        if stacked_bands is None:
+            raise ValueError("Nitrogen model uses patch features but no band stack was given")
+        if isinstance(stacked_bands, (str, os.PathLike)):
+            stacked_bands = np.load(stacked_bands, mmap_mode='r')
+        
+        patches = self.patch_grid(stacked_bands, patch_size)
+        n_patches_h, n_patches_w = patches.shape[:2]
+        if n_patches_h == 0 or n_patches_w == 0:
+            raise ValueError(f"Scene is smaller than one {patch_size}px patch")
+        
+        n_features = self.nitrogen_predictor.model.n_features_in_
+        grid = np.empty((n_patches_h, n_patches_w), dtype=np.float32)
+        for row in range(n_patches_h):
+            features = self.nitrogen_predictor.patch_features(patches[row])
+            if features.shape[1] != n_features:
+                raise ValueError(f"Nitrogen model expects {n_features} features, "
+                                 f"{stacked_bands.shape[2]}-band patches give {features.shape[1]}")
+            # NaN features would go down the flat forest's "> threshold" branches,
+            # where sklearn routes them differently
+            valid = np.isfinite(features).all(axis=1)
+            grid[row] = np.nan
+            if valid.any():
+                grid[row, valid] = self.nitrogen_predictor.predict(features[valid])
+        
+        h, w = ndvi.shape
+        rows = np.minimum(np.arange(h) // patch_size, n_patches_h - 1)
+        cols = np.minimum(np.arange(w) // patch_size, n_patches_w - 1)
+        nitrogen_map = grid[rows[:, None], cols[None, :]]
+        nitrogen_map[~np.isfinite(ndvi)] = np.nan
+        return nitrogen_map
+    
+    def _predict_nitrogen_chunks(self, ndvi, ndre, out, chunk_rows):
+        """
+        Score every pixel of ndvi/ndre into out, chunk_rows rows at a time
+        
+        Each chunk is one vectorized predict call on its valid pixels; the
+        forest parallelises the call across cores. Invalid pixels get NaN.
+        """
+        h = ndvi.shape[0]
+        for row in range(0, h, chunk_rows):
+            ndvi_chunk = np.asarray(ndvi[row:row + chunk_rows], dtype=np.float32)
+            ndre_chunk = np.asarray(ndre[row:row + chunk_rows], dtype=np.float32)
+            
+            valid = np.isfinite(ndvi_chunk) & np.isfinite(ndre_chunk)
+            chunk = np.full(ndvi_chunk.shape, np.nan, dtype=np.float32)
+            if valid.any():
+                features = np.column_stack((ndvi_chunk[valid], ndre_chunk[valid]))
+                chunk[valid] = self.nitrogen_predictor.predict(features)
+            out[row:row + chunk_rows] = chunk
+    
+    def _predict_nitrogen_tile(self, ndvi, ndre, stacked_bands, window, out, patch_size):
+        """
+        Nitrogen for one tile of the scene, written into out[window]
+        
+        Matches predict_nitrogen on the whole scene: pixel models are scored
+        per pixel, patch-feature models on the scene's patch grid (a tile
+        narrower than a patch takes the neighbouring patch, as the partial
+        last row/column of the scene does).
+        """
+        rows, cols = window.toslices()
+        model = self.nitrogen_predictor.model
+        
+        if model is not None and getattr(model, 'n_features_in_', 2) == 2:
+            chunk_rows = self.config['pipeline'].get('nitrogen', {}).get('chunk_rows', 256)
+            self._predict_nitrogen_chunks(ndvi[rows, cols], ndre[rows, cols],
+                                          out[rows, cols], chunk_rows)
+            return
+        
+        if model is not None:
+            row_start, col_start = rows.start, cols.start
+            if rows.stop - rows.start < patch_size:
+                row_start = max(rows.start - patch_size, 0)
+            if cols.stop - cols.start < patch_size:
+                col_start = max(cols.start - patch_size, 0)
+            try:
+                nitrogen = self._predict_nitrogen_patches(
+                    ndvi[row_start:rows.stop, col_start:cols.stop],
+                    stacked_bands[row_start:rows.stop, col_start:cols.stop], patch_size)
+                out[rows, cols] = nitrogen[rows.start - row_start:, cols.start - col_start:]
+                return
+            except ValueError as e:
+                print(f"Warning: {e}. Using NDVI-based estimation.")
+        
+        out[rows, cols] = 100 + ndvi[rows, cols] * 100
+    
+    def model_fingerprint(self):
+        """Identity of the CNN and RF in use (model files and whether they loaded)"""
+        digest = hashlib.sha1()
+        digest.update(f"cnn={self.stage_classifier.model is not None};"
+                      f"rf={self.nitrogen_predictor.model is not None}".encode())
+        
+        paths = [self.stage_classifier.model_path,
+                 self.stage_classifier.export_path('tflite'),
+                 self.stage_classifier.export_path('onnx'),
+                 self.nitrogen_predictor.model_path]
+        if self.nitrogen_predictor.artifact_path:
+            paths.append(os.path.join(self.nitrogen_predictor.artifact_path, "manifest.json"))
+        
+        for path in paths:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+    
+    def process_incremental(self, patch_size=64, profiler=None):
+        """
+        Change-aware processing: only tiles that changed are recomputed
+        
+        Band math reruns for tiles whose input hash changed
+        (ImageProcessor.process_images_incremental). The CNN and RF rerun for
+        new tiles, after a model change, and for tiles whose NDVI drifted by
+        more than ndvi_change_threshold since their last model run; every
+        other tile, including one whose bands changed by less, keeps its
+        cached stages and nitrogen. Pixel nitrogen models are always scored
+        per pixel here (pipeline.nitrogen.mode is ignored).
+        
+        Args:
+            patch_size: CNN patch edge
+            profiler: StageProfiler recording band math, the CNN and the RF
+                (including the nitrogen COG) as process, classify and nitrogen
+        
+        Returns:
+            results, stages, stage_probs, nitrogen_map
+        
+        Raises:
+            ValueError: If the tile grid is not aligned to patch_size
+        """
+        cache = self.tile_cache
+        profiler = profiler or StageProfiler()
+        with profiler.stage("process"):
+            results = self.processor.process_images_incremental(cache, patch_size)
+        
+        h, w = results['ndvi'].shape
+        n_classes = self.config['models']['cnn']['num_classes']
+        grid_shape = (h // patch_size, w // patch_size)
+        
+        model_outputs = {
+            os.path.join(self.output_dir, "growth_stages.npy"): (grid_shape, np.int64),
+            os.path.join(self.output_dir, "growth_stage_probs.npy"):
+                (grid_shape + (n_classes,), np.float32),
+            os.path.join(self.output_dir, "nitrogen.npy"): ((h, w), np.float32)
+        }
+        outputs = dict(results['outputs'])
+        for path, (shape, dtype) in model_outputs.items():
+            outputs[path] = cache.open_array(path, shape, dtype, 'models')
+        stages, stage_probs, nitrogen_map = [outputs[path] for path in model_outputs]
+        
+        fingerprint = self.model_fingerprint()
+        windows = results['windows']
+        dirty = [window for window in windows
+                 if cache.needs_models(tile_key(window), self.ndvi_change_threshold, fingerprint)]
+        print(f"Running CNN and RF on {len(dirty)}/{len(windows)} tiles")
+        
+        if dirty and self.stage_classifier.model is None:
+            print("Warning: CNN model not loaded. Using random predictions.")
+        if dirty and self.nitrogen_predictor.model is None:
+            print("Warning: RF model not loaded. Using NDVI-based estimation.")
+        
+        stacked_bands = results['stacked_bands']
+        with profiler.stage("classify"):
+            for window in dirty:
+                rows, cols = window.toslices()
+                patch_rows = slice(rows.start // patch_size, rows.stop // patch_size)
+                patch_cols = slice(cols.start // patch_size, cols.stop // patch_size)
+                if patch_rows.stop > patch_rows.start and patch_cols.stop > patch_cols.start:
+                    tile_stages, tile_probs = self._classify_grid(stacked_bands[rows, cols],
+                                                                  patch_size)
+                    stages[patch_rows, patch_cols] = tile_stages
+                    stage_probs[patch_rows, patch_cols] = tile_probs
+        
+        with profiler.stage("nitrogen"):
+            for window in dirty:
+                self._predict_nitrogen_tile(results['ndvi'], results['ndre'], stacked_bands,
+                                            window, nitrogen_map, patch_size)
+                cache.record_models(tile_key(window))
+            
+            cache.finish(outputs, results['input_fingerprint'], fingerprint)
+            self.processor.save_cog(nitrogen_map, 'nitrogen', results['transform'], results['crs'])
+        
+        return results, stages, stage_probs, nitrogen_map
+    
+    def compute_zone_statistics(self, results, stages, nitrogen_map, patch_size=64):
+        """
+        Per-zone statistics for the zones in config.yaml
+        
+        Returns:
+            List of zone statistics, or None when no zones file is configured
+        """
+        zones = self.zonal.configured_zones()
+        if zones is None:
+            return None
+        
+        print(f"Computing statistics for {len(zones)} zones...")
+        layers = {'ndvi': results['ndvi'], 'ndre': results['ndre'], 'nitrogen': nitrogen_map}
+        zone_stats = self.zonal.compute(zones, layers, results['transform'], results['crs'],
+                                        stages=stages, patch_size=patch_size)
+        self.zonal.save(zone_stats)
+        return zone_stats
+    
+    def generate_report(self, results, stages, nitrogen_map, zone_stats=None):
         """
         Generate weekly report JSON
         """
@@ -179,14 +508,20 @@ class WeeklyPipeline:
             },
             "processing_status": "completed"
         }
+        if zone_stats is not None:
+            report["zones"] = zone_stats
         
-        # Save report
+        self.save_report(report)
+        return report
+    
+    def save_report(self, report):
+        """Write (or rewrite) the weekly report JSON"""
         report_path = os.path.join(self.output_dir, f"weekly_report_{report['date']}.json")
         with open(report_path, 'w') as f:
             json.dump(report, f, indent=2)
         
         print(f"Report saved to {report_path}")
-        return report
+        return report_path
     
     def run_weekly_processing(self):
         """Execute full weekly processing pipeline"""
@@ -194,21 +529,62 @@ class WeeklyPipeline:
         print(f"Weekly Processing Pipeline - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("="*60)
         
+        profiler = StageProfiler()
+        success = False
         try:
             # 1. Download images (if needed)
-            self.download_images()
+            with profiler.stage("download"):
+                self.download_images()
+            
+            results = None
+            if self.incremental:
+                # 2-4. Band math, CNN and RF on changed tiles only
+                recorded = list(profiler.stages)
+                try:
+                    results, stages, stage_probs, nitrogen_map = self.process_incremental(
+                        profiler=profiler)
+                except ValueError as e:
+                    print(f"Warning: {e}. Running a full pass instead.")
+                    # Keep the failed attempt's stages apart from the full pass
+                    for name in [name for name in profiler.stages if name not in recorded]:
+                        profiler.rename(name, f"{name}_incremental")
             
-            # 2. Process images
-            results = self.process_images()
+            if results is None:
+                # 2. Process images
+                with profiler.stage("process"):
+                    results = self.process_images()
+                
+                # 3. Classify growth stages
+                with profiler.stage("classify"):
+                    stages, stage_probs = self.classify_growth_stages(results['stacked_bands'])
+                    np.save(os.path.join(self.output_dir, "growth_stages.npy"), stages)
+                
+                # 4. Predict Nitrogen
+                with profiler.stage("nitrogen"):
+                    nitrogen_map = self.predict_nitrogen(results['ndvi'], results['ndre'],
+                                                         results['stacked_bands'])
+                    self.processor.save_cog(nitrogen_map, 'nitrogen',
+                                            results['transform'], results['crs'])
             
-            # 3. Classify growth stages
-            stages, stage_probs = self.classify_growth_stages(results['stacked_bands'])
+            # 5. Zonal statistics and report
+            with profiler.stage("report"):
+                zone_stats = self.compute_zone_statistics(results, stages, nitrogen_map)
+                report = self.generate_report(results, stages, nitrogen_map, zone_stats)
+                if zone_stats is not None:
+                    recommendations = self.recommendation_agent.generate_zone_recommendations(
+                        self.zonal.recommendation_inputs(zone_stats))
+                    self.recommendation_agent.save_recommendations(recommendations)
             
-            # 4. Predict Nitrogen
-            nitrogen_map = self.predict_nitrogen(results['ndvi'], results['ndre'])
+            # 6. MCP: archive the week, streamed NDVI change, dashboard update
+            with profiler.stage("mcp"):
+                self.mcp.archive_week(results['ndvi'], results['ndre'])
+                triggered, change_info = self.mcp.trigger_classification(results['ndvi'], report)
+                report['mcp'] = change_info
             
-            # 5. Generate report
-            report = self.generate_report(results, stages, nitrogen_map)
+            # Rewrite the report with the MCP result and the stage metrics
+            report['instrumentation'] = profiler.summary()
+            self.save_report(report)
+            success = True
             
             print("\n" + "="*60)
             print("Pipeline completed successfully!")
@@ -221,14 +597,29 @@ class WeeklyPipeline:
             import traceback
             traceback.print_exc()
             return None
+            
+        finally:
+            profiler.print_summary()
+            if self.metrics_enabled and self.metrics_path:
+                profiler.write_prometheus(self.metrics_path, success)
 
 
-def run_scheduled():
-    """Run pipeline on schedule (every Monday at 6 AM)"""
-    pipeline = WeeklyPipeline()
+def run_batch(manifest_path, workers=None):
+    """Run the pipeline over every granule and field of a manifest"""
+    from src.batch import BatchRunner
+    
+    return BatchRunner("config.yaml", manifest_path, workers=workers).run()
+
+
+def run_scheduled(manifest_path=None):
+    """Run pipeline (or a batch manifest) on schedule (every Monday at 6 AM)"""
+    if manifest_path:
+        job = lambda: run_batch(manifest_path)
+    else:
+        job = WeeklyPipeline().run_weekly_processing
     
     # Schedule weekly run
-    schedule.every().monday.at("06:00").do(pipeline.run_weekly_processing)
+    schedule.every().monday.at("06:00").do(job)
     
     print("Pipeline scheduler started. Runs every Monday at 6:00 AM")
     print("Press Ctrl+C to stop")
@@ -241,9 +632,18 @@ def run_scheduled():
 if __name__ == "__main__":
     import sys
     
+    # --batch <manifest.yaml> [--workers N] runs a manifest of granules/fields
+    manifest_path, workers = None, None
+    if "--batch" in sys.argv:
+        manifest_path = sys.argv[sys.argv.index("--batch") + 1]
+    if "--workers" in sys.argv:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+    
     if len(sys.argv) > 1 and sys.argv[1] == "--schedule":
         # Run with scheduler
-        run_scheduled()
+        run_scheduled(manifest_path)
+    elif manifest_path:
+        run_batch(manifest_path, workers)
     else:
         # Run once immediately
         pipeline = WeeklyPipeline()
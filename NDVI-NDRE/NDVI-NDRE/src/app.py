@@ -3,7 +3,7 @@ Flask API for Mobile/Web App Integration
 Endpoints for predictions, recommendations, and dashboard data
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import os
 import json
@@ -14,6 +14,10 @@ from datetime import datetime
 from src.image_processor import ImageProcessor
 from src.models import GrowthStageClassifier, NitrogenPredictor
 from src.agentic_ai import RecommendationAgent
+from src.raster_lookup import RasterLookup
+from src.jobs import JobQueue
+from src.tile_server import TileServer
+from src.zonal_stats import ZonalStatistics, load_zones
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for mobile app
@@ -24,6 +28,16 @@ processor = ImageProcessor(config_path)
 stage_classifier = GrowthStageClassifier(config_path)
 nitrogen_predictor = NitrogenPredictor(config_path)
 recommendation_agent = RecommendationAgent(config_path)
+raster_lookup = RasterLookup(config_path)
+tile_server = TileServer(config_path)
+zonal_stats = ZonalStatistics(config_path)
+
+# Long-running processing happens off the request thread
+jobs_config = processor.config.get('jobs', {})
+# One worker: jobs share `processor` and write the same output files, so
+# concurrent jobs would overwrite each other's buffers and outputs
+job_queue = JobQueue(max_workers=1,
+                     max_history=jobs_config.get('max_history', 100))
 
 # Load models if available
 stage_classifier.load_model()
@@ -49,11 +63,16 @@ def predict_from_gee():
     Predict from Google Earth Engine coordinates
     Accepts GPS coordinates and returns NDVI, growth stage, nitrogen
     
+    Values are looked up in the precomputed COG outputs through their
+    transform/CRS; the scene is never reprocessed per request.
+    
     Request body:
     {
         "latitude": 13.0827,
         "longitude": 80.2707,
-        "date": "2025-11-03"  # optional
+        "date": "2025-11-03",  # optional
+        "buffer_pixels": 1,    # optional, window half-width for statistics
+        "polygon": {...}       # optional GeoJSON geometry (WGS84) to summarise
     }
     """
     try:
@@ -66,17 +85,35 @@ def predict_from_gee():
         lon = data['longitude']
         date = data.get('date', datetime.now().strftime("%Y-%m-%d"))
         
-        # In production, fetch from GEE
-        # For now, use local processing
-        results = processor.process_images()
+        if 'ndvi' not in raster_lookup.available_layers():
+            return jsonify({
+                "error": "Raster outputs not available. Run /process or the weekly pipeline first."
+            }), 503
+        
+        try:
+            if data.get('polygon'):
+                stats = raster_lookup.polygon_stats(data['polygon'])
+                values = {layer: s['mean'] for layer, s in stats.items()}
+            else:
+                stats = raster_lookup.sample(lat, lon, data.get('buffer_pixels'))
+                values = {layer: s['value'] for layer, s in stats.items()}
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 404
         
-        # Get NDVI at coordinates (simplified - in production, use actual geo-referencing)
-        ndvi_value = np.nanmean(results['ndvi'])
-        ndre_value = np.nanmean(results['ndre'])
+        ndvi_value = values.get('ndvi')
+        ndre_value = values.get('ndre')
+        if ndvi_value is None or ndre_value is None:
+            return jsonify({"error": "No valid NDVI/NDRE data at this location"}), 404
         
-        # Predict nitrogen
-        features = np.array([[ndvi_value, ndre_value]])
-        nitrogen_pred = nitrogen_predictor.predict(features)[0] if nitrogen_predictor.model else 150.0
+        # Nitrogen from the precomputed map, else predict from this pixel's indices
+        # (only possible for a pixel model; patch-feature models need the band stack)
+        nitrogen_pred = values.get('nitrogen')
+        if nitrogen_pred is None:
+            model = nitrogen_predictor.model
+            if model is not None and getattr(model, 'n_features_in_', 2) == 2:
+                nitrogen_pred = nitrogen_predictor.predict(np.array([[ndvi_value, ndre_value]]))[0]
+            else:
+                nitrogen_pred = 150.0
         
         # Classify growth stage (simplified)
         stage_labels = ["Vegetative", "Tuber_Initiation", "Bulking", "Maturation"]
@@ -96,7 +133,8 @@ def predict_from_gee():
             "ndre": round(float(ndre_value), 3),
             "nitrogen_kg_per_ha": round(float(nitrogen_pred), 2),
             "growth_stage": stage,
-            "nutrient_status": "low" if nitrogen_pred < 140 else ("optimal" if nitrogen_pred <= 180 else "high")
+            "nutrient_status": "low" if nitrogen_pred < 140 else ("optimal" if nitrogen_pred <= 180 else "high"),
+            "statistics": stats
         }
         
         return jsonify(response), 200
@@ -110,6 +148,8 @@ def get_recommendations():
     """
     Get zone-wise recommendations
     
+    Without "zones", the zones of the last zonal statistics run are used.
+    
     Request body:
     {
         "zones": [
@@ -124,12 +164,16 @@ def get_recommendations():
     }
     """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
-        if not data or 'zones' not in data:
-            return jsonify({"error": "Missing zones data"}), 400
+        if data and 'zones' in data:
+            zones = data['zones']
+        else:
+            latest = zonal_stats.load_latest()
+            if latest is None:
+                return jsonify({"error": "Missing zones data"}), 400
+            zones = zonal_stats.recommendation_inputs(latest['zones'])
         
-        zones = data['zones']
         recommendations = recommendation_agent.generate_zone_recommendations(zones)
         output = recommendation_agent.save_recommendations(recommendations)
         
@@ -159,41 +203,91 @@ def get_dashboard():
         return jsonify({"error": str(e)}), 500
 
 
+def run_processing_job(progress):
+    """Background job: process images and generate all outputs"""
+    progress(0.05, "Processing images")
+    results = processor.process_images()  # Also writes the nutrient map
+    
+    # Predictions would go here
+    # (simplified for API endpoint)
+    
+    return {
+        "ndvi_mean": float(np.nanmean(results['ndvi'])),
+        "ndre_mean": float(np.nanmean(results['ndre'])),
+        "nutrient_map": "Nutrient_Map_Enhanced.png",
+        "output_directory": processor.output_dir
+    }
+
+
 @app.route('/process', methods=['POST'])
 def process_images():
-    """Process images and generate all outputs"""
+    """
+    Enqueue image processing and return a job id immediately
+    
+    Poll GET /jobs/<job_id> for progress and results. Submissions for the
+    same inputs while a job is queued or running return that job.
+    """
     try:
-        # Process images
-        results = processor.process_images()
-        
-        # Generate nutrient map
-        nutrient_map = processor.create_nutrient_map(results['ndvi'])
-        
-        # Predictions would go here
-        # (simplified for API endpoint)
+        job, created = job_queue.submit(processor.input_fingerprint(), run_processing_job)
         
         response = {
-            "status": "success",
-            "message": "Images processed successfully",
-            "outputs": {
-                "ndvi_mean": float(np.nanmean(results['ndvi'])),
-                "ndre_mean": float(np.nanmean(results['ndre'])),
-                "nutrient_map": "Nutrient_Map_Enhanced.png",
-                "output_directory": processor.output_dir
-            },
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "coalesced": not created,
+            "status_url": f"/jobs/{job['job_id']}",
             "timestamp": datetime.now().isoformat()
         }
         
-        return jsonify(response), 200
+        return jsonify(response), 202
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get status, progress and result of a background job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify(job), 200
+
+
+@app.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def get_tile(layer, z, x, y):
+    """
+    XYZ web-map tile of ndvi, ndre, nutrient_map or nitrogen
+    
+    Tiles are cut on demand from the COG overviews and cached on disk;
+    a matching If-None-Match returns 304 without reading the tile.
+    """
+    try:
+        etag = tile_server.etag(layer, z, x, y)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(tile_server.tile(layer, z, x, y), mimetype='image/png')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, max-age=3600, must-revalidate'
+        return response
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/zones', methods=['GET'])
 def get_zones():
     """Get zone analysis from current processing"""
     try:
+        # Per-zone statistics when zones are configured
+        latest = zonal_stats.load_latest()
+        if latest is not None:
+            return jsonify(latest), 200
+        
         # Load latest report
         outputs_dir = "outputs"
         report_files = [f for f in os.listdir(outputs_dir) if f.startswith("weekly_report_")]
@@ -213,6 +307,32 @@ def get_zones():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/zones', methods=['POST'])
+def compute_zones():
+    """
+    Zone statistics for posted polygons, from the latest pipeline outputs
+    
+    Request body: GeoJSON FeatureCollection of (Multi)Polygons in WGS84;
+    zone ids come from the "zone_id" property (or the feature id).
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({"error": "Missing GeoJSON body"}), 400
+        
+        zones = load_zones(data, zonal_stats.id_property)
+        # Client-supplied zones are not cached: every new polygon set would add a label file
+        zone_stats = zonal_stats.from_outputs(zones, cache_labels=False)
+        return jsonify({"generated_at": datetime.now().isoformat(), "zones": zone_stats}), 200
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 if __name__ == '__main__':
     with open(config_path, 'r') as f:
         config = yaml.safe_load(f)
@@ -227,8 +347,11 @@ if __name__ == '__main__':
     print("  POST /predict-gee - Predict from GPS coordinates")
     print("  POST /recommend - Get recommendations")
     print("  GET  /dashboard - Get dashboard data")
-    print("  POST /process - Process images")
+    print("  POST /process - Enqueue image processing")
+    print("  GET  /jobs/<id> - Job status and results")
     print("  GET  /zones - Get zone analysis")
+    print("  POST /zones - Zone statistics for GeoJSON polygons")
+    print("  GET  /tiles/<layer>/<z>/<x>/<y>.png - Map tiles (ndvi, ndre, nutrient_map, nitrogen)")
     
     app.run(host=host, port=port, debug=debug)
 
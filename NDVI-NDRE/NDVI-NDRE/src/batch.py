@@ -0,0 +1,274 @@
+"""
+Batch Processing
+Run the weekly pipeline over a manifest of granules and fields on a process pool, resumably
+"""
+
+import os
+import copy
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import yaml
+
+DONE_MARKER = "_DONE"
+
+# Per-process models, loaded once by the pool initializer
+_WORKER_MODELS = None
+
+
+def load_manifest(path):
+    """
+    Granules and their fields from a YAML (or JSON) manifest
+    
+    Example:
+        output_dir: outputs/batch
+        granules:
+          - id: T43PGQ
+            r10_dir: granules/T43PGQ/R10m
+            r20_dir: granules/T43PGQ/R20m
+            fields:
+              - id: farm_012
+                zones: fields/farm_012.geojson
+    
+    Relative paths are resolved against the manifest's directory. A field
+    without "zones" is skipped after its granule has been processed.
+    
+    Raises:
+        ValueError: On missing keys or duplicate granule/field ids
+    """
+    with open(path, 'r') as f:
+        manifest = yaml.safe_load(f) or {}
+    
+    base = os.path.dirname(os.path.abspath(path))
+    
+    def resolve(value):
+        return value if os.path.isabs(value) else os.path.join(base, value)
+    
+    granules, field_ids = [], set()
+    for granule in manifest.get('granules', []):
+        for key in ('id', 'r10_dir', 'r20_dir'):
+            if key not in granule:
+                raise ValueError(f"Granule {granule.get('id', '?')} is missing '{key}'")
+        fields = []
+        for field in granule.get('fields', []):
+            if 'id' not in field:
+                raise ValueError(f"A field of granule {granule['id']} is missing 'id'")
+            if field['id'] in field_ids:
+                raise ValueError(f"Duplicate field id '{field['id']}'")
+            field_ids.add(field['id'])
+            fields.append({'id': str(field['id']),
+                           'zones': resolve(field['zones']) if field.get('zones') else None})
+        granules.append({'id': str(granule['id']),
+                         'r10_dir': resolve(granule['r10_dir']),
+                         'r20_dir': resolve(granule['r20_dir']),
+                         'fields': fields})
+    
+    if len({granule['id'] for granule in granules}) != len(granules):
+        raise ValueError("Duplicate granule ids in manifest")
+    if not granules:
+        raise ValueError(f"No granules in manifest {path}")
+    
+    manifest['granules'] = granules
+    if manifest.get('output_dir'):
+        manifest['output_dir'] = resolve(manifest['output_dir'])
+    return manifest
+
+
+def _rebase_paths(value, old, new):
+    """Copy of a config section with every path under old moved under new"""
+    if isinstance(value, dict):
+        return {key: _rebase_paths(item, old, new) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rebase_paths(item, old, new) for item in value]
+    if isinstance(value, str) and (value == old or value.startswith(old + "/")):
+        return new + value[len(old):]
+    return value
+
+
+def _write_marker(path, info):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"completed_at": datetime.now().isoformat(), **info}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _init_worker(config_path):
+    """Pool initializer: load the CNN and RF once per worker process"""
+    global _WORKER_MODELS
+    from src.models import GrowthStageClassifier, NitrogenPredictor
+    
+    stage_classifier = GrowthStageClassifier(config_path)
+    nitrogen_predictor = NitrogenPredictor(config_path)
+    stage_classifier.load_model()
+    nitrogen_predictor.load_model()
+    _WORKER_MODELS = (stage_classifier, nitrogen_predictor)
+
+
+def _run_granule(granule, granule_config_path, granule_marker, run_dir):
+    """
+    Process one granule, then write the outputs of its pending fields
+    
+    Runs in a worker process. The granule pipeline is skipped when its
+    marker exists (a crash after it finished only redoes the fields).
+    
+    Returns:
+        Dict of field id -> "completed", "skipped" or an error message
+    """
+    from main import WeeklyPipeline
+    from src.agentic_ai import RecommendationAgent
+    from src.zonal_stats import ZonalStatistics, load_zones
+    
+    if not os.path.exists(granule_marker):
+        pipeline = WeeklyPipeline(granule_config_path, models=_WORKER_MODELS)
+        report = pipeline.run_weekly_processing()
+        if report is None:
+            return {field['id']: f"failed: pipeline error in granule {granule['id']}"
+                    for field in granule['fields']}
+        _write_marker(granule_marker, {"granule": granule['id'], "date": report['date']})
+    
+    zonal = ZonalStatistics(granule_config_path)
+    agent = RecommendationAgent(granule_config_path)
+    status = {}
+    for field in granule['fields']:
+        field_dir = os.path.join(run_dir, "fields", field['id'])
+        marker = os.path.join(field_dir, DONE_MARKER)
+        if os.path.exists(marker):
+            status[field['id']] = "completed"
+            continue
+        if field['zones'] is None:
+            status[field['id']] = "skipped"
+            continue
+        
+        try:
+            os.makedirs(field_dir, exist_ok=True)
+            zone_stats = zonal.from_outputs(load_zones(field['zones'], zonal.id_property))
+            recommendations = agent.generate_zone_recommendations(
+                zonal.recommendation_inputs(zone_stats))
+            field_report = {
+                "field_id": field['id'],
+                "granule": granule['id'],
+                "generated_at": datetime.now().isoformat(),
+                "zones": zone_stats,
+                "recommendations": recommendations
+            }
+            with open(os.path.join(field_dir, "field_report.json"), 'w') as f:
+                json.dump(field_report, f, indent=2)
+            _write_marker(marker, {"field": field['id'], "granule": granule['id']})
+            status[field['id']] = "completed"
+        except Exception as e:
+            status[field['id']] = f"failed: {e}"
+    return status
+
+
+class BatchRunner:
+    """
+    Weekly pipeline over many granules and fields
+    
+    Each granule is processed once, into outputs under <output_dir>/granules/<id>
+    that persist across weeks (previous NDVI, archive, tile cache), by a
+    WeeklyPipeline built from a derived copy of config.yaml. Its fields are
+    then cut from the granule's COGs into <output_dir>/<run_id>/fields/<id>.
+    Granules run on a process pool whose workers each load the models once.
+    Completion markers make a rerun of the same run_id resume: finished
+    fields are skipped, and a granule whose fields are all done is not
+    reprocessed.
+    
+    Usage:
+        runner = BatchRunner("config.yaml", "manifest.yaml", workers=4)
+        status = runner.run()
+    """
+    
+    def __init__(self, config_path="config.yaml", manifest_path="manifest.yaml",
+                 workers=None, run_id=None):
+        with open(config_path, 'r') as f:
+            self.config = yaml.safe_load(f)
+        
+        self.config_path = config_path
+        self.manifest = load_manifest(manifest_path)
+        batch = self.config.get('batch', {})
+        self.workers = workers or batch.get('workers', 2)
+        self.output_dir = self.manifest.get('output_dir') or batch.get(
+            'output_dir', os.path.join(self.config['paths']['output_dir'], "batch"))
+        self.run_id = str(run_id or self.manifest.get('run_id') or datetime.now().strftime("%Y%m%d"))
+        self.run_dir = os.path.join(self.output_dir, self.run_id)
+    
+    def granule_config(self, granule):
+        """
+        Write the config of one granule and return its path
+        
+        Paths under the base output_dir (outputs, tile cache, archive, tile
+        and label caches) move into the granule's directory; zones are cut
+        per field instead of per granule.
+        """
+        granule_dir = os.path.join(self.output_dir, "granules", granule['id'])
+        os.makedirs(granule_dir, exist_ok=True)
+        
+        config = _rebase_paths(copy.deepcopy(self.config),
+                               self.config['paths']['output_dir'].rstrip("/"), granule_dir)
+        config['paths']['r10_dir'] = granule['r10_dir']
+        config['paths']['r20_dir'] = granule['r20_dir']
+        config.setdefault('zones', {})['geojson'] = None
+        
+        path = os.path.join(granule_dir, "config.yaml")
+        with open(path, 'w') as f:
+            yaml.safe_dump(config, f, sort_keys=False)
+        return path
+    
+    def _granule_marker(self, granule):
+        return os.path.join(self.run_dir, "granules", f"{granule['id']}{DONE_MARKER}")
+    
+    def pending(self):
+        """Granules not processed yet or with fields not completed in this run"""
+        pending = []
+        for granule in self.manifest['granules']:
+            processed = os.path.exists(self._granule_marker(granule))
+            # Fields without zones have nothing to do once their granule is processed
+            fields = [field for field in granule['fields']
+                      if not (processed and field['zones'] is None) and not os.path.exists(
+                          os.path.join(self.run_dir, "fields", field['id'], DONE_MARKER))]
+            if fields or not processed:
+                pending.append({**granule, 'fields': fields})
+        return pending
+    
+    def run(self):
+        """
+        Process every pending granule and field
+        
+        Returns:
+            Dict of field id -> status ("completed", "skipped" or the error),
+            also written to <run_dir>/batch_status.json
+        """
+        os.makedirs(os.path.join(self.run_dir, "granules"), exist_ok=True)
+        status = {field['id']: "completed" if field['zones'] else "skipped"
+                  for granule in self.manifest['granules'] for field in granule['fields']}
+        
+        pending = self.pending()
+        print(f"Batch {self.run_id}: {len(pending)} of {len(self.manifest['granules'])} "
+              f"granules pending, {self.workers} workers")
+        
+        # spawn: workers start clean instead of forking TensorFlow state
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(self.config_path,)) as pool:
+            futures = {pool.submit(_run_granule, granule, self.granule_config(granule),
+                                   self._granule_marker(granule), self.run_dir): granule
+                       for granule in pending}
+            for future in as_completed(futures):
+                granule = futures[future]
+                try:
+                    status.update(future.result())
+                    print(f"Granule {granule['id']} done")
+                except Exception as e:
+                    print(f"Error in granule {granule['id']}: {e}")
+                    status.update({field['id']: f"failed: {e}" for field in granule['fields']})
+        
+        failed = [field_id for field_id, state in status.items() if state.startswith("failed")]
+        summary = {"run_id": self.run_id, "finished_at": datetime.now().isoformat(),
+                   "failed": len(failed), "fields": status}
+        with open(os.path.join(self.run_dir, "batch_status.json"), 'w') as f:
+            json.dump(summary, f, indent=2)
+        
+        print(f"Batch {self.run_id} finished: {len(status) - len(failed)} fields ok "
+              f"(without zones: {list(status.values()).count('skipped')}), {len(failed)} failed")
+        return status
@@ -0,0 +1,214 @@
+"""
+Lightweight CNN Runtime
+Exports the growth stage CNN to TFLite/ONNX and serves it without importing TensorFlow
+"""
+
+import os
+import numpy as np
+
+TFLITE_QUANTIZATIONS = ('float32', 'float16', 'int8')
+
+
+def _tflite_interpreter_class():
+    """Smallest available TFLite interpreter (tflite_runtime, LiteRT, then tf.lite)"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf  # full TensorFlow as a last resort
+    return tf.lite.Interpreter
+
+
+def export_tflite(keras_model, path, quantization='float16', representative_data=None):
+    """
+    Convert a Keras model to TFLite with post-training quantization
+    
+    Args:
+        keras_model: Trained Keras model
+        path: Output .tflite path
+        quantization: 'float32' (no quantization), 'float16' (weights) or
+            'int8' (weights and activations, calibrated)
+        representative_data: (N, H, W, C) calibration patches, required for int8
+    
+    Returns:
+        Path of the written model
+    """
+    import tensorflow as tf
+    
+    if quantization not in TFLITE_QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantization}'. Use one of {TFLITE_QUANTIZATIONS}")
+    
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if representative_data is None:
+            raise ValueError("int8 quantization needs representative_data for calibration")
+        calibration = np.asarray(representative_data, dtype=np.float32)
+        
+        def representative_dataset():
+            for i in range(len(calibration)):
+                yield [calibration[i:i + 1]]
+        
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        # Integer kernels throughout; float input/output are (de)quantized at the edges
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+    
+    return path
+
+
+def export_onnx(keras_model, path, opset=13):
+    """
+    Convert a Keras model to ONNX (requires tf2onnx)
+    
+    Returns:
+        Path of the written model
+    """
+    import tensorflow as tf
+    import tf2onnx
+    
+    input_shape = (None,) + tuple(keras_model.inputs[0].shape[1:])
+    
+    if hasattr(keras_model, 'export'):
+        # Keras 3: native exporter (tf2onnx underneath); needs a called model
+        keras_model(np.zeros((1,) + input_shape[1:], dtype=np.float32))
+        keras_model.export(path, format='onnx')
+    else:
+        signature = (tf.TensorSpec(input_shape, tf.float32, name="patches"),)
+        tf2onnx.convert.from_keras(keras_model, input_signature=signature,
+                                   opset=opset, output_path=path)
+    return path
+
+
+class LiteClassifier:
+    """
+    Exported CNN behind the same predict() interface as the Keras model
+    
+    .tflite files run on the TFLite interpreter (tflite_runtime when
+    installed), .onnx files on onnxruntime. Neither imports TensorFlow
+    unless no standalone TFLite interpreter is available.
+    """
+    
+    def __init__(self, path, num_threads=None):
+        """
+        Args:
+            path: Exported .tflite or .onnx model
+            num_threads: CPU threads for the interpreter (None = runtime default)
+        """
+        self.path = path
+        self.num_threads = num_threads
+        self.format = os.path.splitext(path)[1].lstrip('.').lower()
+        
+        if self.format == 'tflite':
+            self.interpreter = _tflite_interpreter_class()(model_path=path, num_threads=num_threads)
+            self.input_index = self.interpreter.get_input_details()[0]['index']
+            self.output_index = self.interpreter.get_output_details()[0]['index']
+            self.input_shape = tuple(self.interpreter.get_input_details()[0]['shape'])
+            self._batch_size = None
+        elif self.format == 'onnx':
+            import onnxruntime as ort
+            
+            options = ort.SessionOptions()
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+            self.session = ort.InferenceSession(path, sess_options=options,
+                                                providers=['CPUExecutionProvider'])
+            self.input_name = self.session.get_inputs()[0].name
+            self.input_shape = tuple(self.session.get_inputs()[0].shape)
+        else:
+            raise ValueError(f"Unsupported model format: {path}")
+    
+    def _run_tflite(self, batch):
+        """Run one batch, resizing the interpreter input when the batch size changes"""
+        if self._batch_size != len(batch):
+            self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(batch)
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+    
+    def predict(self, X, batch_size=32, verbose=0):
+        """
+        Class probabilities for a batch of patches
+        
+        Args:
+            X: (N, H, W, C) patches
+            batch_size: Patches per interpreter call; a short final batch
+                is zero-padded so the interpreter keeps one allocation
+            verbose: Accepted for Keras compatibility, ignored
+        
+        Returns:
+            (N, num_classes) float32 probabilities
+        """
+        X = np.asarray(X, dtype=np.float32)
+        outputs = []
+        
+        for start in range(0, len(X), batch_size):
+            batch = X[start:start + batch_size]
+            n = len(batch)
+            if self.format == 'tflite' and n < batch_size and len(X) > batch_size:
+                padded = np.zeros((batch_size,) + batch.shape[1:], dtype=np.float32)
+                padded[:n] = batch
+                batch = padded
+            batch = np.ascontiguousarray(batch)
+            
+            if self.format == 'tflite':
+                probs = self._run_tflite(batch)
+            else:
+                probs = self.session.run(None, {self.input_name: batch})[0]
+            outputs.append(np.asarray(probs[:n], dtype=np.float32))
+        
+        return np.concatenate(outputs) if outputs else np.empty((0, 0), dtype=np.float32)
+
+
+def compare_models(reference, candidates, X, y=None, batch_size=32):
+    """
+    Accuracy deltas of exported models against the Keras model
+    
+    Args:
+        reference: Keras model
+        candidates: Dict of name -> LiteClassifier
+        X: (N, H, W, C) evaluation patches
+        y: Optional integer labels; accuracy is reported when given
+        batch_size: Inference batch size
+    
+    Returns:
+        Dict of name -> metrics (agreement with Keras, max probability
+        difference, accuracy and accuracy delta)
+    """
+    reference_probs = reference.predict(X, batch_size=batch_size, verbose=0)
+    reference_labels = np.argmax(reference_probs, axis=1)
+    reference_accuracy = float(np.mean(reference_labels == y)) if y is not None else None
+    
+    report = {"keras": {"accuracy": reference_accuracy}}
+    for name, model in candidates.items():
+        probs = model.predict(X, batch_size=batch_size)
+        labels = np.argmax(probs, axis=1)
+        metrics = {
+            "agreement": float(np.mean(labels == reference_labels)),
+            "max_prob_diff": float(np.max(np.abs(probs - reference_probs))),
+            "size_mb": round(os.path.getsize(model.path) / 1e6, 3)
+        }
+        if y is not None:
+            metrics["accuracy"] = float(np.mean(labels == y))
+            metrics["accuracy_delta"] = metrics["accuracy"] - reference_accuracy
+        report[name] = metrics
+        
+        delta = f", accuracy delta {metrics['accuracy_delta']:+.4f}" if y is not None else ""
+        print(f"  {name}: agreement {metrics['agreement']:.4f}, "
+              f"max prob diff {metrics['max_prob_diff']:.4f}{delta} ({metrics['size_mb']} MB)")
+    
+    return report
@@ -0,0 +1,101 @@
+"""
+Cloud-Optimized GeoTIFF Writer
+Writes georeferenced, tiled, compressed rasters with internal overview pyramids
+"""
+
+import os
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+
+def overview_levels(height, width, blocksize=512):
+    """Decimation factors (2, 4, 8, ...) until the overview fits in one block"""
+    levels = []
+    factor = 2
+    while max(height, width) / factor >= blocksize / 2:
+        levels.append(factor)
+        factor *= 2
+    return levels
+
+
+def write_cog(path, array, transform, crs, nodata=None, blocksize=512,
+              compress="deflate", resampling="average"):
+    """
+    Write a 2D array as a Cloud-Optimized GeoTIFF
+    
+    The array is written one strip of blocks at a time, so memory-mapped
+    inputs are never loaded whole. Overviews are built on a temporary tiled
+    GTiff, which is then copied with its overviews into COG layout (overview
+    IFDs first, tiles ordered), so range reads and zoomed-out views only
+    touch the blocks they need.
+    
+    Args:
+        path: Output .tif path
+        array: (H, W) numpy array or memmap
+        transform: Affine transform of the array grid
+        crs: Coordinate reference system
+        nodata: Nodata value (NaN for float rasters by default)
+        blocksize: Internal tile edge in pixels
+        compress: GDAL compression (deflate, lzw, zstd, ...)
+        resampling: Overview resampling ('average' for continuous data,
+            'nearest' or 'mode' for class maps)
+    
+    Returns:
+        Path of the written COG
+    """
+    height, width = array.shape
+    dtype = np.dtype(array.dtype)
+    if dtype == np.float64:
+        dtype = np.dtype(np.float32)
+    if nodata is None and np.issubdtype(dtype, np.floating):
+        nodata = np.nan
+    
+    profile = {
+        'driver': 'GTiff',
+        'height': height,
+        'width': width,
+        'count': 1,
+        'dtype': dtype.name,
+        'crs': crs,
+        'transform': transform,
+        'nodata': nodata,
+        'tiled': True,
+        'blockxsize': blocksize,
+        'blockysize': blocksize,
+        'compress': compress,
+        # Floating point predictor compresses smooth index rasters much better
+        'predictor': 3 if np.issubdtype(dtype, np.floating) else 2,
+    }
+    
+    tmp_path = f"{path}.tmp.tif"
+    with rasterio.open(tmp_path, 'w', **profile) as dst:
+        for row_off in range(0, height, blocksize):
+            rows = min(blocksize, height - row_off)
+            strip = np.asarray(array[row_off:row_off + rows], dtype=dtype)
+            dst.write(strip, 1, window=Window(0, row_off, width, rows))
+        
+        levels = overview_levels(height, width, blocksize)
+        if levels:
+            dst.build_overviews(levels, Resampling[resampling])
+            dst.update_tags(ns='rio_overview', resampling=resampling)
+    
+    # Copy next to the target and swap it in, so readers of path (tile
+    # server, raster lookups, zonal statistics) never see a partial file
+    cog_path = f"{path}.cog.tmp.tif"
+    rasterio.shutil.copy(
+        tmp_path, cog_path,
+        driver='GTiff',
+        tiled=True,
+        blockxsize=blocksize,
+        blockysize=blocksize,
+        compress=compress,
+        predictor=profile['predictor'],
+        copy_src_overviews=True
+    )
+    os.remove(tmp_path)
+    os.replace(cog_path, path)
+    
+    return path
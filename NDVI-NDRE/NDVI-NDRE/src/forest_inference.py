@@ -0,0 +1,437 @@
+"""
+Array-native Random Forest Inference
+Flattens a fitted sklearn forest into NumPy node arrays and evaluates it over large pixel batches
+"""
+
+import os
+import json
+import shutil
+import time
+from datetime import datetime
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+# On-disk artifact layout (see FlatForest.save); bump when it changes
+ARTIFACT_FORMAT = "flat-forest"
+ARTIFACT_VERSION = 1
+ARTIFACT_ARRAYS = ('feature', 'threshold', 'children', 'value', 'roots', 'depths')
+
+# Rows walked in lockstep by the compiled kernel. Interleaving independent
+# rows overlaps their node fetches instead of stalling on each one.
+LOCKSTEP_ROWS = 16
+
+
+if NUMBA_AVAILABLE:
+    @njit(nogil=True, cache=True)
+    def _traverse_compiled(X, feature, threshold, children, value, roots, depths, out):
+        """Compiled traversal, one tree at a time so its nodes stay in cache"""
+        n = X.shape[0]
+        nodes = np.empty(LOCKSTEP_ROWS, dtype=np.int64)
+        out[:] = 0.0
+        for t in range(roots.shape[0]):
+            for start in range(0, n, LOCKSTEP_ROWS):
+                rows = min(LOCKSTEP_ROWS, n - start)
+                nodes[:rows] = roots[t]
+                for _ in range(depths[t]):
+                    for j in range(rows):
+                        node = nodes[j]
+                        nodes[j] = children[2 * node + (X[start + j, feature[node]] > threshold[node])]
+                for j in range(rows):
+                    out[start + j] += value[nodes[j]]
+        out /= roots.shape[0]
+
+
+class FlatForest:
+    """
+    Random Forest regressor stored as flat node arrays
+    
+    All trees are concatenated into one set of arrays (feature, threshold,
+    children, value); `roots` holds the index of each tree's root node and
+    `depths` its depth. `children` interleaves (left, right) per node, and
+    leaves point to themselves so every tree is walked for exactly `depth`
+    steps.
+    
+    Two traversal kernels are available: a compiled kernel walking small
+    blocks of rows in lockstep (needs numba) and a pure NumPy kernel that
+    advances all rows of a chunk one tree level at a time.
+    
+    Predictions are bit-identical to RandomForestRegressor.predict evaluated
+    with n_jobs=1: features are compared as float32 against float64
+    thresholds, and per-tree values are summed in tree order in float64
+    before dividing by the number of trees. (With n_jobs > 1 sklearn sums
+    trees in completion order, which can differ in the last ulp.)
+    """
+    
+    def __init__(self, feature, threshold, children, value, roots, depths,
+                 n_features, n_threads=1, chunk_size=65536, backend="auto"):
+        """
+        Args:
+            feature, threshold, value: Concatenated per-node arrays
+            children: Interleaved (left, right) child indices, 2 per node
+            roots: Root node index of each tree
+            depths: Depth of each tree
+            n_features: Number of input features
+            n_threads: Threads used by predict()
+            chunk_size: Rows evaluated per work item
+            backend: 'numba', 'numpy' or 'auto' (numba when installed)
+        """
+        if backend == "auto":
+            backend = "numba" if NUMBA_AVAILABLE else "numpy"
+        if backend == "numba" and not NUMBA_AVAILABLE:
+            print("Warning: numba not available. Using NumPy forest traversal.")
+            backend = "numpy"
+        if backend not in ("numba", "numpy"):
+            raise ValueError(f"Unknown forest backend '{backend}'")
+        
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.depths = depths
+        self.n_features_in_ = int(n_features)
+        self.n_threads = n_threads
+        self.chunk_size = chunk_size
+        self.backend = backend
+    
+    @classmethod
+    def from_sklearn(cls, model, **kwargs):
+        """
+        Convert a fitted RandomForestRegressor
+        
+        Args:
+            model: Fitted sklearn RandomForestRegressor (single output)
+            **kwargs: n_threads / chunk_size / backend, see __init__
+        
+        Returns:
+            FlatForest
+        """
+        if getattr(model, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output forests are supported")
+        
+        features, thresholds, children, values, roots, depths = [], [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left == -1
+            nodes = np.arange(offset, offset + tree.node_count)
+            
+            roots.append(offset)
+            depths.append(tree.max_depth)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold.astype(np.float64))
+            pairs = np.empty((tree.node_count, 2), dtype=np.int64)
+            pairs[:, 0] = np.where(is_leaf, nodes, tree.children_left + offset)
+            pairs[:, 1] = np.where(is_leaf, nodes, tree.children_right + offset)
+            children.append(pairs.ravel())
+            values.append(tree.value[:, 0, 0].astype(np.float64))
+            offset += tree.node_count
+        
+        return cls(
+            feature=np.concatenate(features).astype(np.int64),
+            threshold=np.concatenate(thresholds),
+            children=np.concatenate(children),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int64),
+            depths=np.asarray(depths, dtype=np.int32),
+            n_features=model.n_features_in_,
+            **kwargs
+        )
+    
+    @property
+    def n_trees(self):
+        return len(self.roots)
+    
+    @property
+    def n_nodes(self):
+        return len(self.value)
+    
+    def save(self, path, metadata=None):
+        """
+        Write the forest as a versioned artifact directory
+        
+        Layout: `manifest.json` plus one uncompressed `.npy` file per node
+        array, so load() can memory-map them. The directory is written next
+        to `path` and swapped in, so readers never see a half-written
+        artifact.
+        
+        Args:
+            path: Artifact directory (e.g. models/nitrogen_rf)
+            metadata: Extra JSON-serialisable fields for the manifest
+        
+        Returns:
+            Artifact path
+        """
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        
+        arrays = {}
+        for name in ARTIFACT_ARRAYS:
+            array = np.ascontiguousarray(getattr(self, name))
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+            arrays[name] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+        
+        manifest = {
+            "format": ARTIFACT_FORMAT,
+            "version": ARTIFACT_VERSION,
+            "n_trees": self.n_trees,
+            "n_nodes": self.n_nodes,
+            "n_features": self.n_features_in_,
+            "arrays": arrays,
+            "created_at": datetime.now().isoformat(),
+            "metadata": metadata or {}
+        }
+        with open(os.path.join(tmp_path, "manifest.json"), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        
+        old_path = f"{path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        
+        return path
+    
+    @staticmethod
+    def read_manifest(path):
+        """
+        Manifest of an artifact directory
+        
+        Raises:
+            ValueError: If the directory is not a flat-forest artifact of a
+                supported version
+        """
+        with open(os.path.join(path, "manifest.json"), 'r') as f:
+            manifest = json.load(f)
+        
+        if manifest.get("format") != ARTIFACT_FORMAT:
+            raise ValueError(f"{path} is not a {ARTIFACT_FORMAT} artifact")
+        if manifest.get("version") != ARTIFACT_VERSION:
+            raise ValueError(f"Unsupported {ARTIFACT_FORMAT} artifact version "
+                             f"{manifest.get('version')} (expected {ARTIFACT_VERSION})")
+        return manifest
+    
+    @classmethod
+    def load(cls, path, mmap=True, **kwargs):
+        """
+        Load an artifact written by save()
+        
+        With mmap=True the node arrays are memory-mapped read-only: loading
+        costs a few file opens, and processes serving the same model share
+        one copy through the page cache.
+        
+        Args:
+            path: Artifact directory
+            mmap: Memory-map the arrays instead of reading them
+            **kwargs: n_threads / chunk_size / backend, see __init__
+        
+        Returns:
+            FlatForest
+        """
+        manifest = cls.read_manifest(path)
+        
+        arrays = {}
+        for name, spec in manifest["arrays"].items():
+            array = np.load(os.path.join(path, f"{name}.npy"),
+                            mmap_mode='r' if mmap else None)
+            if array.dtype.str != spec["dtype"] or list(array.shape) != spec["shape"]:
+                raise ValueError(f"Artifact array {name}.npy does not match the manifest")
+            arrays[name] = array
+        
+        return cls(n_features=manifest["n_features"], **arrays, **kwargs)
+    
+    def _predict_chunk_numpy(self, X, out):
+        """Evaluate all trees over one chunk of rows, one level at a time"""
+        n = X.shape[0]
+        columns = np.ascontiguousarray(X.T).ravel()  # feature-major: index = f * n + row
+        rows = np.arange(n, dtype=np.intp)
+        
+        total = np.zeros(n, dtype=np.float64)
+        node = np.empty(n, dtype=np.intp)
+        flat_index = np.empty(n, dtype=np.intp)
+        x = np.empty(n, dtype=np.float32)
+        threshold = np.empty(n, dtype=np.float64)
+        go_right = np.empty(n, dtype=bool)
+        
+        for root, depth in zip(self.roots, self.depths):
+            node.fill(root)
+            for _ in range(depth):
+                np.take(self.feature, node, out=flat_index)
+                flat_index *= n
+                flat_index += rows
+                np.take(columns, flat_index, out=x)
+                np.take(self.threshold, node, out=threshold)
+                np.greater(x, threshold, out=go_right)
+                np.multiply(node, 2, out=flat_index)
+                flat_index += go_right
+                np.take(self.children, flat_index, out=node)
+            total += self.value[node]
+        
+        np.divide(total, self.n_trees, out=out)
+    
+    def _predict_chunk(self, X, out):
+        if self.backend == "numba":
+            _traverse_compiled(X, self.feature, self.threshold, self.children, self.value,
+                               self.roots, self.depths, out)
+        else:
+            self._predict_chunk_numpy(X, out)
+    
+    def predict(self, X, n_threads=None):
+        """
+        Predict for a (N, n_features) batch
+        
+        Rows are split into chunks (bounding temporaries) that are evaluated
+        on a thread pool; both kernels release the GIL while traversing.
+        
+        Args:
+            X: Feature matrix; NaN inputs are not supported, mask them first
+            n_threads: Override the configured thread count
+        
+        Returns:
+            (N,) float64 predictions
+        """
+        # sklearn validates X to float32 before traversing its trees
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected X with {self.n_features_in_} features, got shape {X.shape}")
+        
+        n = X.shape[0]
+        n_threads = n_threads or self.n_threads
+        starts = range(0, n, self.chunk_size)
+        out = np.empty(n, dtype=np.float64)
+        
+        def run(start):
+            stop = start + self.chunk_size
+            self._predict_chunk(X[start:stop], out[start:stop])
+        
+        if n_threads > 1 and len(starts) > 1:
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                list(pool.map(run, starts))
+        else:
+            for start in starts:
+                run(start)
+        
+        return out
+
+
+def benchmark(model, row_counts, n_threads=1, backend="auto", batch_rows=1_000_000, seed=42):
+    """
+    Compare sklearn and FlatForest inference throughput
+    
+    Rows are generated and scored in batches of batch_rows so that 100M-row
+    runs fit in memory. The first batch of every run is checked for exact
+    agreement between the backends.
+    
+    Args:
+        model: Fitted RandomForestRegressor
+        row_counts: Iterable of total row counts (e.g. [1_000_000, 100_000_000])
+        n_threads: Threads for the flat backend
+        backend: Flat traversal kernel ('numba', 'numpy' or 'auto')
+        batch_rows: Rows generated and scored per batch
+    
+    Returns:
+        List of result dicts
+    """
+    flat = FlatForest.from_sklearn(model, n_threads=n_threads, backend=backend)
+    # Compile (numba) outside the timed region
+    flat.predict(np.zeros((1, flat.n_features_in_), dtype=np.float32))
+    rng = np.random.default_rng(seed)
+    results = []
+    
+    for total_rows in row_counts:
+        timings = {'sklearn': 0.0, 'flat': 0.0}
+        identical = None
+        done = 0
+        
+        while done < total_rows:
+            rows = min(batch_rows, total_rows - done)
+            X = rng.random((rows, flat.n_features_in_), dtype=np.float32)
+            
+            start = time.perf_counter()
+            expected = model.predict(X)
+            timings['sklearn'] += time.perf_counter() - start
+            
+            start = time.perf_counter()
+            predicted = flat.predict(X)
+            timings['flat'] += time.perf_counter() - start
+            
+            if identical is None:
+                identical = bool(np.array_equal(expected, predicted))
+                max_abs_diff = float(np.max(np.abs(expected - predicted)))
+            done += rows
+        
+        result = {
+            'rows': total_rows,
+            'sklearn_seconds': round(timings['sklearn'], 3),
+            'flat_seconds': round(timings['flat'], 3),
+            'speedup': round(timings['sklearn'] / timings['flat'], 2),
+            'identical': identical,
+            'max_abs_diff': max_abs_diff
+        }
+        print(f"{total_rows:>12,} rows | sklearn {result['sklearn_seconds']:9.2f}s | "
+              f"flat {result['flat_seconds']:9.2f}s | x{result['speedup']:.2f} | "
+              f"identical: {identical} (max diff {max_abs_diff:.2e})")
+        results.append(result)
+    
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import pickle
+    import yaml
+    
+    parser = argparse.ArgumentParser(description="Benchmark sklearn vs flat Random Forest inference")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 100_000_000],
+                        help="Row counts to score")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1,
+                        help="Threads for the flat backend")
+    parser.add_argument("--backend", type=str, default="auto", choices=["auto", "numba", "numpy"],
+                        help="Flat traversal kernel")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Config file")
+    parser.add_argument("--export", action="store_true",
+                        help="Convert the trained pickle into the flat artifact and exit")
+    
+    args = parser.parse_args()
+    
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    rf_config = config['models']['random_forest']
+    
+    if args.export:
+        with open(rf_config['model_path'], 'rb') as f:
+            model = pickle.load(f)
+        artifact_path = FlatForest.from_sklearn(model).save(
+            rf_config['artifact_path'], metadata={"source": rf_config['model_path']})
+        print(f"Saved flat forest artifact to {artifact_path}")
+        raise SystemExit(0)
+    
+    if os.path.exists(rf_config['model_path']):
+        print(f"Loading {rf_config['model_path']}")
+        with open(rf_config['model_path'], 'rb') as f:
+            model = pickle.load(f)
+    else:
+        from sklearn.ensemble import RandomForestRegressor
+        
+        print("Trained model not found. Fitting a synthetic NDVI/NDRE forest...")
+        rng = np.random.default_rng(42)
+        X = rng.uniform(0, 1, size=(20000, 2))
+        y = 100 + 80 * X[:, 0] + 20 * X[:, 1] + rng.normal(0, 10, 20000)
+        model = RandomForestRegressor(n_estimators=rf_config['n_estimators'],
+                                      max_depth=rf_config['max_depth'],
+                                      random_state=42, n_jobs=-1).fit(X, y)
+    
+    print("="*50)
+    print(f"Random Forest inference benchmark ({len(model.estimators_)} trees, "
+          f"{args.threads} flat threads, {args.backend} backend)")
+    print("="*50)
+    benchmark(model, args.rows, n_threads=args.threads, backend=args.backend)
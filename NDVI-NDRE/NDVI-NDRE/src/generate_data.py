@@ -8,55 +8,157 @@ import pandas as pd
 import numpy as np
 import os
 from pathlib import Path
+from numpy.lib.format import open_memmap
+from src.shards import ShardWriter
+from src.indices import BAND_SPECS
 
-def generate_synthetic_soil_data(n_samples=200, output_path="data/synthetic_soil_data.csv"):
+try:
+    import pyarrow  # Parquet engine for pandas
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+GROWTH_STAGES = ['Vegetative', 'Tuber Initiation', 'Bulking']
+
+SOIL_DATA_NAME = "synthetic_soil_data"
+
+# Column types of the soil table (Parquet stores them as-is; CSV is parsed into them)
+SOIL_DTYPES = {
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'growth_stage': pd.CategoricalDtype(GROWTH_STAGES),
+    'pH': 'float32',
+    'N': 'int16',
+    'P': 'int16',
+    'K': 'int16',
+    'NDVI': 'float32',
+    'NDRE': 'float32'
+}
+
+# Stage-specific NPK ranges in kg/ha, [low, high) (based on ICAR 2023-24)
+NPK_RANGES = {
+    'N': [(60, 100), (100, 140), (140, 200)],
+    'P': [(30, 50), (40, 60), (50, 80)],
+    'K': [(50, 80), (70, 100), (90, 140)]
+}
+
+# Bands per patch, in the order of the pipeline's stacked_bands.npy
+# (B02, B03, B04, B08, B05, B11, B12), so models see the same layout in training
+N_BANDS = len(BAND_SPECS)
+
+
+def assign_npk(stage_codes, rng):
+    """
+    Assign NPK values based on growth stage
+    
+    Args:
+        stage_codes: Integer growth stage codes (index into GROWTH_STAGES)
+        rng: np.random.Generator
+    
+    Returns:
+        Dict of nutrient -> int64 array
+    """
+    npk = {}
+    for nutrient, ranges in NPK_RANGES.items():
+        low, high = np.array(ranges).T
+        npk[nutrient] = rng.integers(low[stage_codes], high[stage_codes])
+    return npk
+
+
+def load_soil_data(data_dir="data", columns=None):
+    """
+    Load the synthetic soil table written by generate_synthetic_soil_data
+    
+    The most recently written of synthetic_soil_data.parquet / .csv is read.
+    Only the requested columns are loaded; Parquet reads just those column
+    chunks, with types and the categorical growth_stage preserved.
+    
+    Args:
+        data_dir: Data directory
+        columns: Columns to load (defaults to all)
+    
+    Returns:
+        DataFrame, or None if no soil data exists
+    
+    Raises:
+        ValueError: If growth_stage holds stages not in GROWTH_STAGES
+    """
+    candidates = [os.path.join(data_dir, f"{SOIL_DATA_NAME}.{ext}") for ext in ('parquet', 'csv')]
+    candidates = [path for path in candidates if os.path.exists(path)]
+    if not PARQUET_AVAILABLE:
+        candidates = [path for path in candidates if not path.endswith('.parquet')]
+    if not candidates:
+        return None
+    
+    path = max(candidates, key=os.path.getmtime)
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        # growth_stage is read as text so unknown stages can be reported
+        dtypes = {column: dtype for column, dtype in SOIL_DTYPES.items()
+                  if (columns is None or column in columns) and column != 'growth_stage'}
+        df = pd.read_csv(path, usecols=columns, dtype={**dtypes, 'growth_stage': str})
+    
+    if 'growth_stage' in df:
+        # Codes follow GROWTH_STAGES whatever categories the file stored;
+        # an unknown stage would get code -1 and silently train as the last class
+        known = df['growth_stage'].isin(GROWTH_STAGES)
+        if not known.all():
+            unknown = sorted(df['growth_stage'][~known].astype(str).unique())
+            raise ValueError(f"Unknown growth stages in {path}: {unknown} "
+                             f"(expected {GROWTH_STAGES})")
+        df['growth_stage'] = df['growth_stage'].astype(SOIL_DTYPES['growth_stage'])
+    return df
+
+
+def generate_synthetic_soil_data(n_samples=200, output_path="data/synthetic_soil_data.csv", seed=42):
     """
     Generate synthetic soil and crop data for training
     
     Args:
         n_samples: Number of samples to generate
-        output_path: Path to save the CSV file
+        output_path: Path to save the data; a .parquet extension writes
+            typed columnar Parquet, anything else CSV
+        seed: Random seed (the same seed always gives the same data)
     
     Returns:
         DataFrame with synthetic data
     """
     print(f"Generating {n_samples} synthetic data samples...")
     
-    # Set random seed for reproducibility
-    np.random.seed(42)
+    rng = np.random.default_rng(seed)
+    stage_codes = rng.integers(0, len(GROWTH_STAGES), n_samples)
     
     # Generate base data
     data = {
-        'latitude': np.round(11.25 + np.random.uniform(0, 0.1, n_samples), 4),
-        'longitude': np.round(78.15 + np.random.uniform(0, 0.1, n_samples), 4),
-        'growth_stage': np.random.choice(['Vegetative', 'Tuber Initiation', 'Bulking'], n_samples),
-        'pH': np.round(np.random.uniform(5.5, 7.5, n_samples), 1)
+        'latitude': np.round(11.25 + rng.uniform(0, 0.1, n_samples), 4),
+        'longitude': np.round(78.15 + rng.uniform(0, 0.1, n_samples), 4),
+        'growth_stage': pd.Categorical.from_codes(stage_codes, categories=GROWTH_STAGES),
+        'pH': np.round(rng.uniform(5.5, 7.5, n_samples), 1)
     }
     
     df = pd.DataFrame(data)
     
-    # Stage-specific NPK (based on ICAR 2023-24)
-    def assign_npk(stage):
-        """Assign NPK values based on growth stage"""
-        if stage == 'Vegetative':
-            return np.random.randint(60, 100), np.random.randint(30, 50), np.random.randint(50, 80)
-        if stage == 'Tuber Initiation':
-            return np.random.randint(100, 140), np.random.randint(40, 60), np.random.randint(70, 100)
-        # Bulking
-        return np.random.randint(140, 200), np.random.randint(50, 80), np.random.randint(90, 140)
-    
     # Assign NPK values
-    df[['N', 'P', 'K']] = df['growth_stage'].apply(lambda x: pd.Series(assign_npk(x)))
+    for nutrient, values in assign_npk(stage_codes, rng).items():
+        df[nutrient] = values
     
     # NDVI/NDRE correlation with Nitrogen
-    df['NDVI'] = np.round(0.2 + (df['N'] / 200) * 0.6 + np.random.uniform(-0.1, 0.1, n_samples), 2)
-    df['NDRE'] = np.round(df['NDVI'] * 0.8 + np.random.uniform(-0.1, 0.1, n_samples), 2)
+    df['NDVI'] = np.round(0.2 + (df['N'] / 200) * 0.6 + rng.uniform(-0.1, 0.1, n_samples), 2)
+    df['NDRE'] = np.round(df['NDVI'] * 0.8 + rng.uniform(-0.1, 0.1, n_samples), 2)
+    df = df.astype(SOIL_DTYPES)
     
     # Ensure output directory exists
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    
+    if output_path.endswith('.parquet') and not PARQUET_AVAILABLE:
+        print("Warning: pyarrow not available. Writing CSV instead of Parquet.")
+        output_path = os.path.splitext(output_path)[0] + '.csv'
     
-    # Save to CSV
-    df.to_csv(output_path, index=False)
+    if output_path.endswith('.parquet'):
+        df.to_parquet(output_path, index=False)
+    else:
+        df.to_csv(output_path, index=False)
     
     print(f"[OK] Synthetic data saved to: {output_path}")
     print(f"\nData Summary:")
@@ -73,84 +175,119 @@ def generate_synthetic_soil_data(n_samples=200, output_path="data/synthetic_soil
     return df
 
 
-def generate_patch_dataset(n_samples=200, patch_size=64, output_dir="data"):
+def fill_patches(out, ndvi, stage_codes, rng):
+    """
+    Fill a preallocated (n, H, W, N_BANDS) buffer with synthetic Sentinel-2 patches
+    
+    Bands are uniform DNs in [0, 10000) scaled per patch: NIR (B08) rises and
+    Red (B04) falls with NDVI, Green (B03) is boosted in the Vegetative stage
+    and Red Edge (B05) in Bulking. Channels follow ImageProcessor.BAND_SPECS.
+    Patches with NaN NDVI are left unadjusted.
+    
+    Args:
+        out: float32 or uint16 array (or memmap slice) to fill in place
+        ndvi: (n,) NDVI per patch
+        stage_codes: (n,) growth stage codes
+        rng: np.random.Generator
+    """
+    scale = np.full((len(out), out.shape[-1]), 10000, dtype=np.float32)
+    adjusted = ~np.isnan(ndvi)
+    scale[adjusted, 3] *= 1 + ndvi[adjusted] * 2
+    scale[adjusted, 2] *= 1 - ndvi[adjusted] * 0.5
+    scale[adjusted & (stage_codes == 0), 1] *= 1.2
+    scale[adjusted & (stage_codes == 2), 4] *= 1.3
+    
+    if out.dtype == np.float32:
+        rng.random(dtype=np.float32, out=out)
+        out *= scale[:, None, None, :]
+    else:
+        values = rng.random(out.shape, dtype=np.float32)
+        values *= scale[:, None, None, :]
+        np.rint(values, out=values)
+        out[...] = values
+
+
+def generate_patch_dataset(n_samples=200, patch_size=64, output_dir="data", seed=42,
+                           dtype="float32", chunk_size=1024, shard_size=None):
     """
     Generate synthetic image patches for CNN training
     
+    Patches are generated chunk by chunk straight into their output files,
+    so memory use is bounded by chunk_size regardless of n_samples.
+    
     Args:
         n_samples: Number of patches to generate
         patch_size: Size of each patch (patch_size x patch_size)
         output_dir: Directory to save patches
+        seed: Random seed (same seed and sizes give the same patches)
+        dtype: 'float32' or 'uint16' (DNs, half the size)
+        chunk_size: Patches generated per step
+        shard_size: If set, write a sharded dataset (src/shards.py) to
+            output_dir/patch_shards instead of single .npy files
     
     Returns:
-        Tuple of (patches, labels) arrays
+        Tuple of (patches, labels, nitrogen) arrays, patches memory-mapped;
+        with shard_size, the shard directory instead
     """
-    print(f"\nGenerating {n_samples} synthetic image patches ({patch_size}x{patch_size})...")
-    
-    np.random.seed(42)
+    print(f"\nGenerating {n_samples} synthetic image patches ({patch_size}x{patch_size}, {dtype})...")
     
-    # Load growth stage mapping
-    stage_map = {
-        'Vegetative': 0,
-        'Tuber Initiation': 1,
-        'Bulking': 2
-    }
+    rng = np.random.default_rng(seed)
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.uint16):
+        raise ValueError("dtype must be float32 or uint16")
+    os.makedirs(output_dir, exist_ok=True)
     
     # Load soil data to get realistic correlations
-    soil_data_path = os.path.join(output_dir, "synthetic_soil_data.csv")
-    if os.path.exists(soil_data_path):
-        soil_df = pd.read_csv(soil_data_path)
-    else:
+    soil_df = load_soil_data(output_dir, columns=['growth_stage', 'N', 'NDVI'])
+    if soil_df is None:
         print("Soil data not found. Generating patches with random values...")
-        soil_df = None
     
-    patches = []
-    labels = []
-    nitrogen_values = []
+    # Per-patch stage, nitrogen and NDVI: from soil data where available, random after that
+    n_soil = min(n_samples, len(soil_df)) if soil_df is not None else 0
+    labels = np.empty(n_samples, dtype=np.int64)
+    nitrogen_values = np.empty(n_samples, dtype=np.float32)
+    ndvi = np.full(n_samples, np.nan, dtype=np.float32)
     
-    for i in range(n_samples):
-        # Generate patch (13 bands for Sentinel-2)
-        patch = np.random.rand(patch_size, patch_size, 13) * 10000
-        
-        # If we have soil data, use it to create more realistic patches
-        if soil_df is not None and i < len(soil_df):
-            row = soil_df.iloc[i]
-            # Adjust patch based on NDVI and growth stage
-            ndvi_factor = row['NDVI']
-            stage = row['growth_stage']
-            nitrogen = row['N']
-            
-            # Simulate realistic band values based on NDVI
-            # NIR (B08) - higher for vegetation
-            patch[:, :, 3] = patch[:, :, 3] * (1 + ndvi_factor * 2)
-            # Red (B04) - lower for vegetation
-            patch[:, :, 2] = patch[:, :, 2] * (1 - ndvi_factor * 0.5)
-            
-            # Add stage-specific characteristics
-            if stage == 'Vegetative':
-                # More green in early stages
-                patch[:, :, 1] = patch[:, :, 1] * 1.2
-            elif stage == 'Bulking':
-                # More red edge in bulking
-                patch[:, :, 4] = patch[:, :, 4] * 1.3
-            
-            label = stage_map[stage]
-            nitrogen_values.append(nitrogen)
-        else:
-            # Random assignment
-            stage = np.random.choice(['Vegetative', 'Tuber Initiation', 'Bulking'])
-            label = stage_map[stage]
-            nitrogen_values.append(np.random.randint(60, 200))
+    if n_soil:
+        soil_df = soil_df.iloc[:n_soil]
+        labels[:n_soil] = pd.Categorical(soil_df['growth_stage'], categories=GROWTH_STAGES).codes
+        nitrogen_values[:n_soil] = soil_df['N'].to_numpy()
+        ndvi[:n_soil] = soil_df['NDVI'].to_numpy()
+    labels[n_soil:] = rng.integers(0, len(GROWTH_STAGES), n_samples - n_soil)
+    nitrogen_values[n_soil:] = rng.integers(60, 200, n_samples - n_soil)
+    
+    shape = (patch_size, patch_size, N_BANDS)
+    if shard_size:
+        shard_dir = os.path.join(output_dir, "patch_shards")
+        writer = ShardWriter(
+            shard_dir,
+            {"patches": (shape, dtype), "labels": ((), np.int64), "nitrogen": ((), np.float32)},
+            shard_size=shard_size,
+            metadata={"seed": seed, "stages": GROWTH_STAGES}
+        )
+        buffer = np.empty((chunk_size,) + shape, dtype=dtype)
+    else:
+        patches = open_memmap(os.path.join(output_dir, "patches.npy"), mode='w+',
+                              dtype=dtype, shape=(n_samples,) + shape)
+    
+    report_every = max(1, n_samples // 10)
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        chunk = buffer[:stop - start] if shard_size else patches[start:stop]
+        fill_patches(chunk, ndvi[start:stop], labels[start:stop], rng)
         
-        patches.append(patch)
-        labels.append(label)
+        if shard_size:
+            writer.add(patches=chunk, labels=labels[start:stop], nitrogen=nitrogen_values[start:stop])
+        if stop // report_every > start // report_every or stop == n_samples:
+            print(f"  {stop}/{n_samples} patches")
     
-    patches = np.array(patches)
-    labels = np.array(labels)
-    nitrogen_values = np.array(nitrogen_values)
+    if shard_size:
+        manifest = writer.close()
+        print(f"[OK] {manifest['n_samples']} patches saved to {len(manifest['shards'])} shards in: {shard_dir}/")
+        return shard_dir
     
     # Save patches
-    np.save(os.path.join(output_dir, "patches.npy"), patches)
+    patches.flush()
     np.save(os.path.join(output_dir, "labels.npy"), labels)
     np.save(os.path.join(output_dir, "nitrogen_values.npy"), nitrogen_values)
     
@@ -171,6 +308,14 @@ if __name__ == "__main__":
     parser.add_argument("--patch-size", type=int, default=64, help="Patch size for CNN")
     parser.add_argument("--output", type=str, default="data/synthetic_soil_data.csv", 
                        help="Output CSV path")
+    parser.add_argument("--format", type=str, default="csv", choices=["csv", "parquet"],
+                        help="Soil data format (parquet keeps column types, needs pyarrow)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--patch-dtype", type=str, default="float32", choices=["float32", "uint16"],
+                        help="Patch storage dtype")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="Patches generated per step")
+    parser.add_argument("--shard-size", type=int, default=None,
+                        help="Write patches as a sharded dataset with this many patches per shard")
     
     args = parser.parse_args()
     
@@ -179,14 +324,19 @@ if __name__ == "__main__":
     print("="*60)
     
     # Generate soil data
-    df = generate_synthetic_soil_data(n_samples=args.samples, output_path=args.output)
+    output_path = os.path.splitext(args.output)[0] + f".{args.format}"
+    df = generate_synthetic_soil_data(n_samples=args.samples, output_path=output_path, seed=args.seed)
     
     # Generate patches if requested
     if args.patches:
         output_dir = os.path.dirname(args.output) if os.path.dirname(args.output) else "data"
         generate_patch_dataset(n_samples=args.samples, 
                              patch_size=args.patch_size,
-                             output_dir=output_dir)
+                             output_dir=output_dir,
+                             seed=args.seed,
+                             dtype=args.patch_dtype,
+                             chunk_size=args.chunk_size,
+                             shard_size=args.shard_size)
     
     print("\n" + "="*60)
     print("Data generation complete!")
@@ -4,17 +4,92 @@ Calculates NDVI, NDRE, and processes bands for ML pipeline
 """
 
 import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import bounds as window_bounds
 import numpy as np
+import hashlib
 import os
+import threading
+import time
 import yaml
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
 import cv2
 
+from src.cog import write_cog
+from src.indices import BAND_SPECS, SpectralIndexEngine
+from src.tile_cache import tile_key, hash_tile
+from src.render import NUTRIENT_PALETTE, classify, content_hash, read_png_hash, write_palette_png
+
+
+class BandCache:
+    """
+    LRU cache of decoded bands with an explicit memory budget
+    
+    Entries are keyed by (band, resolution, file mtime, output shape), so a
+    replaced JP2 file is never served stale. Cached arrays are read-only
+    because they are shared by every index and the band stacker.
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Return the cached entry for key (marking it recently used) or None"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+    
+    def put(self, key, data, transform, crs):
+        """Insert an entry, evicting least recently used bands to fit the budget"""
+        nbytes = data.nbytes
+        if nbytes > self.max_bytes:
+            return  # Larger than the whole budget: never cache
+        
+        data.setflags(write=False)
+        
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[0].nbytes
+            
+            while self._entries and self.current_bytes + nbytes > self.max_bytes:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+            
+            self._entries[key] = (data, transform, crs)
+            self.current_bytes += nbytes
+    
+    def clear(self):
+        """Drop all cached bands"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+    
+    def __len__(self):
+        return len(self._entries)
+
+
 class ImageProcessor:
     """Process Sentinel-2 JP2 images and calculate vegetation indices"""
     
+    # Bands used for the ML stack, in channel order
+    BAND_SPECS = BAND_SPECS
+    
+    # Indices every run consumes (nutrient map, nitrogen, change detection, COGs)
+    REQUIRED_INDICES = ('ndvi', 'ndre')
+    
     def __init__(self, config_path="config.yaml"):
         """Initialize with configuration"""
         with open(config_path, 'r') as f:
@@ -24,19 +99,53 @@ class ImageProcessor:
         self.r20_dir = self.config['paths']['r20_dir']
         self.output_dir = self.config['paths']['output_dir']
         
+        # Tiled processing keeps peak memory bounded by the tile size
+        processing = self.config.get('processing', {})
+        self.tiled = processing.get('tiled', False)
+        self.tile_size = processing.get('tile_size', 1024)
+        
+        # Decoded bands are shared by all indices and the stacker within a run
+        cache_mb = processing.get('band_cache_mb', 1024)
+        self.band_cache = BandCache(cache_mb * 1024 * 1024)
+        
+        # JP2 decoding releases the GIL inside GDAL, so bands decode in parallel
+        self.decode_workers = processing.get('decode_workers', os.cpu_count() or 4)
+        self.decode_timings = {}  # "B08_10m" -> seconds spent decoding
+        self._timings_lock = threading.Lock()
+        
+        # Band -> native resolution, from the `bands:` section
+        self.band_resolutions = {band: resolution
+                                 for resolution, bands in self.config['bands'].items()
+                                 for band in bands}
+        
+        # Spectral indices declared under `indices:` are evaluated together
+        self.index_engine = SpectralIndexEngine(
+            self.config['indices'],
+            reflectance_scale=processing.get('reflectance_scale', 10000)
+        )
+        
+        # Last nutrient map as (content key, class map): repeated calls are free
+        self._nutrient_memo = None
+        
+        # Georeferenced COG outputs (NDVI, NDRE, nutrient map, nitrogen)
+        cog = self.config.get('cog', {})
+        self.cog_enabled = cog.get('enabled', True)
+        self.cog_blocksize = cog.get('blocksize', 512)
+        self.cog_compress = cog.get('compress', 'deflate')
+        
         # Ensure output directory exists
         os.makedirs(self.output_dir, exist_ok=True)
     
-    def load_band(self, band_name, resolution="10m"):
+    def find_band_file(self, band_name, resolution="10m"):
         """
-        Load a JP2 band file
+        Locate the JP2 file for a band
         
         Args:
             band_name: Band name (e.g., 'B04', 'B08')
             resolution: '10m' or '20m'
         
         Returns:
-            numpy array of band data
+            Path to the JP2 file
         """
         dir_path = self.r10_dir if resolution == "10m" else self.r20_dir
         
@@ -47,188 +156,685 @@ class ImageProcessor:
         if not files:
             raise FileNotFoundError(f"Band {band_name} at {resolution} not found")
         
-        with rasterio.open(str(files[0])) as src:
-            data = src.read(1)  # Read first band
-            transform = src.transform
-            crs = src.crs
-        
-        return data, transform, crs
+        return str(files[0])
     
-    def calculate_ndvi(self):
+    def input_fingerprint(self):
         """
-        Calculate NDVI: (NIR - Red) / (NIR + Red)
-        Uses B08 (NIR) and B04 (Red) at 10m resolution
+        Hash identifying the current inputs (band files and processing mode)
+        
+        Two runs with the same fingerprint produce the same outputs, so it is
+        used to coalesce duplicate processing requests.
+        """
+        digest = hashlib.sha1()
+        digest.update(f"tiled={self.tiled};tile_size={self.tile_size}".encode())
+        for band, resolution in self.band_specs(set(self.band_resolutions) |
+                                                {band for band, _ in self.BAND_SPECS}):
+            try:
+                path = self.find_band_file(band, resolution)
+            except FileNotFoundError:
+                continue
+            stat = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+    
+    def load_band(self, band_name, resolution="10m", out_shape=None):
         """
-        print("Calculating NDVI...")
+        Load a JP2 band file
         
-        # Load bands
-        red, transform, crs = self.load_band("B04", "10m")
-        nir, _, _ = self.load_band("B08", "10m")
+        Decoded bands are served from the band cache, so each band is decoded
+        from JP2 at most once per run.
+        
+        Args:
+            band_name: Band name (e.g., 'B04', 'B08')
+            resolution: '10m' or '20m'
+            out_shape: Optional (H, W) to resample the band to (e.g. 20m -> 10m)
+        
+        Returns:
+            numpy array of band data (read-only), transform, crs
+        """
+        path = self.find_band_file(band_name, resolution)
+        mtime = os.stat(path).st_mtime_ns
+        
+        key = (band_name, resolution, mtime, None)
+        cached = self.band_cache.get(key)
+        if cached is None:
+            start = time.perf_counter()
+            with rasterio.open(path) as src:
+                data = src.read(1)  # Read first band
+                transform = src.transform
+                crs = src.crs
+            self._record_decode_time(band_name, resolution, time.perf_counter() - start)
+            self.band_cache.put(key, data, transform, crs)
+            cached = (data, transform, crs)
+        
+        data, transform, crs = cached
+        if out_shape is None or data.shape == tuple(out_shape):
+            return cached
+        
+        # Resampled copies are cached too: cubic resizing a full tile is not free
+        resampled_key = (band_name, resolution, mtime, tuple(out_shape))
+        resampled = self.band_cache.get(resampled_key)
+        if resampled is None:
+            data = cv2.resize(data.astype(np.float32),
+                              (out_shape[1], out_shape[0]),
+                              interpolation=cv2.INTER_CUBIC)
+            self.band_cache.put(resampled_key, data, transform, crs)
+            resampled = (data, transform, crs)
+        
+        return resampled
+    
+    def load_bands(self, band_specs, out_shape=None):
+        """
+        Decode several bands concurrently on a thread pool
         
-        # Convert to float to avoid overflow
-        red = red.astype(np.float32)
-        nir = nir.astype(np.float32)
+        Missing bands are skipped with a warning.
         
-        # Calculate NDVI
-        denominator = nir + red
-        denominator[denominator == 0] = np.nan  # Avoid division by zero
+        Args:
+            band_specs: List of (band_name, resolution) tuples
+            out_shape: Optional (H, W) that 20m bands are resampled to
         
-        ndvi = (nir - red) / denominator
+        Returns:
+            Dict of band_name -> (data, transform, crs), in band_specs order
+        """
+        def load(spec):
+            band, resolution = spec
+            shape = out_shape if resolution != "10m" else None
+            try:
+                return self.load_band(band, resolution, out_shape=shape)
+            except FileNotFoundError:
+                print(f"Warning: {band} at {resolution} not found")
+                return None
         
-        # Clip values to [-1, 1]
-        ndvi = np.clip(ndvi, -1, 1)
+        with ThreadPoolExecutor(max_workers=self.decode_workers) as pool:
+            loaded = list(pool.map(load, band_specs))
         
-        return ndvi, transform, crs
+        return {band: result for (band, _), result in zip(band_specs, loaded)
+                if result is not None}
     
-    def calculate_ndre(self):
+    def _record_decode_time(self, band_name, resolution, seconds):
+        """Accumulate decode time for a band (summed over windows in tiled mode)"""
+        key = f"{band_name}_{resolution}"
+        with self._timings_lock:
+            self.decode_timings[key] = self.decode_timings.get(key, 0.0) + seconds
+    
+    def print_decode_timings(self, wall_time):
+        """Report per-band decode times against the wall time of the decode phase"""
+        if not self.decode_timings:
+            return
+        
+        for band, seconds in sorted(self.decode_timings.items()):
+            print(f"  {band}: {seconds:.2f}s")
+        slowest = max(self.decode_timings.values())
+        total = sum(self.decode_timings.values())
+        print(f"Decoded {len(self.decode_timings)} bands in {wall_time:.2f}s "
+              f"(slowest band {slowest:.2f}s, serial sum {total:.2f}s, "
+              f"{self.decode_workers} workers)")
+    
+    def band_specs(self, bands):
+        """(band, resolution) tuples for band names, 10m bands first"""
+        specs = [(band, self.band_resolutions.get(band, "10m")) for band in bands]
+        return sorted(specs, key=lambda spec: spec[1] != "10m")
+    
+    def check_required_indices(self, bands=None):
         """
-        Calculate NDRE: (NIR - RedEdge) / (NIR + RedEdge)
-        Uses B08 (NIR) at 10m and B05 (RedEdge) at 20m
+        Fail early if NDVI/NDRE cannot be computed
+        
+        Args:
+            bands: Band names that were found (default: probe the band files)
+        
+        Raises:
+            ValueError: If a required index is not configured under `indices:`
+                or its input bands are missing
+        """
+        for name in self.REQUIRED_INDICES:
+            if name not in self.index_engine.names:
+                raise ValueError(f"{name.upper()} is required by the pipeline; "
+                                 f"add '{name}' under `indices:` in config.yaml")
+        
+        needed = self.index_engine.required_bands(list(self.REQUIRED_INDICES))
+        if bands is None:
+            bands = []
+            for band, resolution in self.band_specs(needed):
+                try:
+                    self.find_band_file(band, resolution)
+                    bands.append(band)
+                except FileNotFoundError:
+                    pass
+        
+        for name in self.REQUIRED_INDICES:
+            missing = sorted(set(self.index_engine.required_bands([name])) - set(bands))
+            if missing:
+                raise ValueError(f"{name.upper()} is required by the pipeline but "
+                                 f"band(s) {missing} were not found")
+    
+    def calculate_indices(self, names=None):
         """
-        print("Calculating NDRE...")
+        Calculate spectral indices over the full scene in one fused pass
         
-        # Load bands
-        nir, transform, crs = self.load_band("B08", "10m")
-        rededge, _, _ = self.load_band("B05", "20m")
+        Bands are loaded once through the band cache; 20m bands are
+        resampled to the 10m grid.
         
-        # Resample 20m to 10m (simple upsampling)
-        if rededge.shape != nir.shape:
-            rededge = cv2.resize(rededge.astype(np.float32), 
-                                (nir.shape[1], nir.shape[0]), 
-                                interpolation=cv2.INTER_CUBIC)
+        Args:
+            names: Index names (defaults to every index under `indices:`)
         
-        # Convert to float
-        nir = nir.astype(np.float32)
-        rededge = rededge.astype(np.float32)
+        Returns:
+            Dict of name -> index array, transform, crs
+        """
+        names = self.index_engine.names if names is None else names
+        print(f"Calculating {', '.join(name.upper() for name in names)}...")
         
-        # Calculate NDRE
-        denominator = nir + rededge
-        denominator[denominator == 0] = np.nan
+        # The 10m reference grid defines the output shape
+        ref, transform, crs = self.load_band("B04", "10m")
+        specs = self.band_specs(self.index_engine.required_bands(names))
+        loaded = self.load_bands(specs, out_shape=ref.shape)
         
-        ndre = (nir - rededge) / denominator
-        ndre = np.clip(ndre, -1, 1)
+        bands = {band: data for band, (data, _, _) in loaded.items()}
+        names = self.index_engine.available(bands, names)
+        indices = self.index_engine.evaluate(bands, names)
+        self.index_engine.release_buffers()
         
-        return ndre, transform, crs
+        return indices, transform, crs
+    
+    def calculate_ndvi(self):
+        """
+        Calculate NDVI: (NIR - Red) / (NIR + Red)
+        Uses B08 (NIR) and B04 (Red) at 10m resolution
+        """
+        indices, transform, crs = self.calculate_indices(['ndvi'])
+        return indices['ndvi'], transform, crs
+    
+    def calculate_ndre(self):
+        """
+        Calculate NDRE: (NIR - RedEdge) / (NIR + RedEdge)
+        Uses B08 (NIR) at 10m and B05 (RedEdge) at 20m
+        """
+        indices, transform, crs = self.calculate_indices(['ndre'])
+        return indices['ndre'], transform, crs
     
     def create_nutrient_map(self, ndvi, output_name="Nutrient_Map_Enhanced.png"):
         """
         Create color-coded nutrient map based on NDVI thresholds
         
+        Pixels are classified in one np.digitize pass (0 low / red,
+        1 medium / yellow, 2 high / green, 255 no data) and written at full
+        resolution as a palette-indexed PNG. The result is memoized on the
+        NDVI content hash: a repeat call returns the cached class map, and an
+        existing PNG for the same NDVI is not rewritten.
+        
         Args:
-            ndvi: NDVI array
+            ndvi: NDVI array or memmap
             output_name: Output filename
+        
+        Returns:
+            (H, W) uint8 class map (read-only)
         """
         print("Creating nutrient map...")
         
         thresholds = self.config['indices']['ndvi']['thresholds']
-        low_threshold = thresholds['low_fertility']
-        high_threshold = thresholds['high_fertility']
-        
-        # Create classified map
-        nutrient_map = np.zeros_like(ndvi)
-        nutrient_map[ndvi < low_threshold] = 0  # Low fertility (red)
-        nutrient_map[(ndvi >= low_threshold) & (ndvi < high_threshold)] = 1  # Medium (yellow)
-        nutrient_map[ndvi >= high_threshold] = 2  # High fertility (green)
-        
-        # Create custom colormap: Red -> Yellow -> Green
-        colors = ['red', 'yellow', 'green']
-        n_bins = 3
-        cmap = LinearSegmentedColormap.from_list('nutrient', colors, N=n_bins)
-        
-        # Plot
-        plt.figure(figsize=(12, 10))
-        plt.imshow(nutrient_map, cmap=cmap, vmin=0, vmax=2)
-        plt.colorbar(label='Nutrient Level', ticks=[0, 1, 2], 
-                    format=['Low', 'Medium', 'High'])
-        plt.title('Nutrient Health Map (NDVI-based)', fontsize=16, fontweight='bold')
-        plt.axis('off')
-        
-        # Save
+        edges = [thresholds['low_fertility'], thresholds['high_fertility']]
         output_path = os.path.join(self.output_dir, output_name)
-        plt.savefig(output_path, dpi=300, bbox_inches='tight')
-        plt.close()
         
-        print(f"Nutrient map saved to {output_path}")
+        key = content_hash(ndvi, extra=f"nutrient:{edges}")
+        memo = self._nutrient_memo
+        if memo is not None and memo[0] == key:
+            nutrient_map = memo[1]
+        else:
+            nutrient_map = classify(ndvi, edges)
+            nutrient_map.setflags(write=False)
+            self._nutrient_memo = (key, nutrient_map)
+        
+        if read_png_hash(output_path) == key:
+            print(f"Nutrient map unchanged: {output_path}")
+        else:
+            write_palette_png(nutrient_map, output_path, NUTRIENT_PALETTE, content_key=key)
+            print(f"Nutrient map saved to {output_path}")
+        
         return nutrient_map
     
-    def stack_all_bands(self):
+    def stack_all_bands(self, output_path=None):
         """
         Stack all available bands into a single array for ML processing
-        Returns: (H, W, C) array where C is number of bands
+        
+        Bands are written one by one into a preallocated memory-mapped .npy,
+        so the stack is never assembled in RAM and needs no separate save.
+        
+        Args:
+            output_path: Target .npy (defaults to <output_dir>/stacked_bands.npy)
+        
+        Returns: (H, W, C) read-only memmap where C is number of bands
         """
         print("Stacking all bands...")
         
-        bands_data = []
-        band_names = []
+        output_path = output_path or os.path.join(self.output_dir, "stacked_bands.npy")
+        
+        specs_10m = [spec for spec in self.BAND_SPECS if spec[1] == "10m"]
+        specs_20m = [spec for spec in self.BAND_SPECS if spec[1] == "20m"]
         
         # 10m bands
-        for band in ['B02', 'B03', 'B04', 'B08']:
-            try:
-                data, transform, crs = self.load_band(band, "10m")
-                bands_data.append(data)
-                band_names.append(f"{band}_10m")
-            except FileNotFoundError:
-                print(f"Warning: {band} at 10m not found")
+        loaded = self.load_bands(specs_10m)
         
         # 20m bands (need to resample to 10m)
-        base_shape = bands_data[0].shape if bands_data else None
+        base_shape = next(iter(loaded.values()))[0].shape if loaded else None
+        loaded.update(self.load_bands(specs_20m, out_shape=base_shape))
         
-        for band in ['B05', 'B11', 'B12']:
-            try:
-                data, _, _ = self.load_band(band, "20m")
-                if base_shape and data.shape != base_shape:
-                    data = cv2.resize(data.astype(np.float32), 
-                                    (base_shape[1], base_shape[0]), 
-                                    interpolation=cv2.INTER_CUBIC)
+        if not loaded:
+            raise ValueError("No bands found!")
+        
+        bands_data = []
+        band_names = []
+        for band, resolution in self.BAND_SPECS:
+            if band in loaded:
+                data, transform, crs = loaded[band]
                 bands_data.append(data)
-                band_names.append(f"{band}_20m")
-            except FileNotFoundError:
-                print(f"Warning: {band} at 20m not found")
+                band_names.append(f"{band}_{resolution}")
         
-        if not bands_data:
-            raise ValueError("No bands found!")
+        # Stack bands: (H, W, C), written band by band into the memmap
+        shape = bands_data[0].shape + (len(bands_data),)
+        dtype = np.result_type(*[data.dtype for data in bands_data])
+        stacked = np.lib.format.open_memmap(output_path, mode='w+', dtype=dtype, shape=shape)
+        for k, data in enumerate(bands_data):
+            stacked[:, :, k] = data
+        stacked.flush()
+        del stacked, bands_data
         
-        # Stack bands: (H, W, C)
-        stacked = np.stack(bands_data, axis=-1)
+        stacked = np.load(output_path, mmap_mode='r')
         
-        print(f"Stacked {len(bands_data)} bands: {band_names}")
+        print(f"Stacked {len(band_names)} bands: {band_names}")
         print(f"Shape: {stacked.shape}")
         
         return stacked, transform, crs, band_names
     
+    def cog_path(self, name):
+        """Path of the COG output for a layer (e.g. 'ndvi' -> outputs/ndvi.tif)"""
+        return os.path.join(self.output_dir, f"{name}.tif")
+    
+    def save_cog(self, array, name, transform, crs, categorical=False):
+        """
+        Save a raster output as a tiled, compressed COG with overviews
+        
+        Args:
+            array: (H, W) array or memmap on the 10m grid
+            name: Layer name ('ndvi', 'ndre', 'nutrient_map', 'nitrogen')
+            transform: Affine transform of the 10m grid
+            crs: CRS of the 10m grid
+            categorical: Class map (uint8, nearest-neighbour overviews)
+        
+        Returns:
+            Output path, or None when COG output is disabled
+        """
+        if not self.cog_enabled:
+            return None
+        
+        if categorical:
+            array = np.asarray(array).astype(np.uint8)
+        
+        path = write_cog(
+            self.cog_path(name), array, transform, crs,
+            nodata=255 if categorical else None,
+            blocksize=self.cog_blocksize,
+            compress=self.cog_compress,
+            resampling='nearest' if categorical else 'average'
+        )
+        print(f"COG saved to {path}")
+        return path
+    
+    def save_cogs(self, results):
+        """Write NDVI, NDRE and the nutrient class map as COGs"""
+        transform, crs = results['transform'], results['crs']
+        self.save_cog(results['ndvi'], 'ndvi', transform, crs)
+        self.save_cog(results['ndre'], 'ndre', transform, crs)
+        self.save_cog(results['nutrient_map'], 'nutrient_map', transform, crs,
+                      categorical=True)
+    
+    def iter_windows(self, tile_size=None):
+        """
+        Walk the 10m reference grid in block-aligned windows
+        
+        Tiles are rounded to a multiple of the JP2 block shape so that each
+        window decodes whole codeblocks only.
+        
+        Args:
+            tile_size: Tile edge in pixels (defaults to processing.tile_size)
+        
+        Yields:
+            rasterio Window objects covering the scene
+        """
+        tile_size = tile_size or self.tile_size
+        
+        with rasterio.open(self.find_band_file("B04", "10m")) as src:
+            height, width = src.height, src.width
+            block_h, block_w = src.block_shapes[0]
+        
+        step_h = max(block_h, (tile_size // block_h) * block_h)
+        step_w = max(block_w, (tile_size // block_w) * block_w)
+        
+        for row_off in range(0, height, step_h):
+            for col_off in range(0, width, step_w):
+                yield Window(col_off, row_off,
+                             min(step_w, width - col_off),
+                             min(step_h, height - row_off))
+    
+    def read_window(self, src, window, ref_transform):
+        """
+        Read one window of a band on the 10m reference grid
+        
+        Bands on a coarser grid (20m) are read over the same ground extent
+        and resampled to the window shape.
+        
+        Args:
+            src: Open rasterio dataset
+            window: Window on the 10m reference grid
+            ref_transform: Affine transform of the 10m reference grid
+        
+        Returns:
+            (rows, cols) numpy array
+        """
+        out_shape = (int(window.height), int(window.width))
+        
+        if src.transform == ref_transform:
+            return src.read(1, window=window)
+        
+        src_window = from_bounds(*window_bounds(window, ref_transform),
+                                 transform=src.transform)
+        return src.read(1, window=src_window, out_shape=out_shape,
+                        resampling=Resampling.cubic)
+    
+    def _tiled_sources(self):
+        """
+        Band files read by tiled processing (stack bands plus index inputs)
+        
+        Returns:
+            sources_found: Dict of band -> (resolution, path)
+            available: (band, resolution, path) of the stack bands, in channel order
+            index_names: Indices computable from the found bands
+        """
+        index_specs = self.band_specs(self.index_engine.required_bands())
+        read_specs = self.BAND_SPECS + [spec for spec in index_specs
+                                        if spec not in self.BAND_SPECS]
+        
+        sources_found = {}
+        for band, resolution in read_specs:
+            try:
+                sources_found[band] = (resolution, self.find_band_file(band, resolution))
+            except FileNotFoundError:
+                print(f"Warning: {band} at {resolution} not found")
+        
+        self.check_required_indices(sources_found)
+        available = [(band, resolution, sources_found[band][1])
+                     for band, resolution in self.BAND_SPECS if band in sources_found]
+        index_names = self.index_engine.available(sources_found)
+        return sources_found, available, index_names
+    
+    def read_tiles(self, sources_found, ref_transform):
+        """
+        Decode all bands window by window, each window's bands concurrently
+        
+        Args:
+            sources_found: Dict of band -> (resolution, path)
+            ref_transform: Affine transform of the 10m reference grid
+        
+        Yields:
+            (window, {band: (rows, cols) array}) for every window of iter_windows()
+        """
+        with ExitStack() as stack:
+            sources = {band: (resolution, stack.enter_context(rasterio.open(path)))
+                       for band, (resolution, path) in sources_found.items()}
+            pool = stack.enter_context(ThreadPoolExecutor(max_workers=self.decode_workers))
+            
+            def read(band, window):
+                # Each dataset handle is used by one thread at a time
+                resolution, src = sources[band]
+                start = time.perf_counter()
+                data = self.read_window(src, window, ref_transform)
+                self._record_decode_time(band, resolution, time.perf_counter() - start)
+                return data
+            
+            for window in self.iter_windows():
+                futures = {band: pool.submit(read, band, window) for band in sources}
+                yield window, {band: future.result() for band, future in futures.items()}
+    
+    def reference_grid(self):
+        """(height, width, transform, crs) of the 10m reference grid (B04)"""
+        with rasterio.open(self.find_band_file("B04", "10m")) as ref:
+            return ref.height, ref.width, ref.transform, ref.crs
+    
+    def process_images_tiled(self):
+        """
+        Tiled processing: spectral indices and the band stack are computed per
+        window and written straight into memory-mapped .npy outputs, so peak
+        memory is bounded by the tile size rather than the scene size.
+        """
+        print("="*50)
+        print(f"Processing Sentinel-2 Images (tiled, {self.tile_size}px)")
+        print("="*50)
+        
+        sources_found, available, index_names = self._tiled_sources()
+        height, width, transform, crs = self.reference_grid()
+        
+        band_names = [f"{band}_{resolution}" for band, resolution, _ in available]
+        
+        index_paths = {name: os.path.join(self.output_dir, f"{name}.npy")
+                       for name in index_names}
+        stack_path = os.path.join(self.output_dir, "stacked_bands.npy")
+        
+        index_outputs = {name: np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                                         shape=(height, width))
+                         for name, path in index_paths.items()}
+        stacked = np.lib.format.open_memmap(stack_path, mode='w+', dtype=np.float32,
+                                            shape=(height, width, len(available)))
+        
+        self.decode_timings = {}
+        decode_start = time.perf_counter()
+        
+        for window, tile in self.read_tiles(sources_found, transform):
+            rows, cols = window.toslices()
+            
+            # All indices in one pass, written straight into the outputs
+            self.index_engine.evaluate(
+                tile, index_names,
+                out={name: output[rows, cols] for name, output in index_outputs.items()}
+            )
+            
+            for k, (band, _, _) in enumerate(available):
+                stacked[rows, cols, k] = tile[band]
+        
+        self.print_decode_timings(time.perf_counter() - decode_start)
+        
+        for output in index_outputs.values():
+            output.flush()
+        stacked.flush()
+        del index_outputs, stacked
+        
+        # Reopen read-only so downstream consumers never page the scene in eagerly
+        indices = {name: np.load(path, mmap_mode='r') for name, path in index_paths.items()}
+        ndvi, ndre = indices['ndvi'], indices['ndre']
+        stacked_bands = np.load(stack_path, mmap_mode='r')
+        
+        print(f"Stacked {len(band_names)} bands: {band_names}")
+        print(f"Shape: {stacked_bands.shape}")
+        
+        nutrient_map = self.create_nutrient_map(ndvi)
+        
+        results = {
+            'ndvi': ndvi,
+            'ndre': ndre,
+            'indices': indices,
+            'nutrient_map': nutrient_map,
+            'stacked_bands': stacked_bands,
+            'band_names': band_names,
+            'transform': transform,
+            'crs': crs
+        }
+        self.save_cogs(results)
+        
+        print("\nProcessing complete!")
+        print(f"Outputs saved to: {self.output_dir}")
+        
+        return results
+    
+    def process_images_incremental(self, cache, patch_size=64):
+        """
+        Incremental tiled processing against a TileCache
+        
+        Outputs stay in the usual .npy files and are updated in place. Each
+        tile is decoded and hashed, and its band math only reruns when the
+        hash differs from the last run; when no band file changed at all
+        (input_fingerprint), nothing is decoded.
+        
+        Args:
+            cache: src.tile_cache.TileCache (finished by the caller)
+            patch_size: CNN patch edge; tile offsets must be multiples of it so
+                every patch belongs to exactly one tile
+        
+        Returns:
+            Results dict as process_images(), plus 'windows' (all tiles),
+            'changed_tiles' (tiles whose band math was recomputed),
+            'input_fingerprint' and 'outputs' (path -> memmap)
+        
+        Raises:
+            ValueError: If the tile grid is not aligned to patch_size
+        """
+        print("="*50)
+        print(f"Processing Sentinel-2 Images (incremental, {self.tile_size}px)")
+        print("="*50)
+        
+        sources_found, available, index_names = self._tiled_sources()
+        height, width, transform, crs = self.reference_grid()
+        band_names = [f"{band}_{resolution}" for band, resolution, _ in available]
+        
+        windows = list(self.iter_windows())
+        if any(window.row_off % patch_size or window.col_off % patch_size for window in windows):
+            raise ValueError(f"Tile grid is not aligned to {patch_size}px patches "
+                             f"(processing.tile_size {self.tile_size})")
+        
+        cache.begin({
+            "shape": [height, width],
+            "tile": [int(windows[0].height), int(windows[0].width)],
+            "bands": band_names,
+            "indices": {name: self.config['indices'].get(name) for name in index_names},
+            "reflectance_scale": self.index_engine.reflectance_scale
+        })
+        
+        index_paths = {name: os.path.join(self.output_dir, f"{name}.npy")
+                       for name in index_names}
+        stack_path = os.path.join(self.output_dir, "stacked_bands.npy")
+        index_outputs = {name: cache.open_array(path, (height, width), np.float32, 'inputs')
+                         for name, path in index_paths.items()}
+        stacked = cache.open_array(stack_path, (height, width, len(available)),
+                                   np.float32, 'inputs')
+        
+        fingerprint = self.input_fingerprint()
+        changed = []
+        
+        if cache.inputs_unchanged(fingerprint):
+            print("Band files unchanged since the last run, reusing every tile")
+        else:
+            self.decode_timings = {}
+            decode_start = time.perf_counter()
+            ndvi = index_outputs['ndvi']
+            
+            for window, tile in self.read_tiles(sources_found, transform):
+                key = tile_key(window)
+                input_hash = hash_tile(tile)
+                previous_hash = cache.tile_hash(key)
+                if previous_hash == input_hash:
+                    continue
+                
+                rows, cols = window.toslices()
+                previous_ndvi = np.array(ndvi[rows, cols]) if previous_hash else None
+                
+                self.index_engine.evaluate(
+                    tile, index_names,
+                    out={name: output[rows, cols] for name, output in index_outputs.items()}
+                )
+                for k, (band, _, _) in enumerate(available):
+                    stacked[rows, cols, k] = tile[band]
+                
+                ndvi_change = None
+                if previous_ndvi is not None:
+                    change = np.abs(ndvi[rows, cols] - previous_ndvi)
+                    ndvi_change = float(np.nanmean(change)) if np.isfinite(change).any() else 0.0
+                cache.record_inputs(key, input_hash, ndvi_change)
+                changed.append(window)
+            
+            self.print_decode_timings(time.perf_counter() - decode_start)
+        
+        print(f"Band math recomputed for {len(changed)}/{len(windows)} tiles")
+        
+        nutrient_map = self.create_nutrient_map(index_outputs['ndvi'])
+        
+        outputs = {path: index_outputs[name] for name, path in index_paths.items()}
+        outputs[stack_path] = stacked
+        
+        results = {
+            'ndvi': index_outputs['ndvi'],
+            'ndre': index_outputs['ndre'],
+            'indices': index_outputs,
+            'nutrient_map': nutrient_map,
+            'stacked_bands': stacked,
+            'band_names': band_names,
+            'transform': transform,
+            'crs': crs,
+            'windows': windows,
+            'changed_tiles': changed,
+            'input_fingerprint': fingerprint,
+            'outputs': outputs
+        }
+        self.save_cogs(results)
+        
+        return results
+    
     def process_images(self):
         """Main processing function"""
+        if self.tiled:
+            return self.process_images_tiled()
+        
         print("="*50)
         print("Processing Sentinel-2 Images")
         print("="*50)
+        self.check_required_indices()
+        
+        # Decode every band once, concurrently; indices and the stack hit the cache
+        self.decode_timings = {}
+        decode_start = time.perf_counter()
+        self.load_bands(self.BAND_SPECS)
+        self.print_decode_timings(time.perf_counter() - decode_start)
         
-        # Calculate indices
-        ndvi, transform, crs = self.calculate_ndvi()
-        ndre, _, _ = self.calculate_ndre()
+        # Calculate all configured indices in one pass
+        indices, transform, crs = self.calculate_indices()
+        ndvi, ndre = indices['ndvi'], indices['ndre']
         
         # Create nutrient map
         nutrient_map = self.create_nutrient_map(ndvi)
         
-        # Stack bands for ML
+        # Stack bands for ML (written directly to stacked_bands.npy)
         stacked_bands, _, _, band_names = self.stack_all_bands()
         
-        # Save NDVI and NDRE as numpy arrays
-        np.save(os.path.join(self.output_dir, "ndvi.npy"), ndvi)
-        np.save(os.path.join(self.output_dir, "ndre.npy"), ndre)
-        np.save(os.path.join(self.output_dir, "stacked_bands.npy"), stacked_bands)
+        # Save indices as numpy arrays (ndvi.npy, ndre.npy, ...)
+        for name, index in indices.items():
+            np.save(os.path.join(self.output_dir, f"{name}.npy"), index)
         
-        print("\nProcessing complete!")
-        print(f"Outputs saved to: {self.output_dir}")
+        print(f"Band cache: {self.band_cache.hits} hits, {self.band_cache.misses} misses")
+        
+        # The cache is per run: release the decoded bands once outputs exist
+        self.band_cache.clear()
         
-        return {
+        results = {
             'ndvi': ndvi,
             'ndre': ndre,
+            'indices': indices,
             'nutrient_map': nutrient_map,
             'stacked_bands': stacked_bands,
             'band_names': band_names,
             'transform': transform,
             'crs': crs
         }
+        self.save_cogs(results)
+        
+        print("\nProcessing complete!")
+        print(f"Outputs saved to: {self.output_dir}")
+        
+        return results
 
 
 if __name__ == "__main__":
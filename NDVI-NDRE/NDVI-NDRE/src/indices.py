@@ -0,0 +1,224 @@
+"""
+Spectral Index Engine
+Registry of Sentinel-2 vegetation/water indices evaluated in one fused pass per tile
+"""
+
+import numpy as np
+
+# Bands stacked by the pipeline (stacked_bands.npy), in channel order, with
+# their native resolution; training patches use the same layout
+BAND_SPECS = [
+    ('B02', '10m'), ('B03', '10m'), ('B04', '10m'), ('B08', '10m'),
+    ('B05', '20m'), ('B11', '20m'), ('B12', '20m')
+]
+
+# name -> (kernel, default band roles, default params)
+SPECTRAL_INDICES = {}
+
+
+def register_index(name, bands, params=None):
+    """
+    Register a spectral index kernel
+    
+    Kernels receive reflectance arrays by role (e.g. 'nir', 'red'), write the
+    result into `out` and may only use the preallocated `scratch` buffers, so
+    evaluating an index never allocates a full-tile temporary.
+    
+    Args:
+        name: Index name as used under `indices:` in config.yaml
+        bands: Default mapping of role -> Sentinel-2 band
+        params: Default scalar parameters (overridable from config)
+    """
+    def decorator(kernel):
+        SPECTRAL_INDICES[name] = (kernel, dict(bands), dict(params or {}))
+        return kernel
+    return decorator
+
+
+def _normalized_difference(a, b, out, scratch):
+    """(a - b) / (a + b); pixels with a + b == 0 become NaN"""
+    numerator, denominator, invalid = scratch
+    np.subtract(a, b, out=numerator)
+    np.add(a, b, out=denominator)
+    np.equal(denominator, 0, out=invalid)
+    np.divide(numerator, denominator, out=out)
+    np.copyto(out, np.nan, where=invalid)
+
+
+@register_index("ndvi", {"red": "B04", "nir": "B08"})
+def ndvi(b, out, scratch):
+    _normalized_difference(b["nir"], b["red"], out, scratch)
+
+
+@register_index("ndre", {"rededge": "B05", "nir": "B08"})
+def ndre(b, out, scratch):
+    _normalized_difference(b["nir"], b["rededge"], out, scratch)
+
+
+@register_index("gndvi", {"green": "B03", "nir": "B08"})
+def gndvi(b, out, scratch):
+    _normalized_difference(b["nir"], b["green"], out, scratch)
+
+
+@register_index("ndwi", {"green": "B03", "nir": "B08"})
+def ndwi(b, out, scratch):
+    _normalized_difference(b["green"], b["nir"], out, scratch)
+
+
+@register_index("ndmi", {"nir": "B08", "swir1": "B11"})
+def ndmi(b, out, scratch):
+    _normalized_difference(b["nir"], b["swir1"], out, scratch)
+
+
+@register_index("savi", {"red": "B04", "nir": "B08"}, {"L": 0.5})
+def savi(b, out, scratch, L=0.5):
+    numerator, denominator, invalid = scratch
+    np.subtract(b["nir"], b["red"], out=numerator)
+    np.multiply(numerator, 1 + L, out=numerator)
+    np.add(b["nir"], b["red"], out=denominator)
+    np.add(denominator, L, out=denominator)
+    np.equal(denominator, 0, out=invalid)
+    np.divide(numerator, denominator, out=out)
+    np.copyto(out, np.nan, where=invalid)
+
+
+@register_index("evi", {"blue": "B02", "red": "B04", "nir": "B08"},
+                {"G": 2.5, "C1": 6.0, "C2": 7.5, "L": 1.0})
+def evi(b, out, scratch, G=2.5, C1=6.0, C2=7.5, L=1.0):
+    numerator, denominator, invalid = scratch
+    np.subtract(b["nir"], b["red"], out=numerator)
+    np.multiply(numerator, G, out=numerator)
+    np.multiply(b["red"], C1, out=denominator)
+    np.add(denominator, b["nir"], out=denominator)
+    np.multiply(b["blue"], C2, out=out)
+    np.subtract(denominator, out, out=denominator)
+    np.add(denominator, L, out=denominator)
+    np.equal(denominator, 0, out=invalid)
+    np.divide(numerator, denominator, out=out)
+    np.copyto(out, np.nan, where=invalid)
+
+
+@register_index("msavi", {"red": "B04", "nir": "B08"})
+def msavi(b, out, scratch):
+    # (2*NIR + 1 - sqrt((2*NIR + 1)^2 - 8*(NIR - Red))) / 2
+    term, radicand, _ = scratch
+    np.multiply(b["nir"], 2, out=term)
+    np.add(term, 1, out=term)
+    np.square(term, out=radicand)
+    np.subtract(b["nir"], b["red"], out=out)
+    np.multiply(out, 8, out=out)
+    np.subtract(radicand, out, out=radicand)
+    np.sqrt(radicand, out=radicand)
+    np.subtract(term, radicand, out=out)
+    np.multiply(out, 0.5, out=out)
+
+
+class SpectralIndexEngine:
+    """Evaluate any set of configured spectral indices in one fused pass per tile"""
+    
+    def __init__(self, indices_config, reflectance_scale=10000.0):
+        """
+        Args:
+            indices_config: The `indices:` section of config.yaml
+            reflectance_scale: Divisor converting Sentinel-2 DNs to reflectance
+        """
+        self.reflectance_scale = float(reflectance_scale)
+        self.indices = {}  # name -> (kernel, role -> band, params)
+        
+        for name, spec in (indices_config or {}).items():
+            if name not in SPECTRAL_INDICES:
+                raise ValueError(f"Unknown spectral index '{name}'. "
+                                 f"Available: {sorted(SPECTRAL_INDICES)}")
+            kernel, default_bands, default_params = SPECTRAL_INDICES[name]
+            spec = spec or {}
+            bands = {**default_bands, **spec.get('bands', {})}
+            params = {**default_params, **spec.get('params', {})}
+            self.indices[name] = (kernel, bands, params)
+        
+        # Buffers are reused across tiles of the same shape
+        self._buffers = {}
+    
+    @property
+    def names(self):
+        return list(self.indices)
+    
+    def required_bands(self, names=None):
+        """Sorted list of bands needed to evaluate the given indices"""
+        names = self.names if names is None else names
+        return sorted({band for name in names for band in self.indices[name][1].values()})
+    
+    def available(self, bands, names=None):
+        """Subset of indices whose bands are all present in `bands`"""
+        names = self.names if names is None else names
+        usable = []
+        for name in names:
+            missing = set(self.indices[name][1].values()) - set(bands)
+            if missing:
+                print(f"Warning: skipping {name.upper()}, missing bands {sorted(missing)}")
+            else:
+                usable.append(name)
+        return usable
+    
+    def allocate(self, shape, names=None):
+        """Allocate float32 output arrays for the given indices"""
+        names = self.names if names is None else names
+        return {name: np.empty(shape, dtype=np.float32) for name in names}
+    
+    def release_buffers(self):
+        """Drop cached reflectance/scratch buffers (e.g. after a full-scene pass)"""
+        self._buffers.clear()
+    
+    def _tile_buffers(self, shape, bands):
+        """Preallocated reflectance and scratch buffers for a tile shape"""
+        if shape not in self._buffers:
+            # Edge tiles have their own shapes; keep only a few around
+            if len(self._buffers) >= 4:
+                self._buffers.clear()
+            self._buffers[shape] = (
+                {},
+                (np.empty(shape, dtype=np.float32),
+                 np.empty(shape, dtype=np.float32),
+                 np.empty(shape, dtype=bool))
+            )
+        reflectance, scratch = self._buffers[shape]
+        for band in bands:
+            if band not in reflectance:
+                reflectance[band] = np.empty(shape, dtype=np.float32)
+        return reflectance, scratch
+    
+    def evaluate(self, bands, names=None, out=None):
+        """
+        Evaluate indices for one tile
+        
+        Each band is converted to reflectance once and shared by every index.
+        
+        Args:
+            bands: Dict of band name -> array (any numeric dtype), same shape
+            names: Indices to evaluate (defaults to all configured)
+            out: Optional dict of name -> output array/view to write into
+        
+        Returns:
+            Dict of index name -> float32 array clipped to [-1, 1]
+        """
+        names = self.names if names is None else names
+        required = self.required_bands(names)
+        if not required:
+            return {} if out is None else out
+        shape = bands[required[0]].shape
+        
+        if out is None:
+            out = self.allocate(shape, names)
+        
+        reflectance, scratch = self._tile_buffers(shape, required)
+        for band in required:
+            np.divide(bands[band], self.reflectance_scale,
+                      out=reflectance[band], casting='unsafe')
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name in names:
+                kernel, roles, params = self.indices[name]
+                by_role = {role: reflectance[band] for role, band in roles.items()}
+                kernel(by_role, out[name], scratch, **params)
+                np.clip(out[name], -1, 1, out=out[name])
+        
+        return out
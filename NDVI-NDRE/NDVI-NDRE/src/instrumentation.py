@@ -0,0 +1,183 @@
+"""
+Pipeline Instrumentation
+Wall time, CPU time, peak RSS and I/O bytes per pipeline stage, as JSON and Prometheus text
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False  # Windows: peak RSS is not reported
+
+METRIC_PREFIX = "ndvi_pipeline"
+
+# Report field -> (Prometheus metric, help text)
+STAGE_METRICS = {
+    "wall_seconds": ("stage_wall_seconds", "Wall-clock time of the stage"),
+    "cpu_seconds": ("stage_cpu_seconds", "CPU time of the process (all threads) during the stage"),
+    "peak_rss_bytes": ("stage_peak_rss_bytes", "Peak resident set size during the stage"),
+    "read_bytes": ("stage_read_bytes", "Bytes read through read syscalls during the stage"),
+    "write_bytes": ("stage_write_bytes", "Bytes written through write syscalls during the stage"),
+    "disk_read_bytes": ("stage_disk_read_bytes", "Bytes fetched from storage during the stage"),
+    "disk_write_bytes": ("stage_disk_write_bytes", "Bytes sent to storage during the stage")
+}
+
+
+def _io_counters():
+    """Process I/O counters from /proc/self/io (Linux), or None"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(':') for line in f if ':' in line)
+    except OSError:
+        return None
+    return {
+        "read_bytes": int(counters['rchar']),
+        "write_bytes": int(counters['wchar']),
+        "disk_read_bytes": int(counters['read_bytes']),
+        "disk_write_bytes": int(counters['write_bytes'])
+    }
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS (Linux); False if it cannot be reset"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _megabytes(value):
+    return "-" if value is None else f"{value / 1e6:.1f}"
+
+
+def _peak_rss():
+    """Peak RSS in bytes (since the last reset on Linux), or None"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if not RESOURCE_AVAILABLE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Bytes on macOS, KiB elsewhere
+
+
+class StageProfiler:
+    """
+    Resource usage of consecutive pipeline stages
+    
+    CPU time and I/O are process-wide, so threads started by a stage (JP2
+    decoding, TensorFlow) are included. Peak RSS is the peak within the
+    stage where the kernel allows resetting it (Linux); elsewhere it is the
+    peak of the process so far. I/O counters need /proc/self/io and are
+    None without it.
+    
+    Usage:
+        profiler = StageProfiler()
+        with profiler.stage("process"):
+            results = pipeline.process_images()
+        report["instrumentation"] = profiler.summary()
+    """
+    
+    def __init__(self):
+        self.stages = {}  # name -> metrics, in execution order
+        self.started = time.time()
+    
+    @contextmanager
+    def stage(self, name):
+        """Record one stage; a stage that raises is recorded as failed"""
+        peak_reset = _reset_peak_rss()
+        io_start = _io_counters()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        
+        metrics = {"status": "completed"}
+        try:
+            yield metrics
+        except BaseException as e:
+            metrics["status"] = "failed"
+            metrics["error"] = str(e)
+            raise
+        finally:
+            metrics["wall_seconds"] = round(time.perf_counter() - wall_start, 4)
+            metrics["cpu_seconds"] = round(time.process_time() - cpu_start, 4)
+            metrics["peak_rss_bytes"] = _peak_rss()
+            metrics["peak_rss_scope"] = "stage" if peak_reset else "process"
+            io_end = _io_counters()
+            for key in ("read_bytes", "write_bytes", "disk_read_bytes", "disk_write_bytes"):
+                metrics[key] = io_end[key] - io_start[key] if io_start and io_end else None
+            self.stages[name] = metrics
+    
+    def rename(self, name, new_name):
+        """Record a finished stage under another name (e.g. a failed attempt before a retry)"""
+        self.stages[new_name] = self.stages.pop(name)
+    
+    def summary(self):
+        """JSON-serialisable metrics of every stage plus totals"""
+        return {
+            "started_at": datetime.fromtimestamp(self.started).isoformat(),
+            "total_wall_seconds": round(sum(m["wall_seconds"] for m in self.stages.values()), 4),
+            "total_cpu_seconds": round(sum(m["cpu_seconds"] for m in self.stages.values()), 4),
+            "stages": self.stages
+        }
+    
+    def print_summary(self):
+        """Per-stage table on stdout"""
+        print(f"{'Stage':<22}{'Wall (s)':>10}{'CPU (s)':>10}{'Peak RSS (MB)':>15}"
+              f"{'Read (MB)':>11}{'Written (MB)':>14}")
+        for name, m in self.stages.items():
+            print(f"{name:<22}{m['wall_seconds']:>10.2f}{m['cpu_seconds']:>10.2f}"
+                  f"{_megabytes(m['peak_rss_bytes']):>15}{_megabytes(m['read_bytes']):>11}"
+                  f"{_megabytes(m['write_bytes']):>14}")
+    
+    def prometheus_text(self, success):
+        """
+        Metrics in the Prometheus text exposition format
+        
+        Args:
+            success: Whether the whole run succeeded
+        """
+        lines = []
+        for key, (metric, help_text) in STAGE_METRICS.items():
+            lines.append(f"# HELP {METRIC_PREFIX}_{metric} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{metric} gauge")
+            for name, m in self.stages.items():
+                if m[key] is not None:
+                    lines.append(f'{METRIC_PREFIX}_{metric}{{stage="{name}"}} {m[key]}')
+        
+        lines.append(f"# HELP {METRIC_PREFIX}_stage_success Whether the stage completed (1) or failed (0)")
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_success gauge")
+        for name, m in self.stages.items():
+            lines.append(f'{METRIC_PREFIX}_stage_success{{stage="{name}"}} '
+                         f'{int(m["status"] == "completed")}')
+        
+        lines.append(f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Start time of the last run")
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds {self.started:.3f}")
+        lines.append(f"# HELP {METRIC_PREFIX}_success Whether the last run succeeded")
+        lines.append(f"# TYPE {METRIC_PREFIX}_success gauge")
+        lines.append(f"{METRIC_PREFIX}_success {int(success)}")
+        return "\n".join(lines) + "\n"
+    
+    def write_prometheus(self, path, success):
+        """Write the metrics file atomically (for node_exporter's textfile collector)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', newline='\n') as f:
+            f.write(self.prometheus_text(success))
+        os.replace(tmp_path, path)
+        print(f"Metrics written to {path}")
+        return path
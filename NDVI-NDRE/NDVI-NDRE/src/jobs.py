@@ -0,0 +1,115 @@
+"""
+Background Job Queue
+Runs long pipeline jobs on a local worker pool with status polling
+"""
+
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class JobQueue:
+    """Local worker pool for long-running jobs, with duplicate coalescing"""
+    
+    def __init__(self, max_workers=1, max_history=100):
+        """
+        Args:
+            max_workers: Jobs allowed to run at the same time
+            max_history: Finished jobs kept for status polling
+        """
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="job")
+        self._jobs = OrderedDict()  # job_id -> job record
+        self._active = {}  # input key -> job_id of the queued/running job
+        self._lock = threading.Lock()
+    
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Enqueue fn(*args, progress=callback, **kwargs)
+        
+        A submission whose key matches a queued or running job is coalesced
+        into that job instead of starting a second one.
+        
+        Args:
+            key: Identity of the job inputs (e.g. a hash of input files)
+            fn: Callable doing the work; receives a `progress(fraction, message)`
+                keyword argument and returns a JSON-serialisable result
+        
+        Returns:
+            (job status dict, created) where created is False when coalesced
+        """
+        with self._lock:
+            job_id = self._active.get(key)
+            if job_id is not None:
+                return self._public(self._jobs[job_id]), False
+            
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "key": key,
+                "status": "queued",
+                "progress": 0.0,
+                "message": "Queued",
+                "submitted_at": datetime.now().isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None
+            }
+            self._active[key] = job_id
+            self._prune()
+            job = self._public(self._jobs[job_id])
+        
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job, True
+    
+    def get(self, job_id):
+        """Status dict of a job, or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job else None
+    
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+    
+    def _run(self, job_id, fn, args, kwargs):
+        """Worker body: run the job and record its outcome"""
+        self._update(job_id, status="running", message="Running",
+                     started_at=datetime.now().isoformat())
+        
+        def progress(fraction, message=None):
+            fields = {"progress": round(float(fraction), 3)}
+            if message:
+                fields["message"] = message
+            self._update(job_id, **fields)
+        
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+            fields = {"status": "succeeded", "progress": 1.0,
+                      "message": "Completed", "result": result}
+        except Exception as e:
+            traceback.print_exc()
+            fields = {"status": "failed", "message": "Failed", "error": str(e)}
+        
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields, finished_at=datetime.now().isoformat())
+            if self._active.get(job["key"]) == job_id:
+                del self._active[job["key"]]
+    
+    def _prune(self):
+        """Forget the oldest finished jobs beyond max_history (lock held)"""
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job["status"] in ("succeeded", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self._jobs[job_id]
+    
+    @staticmethod
+    def _public(job):
+        """Job record without internal fields"""
+        return {k: v for k, v in job.items() if k != "key"}
@@ -9,6 +9,128 @@ import yaml
 import numpy as np
 from datetime import datetime
 from pathlib import Path
+from numpy.lib.format import open_memmap
+
+from src.ndvi_archive import NDVIArchive
+
+# NDVI differences lie in [-2, 2]
+CHANGE_RANGE = 2.0
+
+
+def _linear_coords(n_out, n_in):
+    """
+    Source indices and weights for linear resampling of an axis
+    
+    Uses the corner-aligned mapping of scipy.ndimage.zoom(order=1):
+    output i samples input i * (n_in - 1) / (n_out - 1).
+    
+    Returns:
+        lo, hi (int arrays) and frac (weight of hi)
+    """
+    if n_out == 1 or n_in == 1:
+        zeros = np.zeros(n_out, dtype=np.intp)
+        return zeros, zeros, np.zeros(n_out, dtype=np.float32)
+    
+    coords = np.arange(n_out) * ((n_in - 1) / (n_out - 1))
+    lo = np.minimum(np.floor(coords).astype(np.intp), n_in - 2)
+    return lo, lo + 1, (coords - lo).astype(np.float32)
+
+
+class ChangeStatistics:
+    """
+    Online statistics of an NDVI change map, fed one block of rows at a time
+    
+    Keeps counts and sums (mean change), a fixed-bin histogram over
+    [-2, 2] (percentiles of the absolute change, to one bin width) and
+    per-zone sums for square zones of zone_size pixels.
+    """
+    
+    def __init__(self, shape, zone_size, threshold, bins=400):
+        """
+        Raises:
+            ValueError: If bins is not a positive even number (the histogram
+                is folded around 0 for |change| percentiles)
+        """
+        if bins <= 0 or bins % 2:
+            raise ValueError(f"histogram_bins must be a positive even number, got {bins}")
+        
+        self.shape = shape
+        self.zone_size = zone_size
+        self.threshold = threshold
+        self.bins = bins
+        self.bin_width = 2 * CHANGE_RANGE / bins
+        
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        n_zones = (-(-shape[0] // zone_size), -(-shape[1] // zone_size))
+        self.zone_count = np.zeros(n_zones, dtype=np.int64)
+        self.zone_sum = np.zeros(n_zones, dtype=np.float64)
+        self.zone_abs_sum = np.zeros(n_zones, dtype=np.float64)
+        self.zone_changed = np.zeros(n_zones, dtype=np.int64)
+        self._zone_edges = np.arange(0, shape[1], zone_size)
+    
+    def update(self, row_start, change):
+        """Accumulate a (rows, W) block of changes starting at row_start"""
+        valid = np.isfinite(change)
+        change = np.where(valid, change, 0.0)
+        abs_change = np.abs(change)
+        changed = valid & (abs_change > self.threshold)
+        
+        bin_index = ((change[valid] + CHANGE_RANGE) / self.bin_width).astype(np.intp)
+        np.clip(bin_index, 0, self.bins - 1, out=bin_index)
+        self.histogram += np.bincount(bin_index, minlength=self.bins)
+        
+        # Zone rows covered by the block, then per-zone column sums
+        zone_rows = np.arange(row_start, row_start + len(change)) // self.zone_size
+        for zone_row in np.unique(zone_rows):
+            rows = zone_rows == zone_row
+            for total, values in ((self.zone_count, valid), (self.zone_sum, change),
+                                  (self.zone_abs_sum, abs_change), (self.zone_changed, changed)):
+                total[zone_row] += np.add.reduceat(values[rows].sum(axis=0), self._zone_edges)
+    
+    def percentile(self, q):
+        """q-th percentile of |change| from the histogram (bin upper edge)"""
+        half = self.bins // 2
+        # Fold the signed histogram around 0 onto |change| bins
+        abs_histogram = self.histogram[half:] + self.histogram[:half][::-1]
+        total = abs_histogram.sum()
+        if total == 0:
+            return None
+        index = np.searchsorted(np.cumsum(abs_histogram), q / 100 * total)
+        return round(float((min(index, half - 1) + 1) * self.bin_width), 6)
+    
+    def summary(self):
+        """JSON-serialisable statistics for the whole scene and per zone"""
+        count = int(self.zone_count.sum())
+        if count == 0:
+            return None
+        
+        zones = []
+        for (zone_row, zone_col), n in np.ndenumerate(self.zone_count):
+            if n == 0:
+                continue
+            zones.append({
+                "row": int(zone_row * self.zone_size),
+                "col": int(zone_col * self.zone_size),
+                "size": self.zone_size,
+                "valid_pixels": int(n),
+                "mean_change": float(self.zone_sum[zone_row, zone_col] / n),
+                "mean_abs_change": float(self.zone_abs_sum[zone_row, zone_col] / n),
+                "changed_fraction": float(self.zone_changed[zone_row, zone_col] / n)
+            })
+        
+        return {
+            "shape": list(self.shape),
+            "valid_pixels": count,
+            "mean_change": float(self.zone_sum.sum() / count),
+            "mean_abs_change": float(self.zone_abs_sum.sum() / count),
+            "changed_fraction": float(self.zone_changed.sum() / count),
+            "abs_change_percentiles": {f"p{q}": self.percentile(q) for q in (50, 90, 99)},
+            "histogram": {"range": [-CHANGE_RANGE, CHANGE_RANGE], "counts": self.histogram.tolist()},
+            "zone_size": self.zone_size,
+            "zones_over_threshold": sum(zone["mean_abs_change"] > self.threshold for zone in zones),
+            "zones": zones
+        }
+
 
 class MCPTrigger:
     """MCP system to trigger model updates based on NDVI changes"""
@@ -20,44 +142,127 @@ class MCPTrigger:
         self.output_dir = self.config['paths']['output_dir']
         self.threshold = self.config['pipeline']['ndvi_change_threshold']
         self.dashboard_path = os.path.join(self.output_dir, "dashboard_data.json")
+        self.previous_ndvi_path = os.path.join(self.output_dir, "ndvi_previous.npy")
+        self.summary_path = os.path.join(self.output_dir, "ndvi_change_summary.json")
+        
+        # Change maps are streamed one row of zones at a time
+        change_detection = self.config['pipeline'].get('change_detection', {})
+        self.zone_size = change_detection.get('zone_size', 512)
+        self.histogram_bins = change_detection.get('histogram_bins', 400)
+        if self.histogram_bins <= 0 or self.histogram_bins % 2:
+            # Checked up front rather than in the middle of the weekly run
+            raise ValueError("pipeline.change_detection.histogram_bins must be a positive even "
+                             f"number, got {self.histogram_bins}")
+        
+        # Weekly NDVI/NDRE history (src/ndvi_archive.py)
+        archive = self.config['pipeline'].get('archive', {})
+        self.archive_enabled = archive.get('enabled', True)
+        self.archive_path = archive.get('path', os.path.join(self.output_dir, "ndvi_archive"))
+        self.archive_chunks = tuple(archive.get('chunks', (8, 256, 256)))
+        self.archive_compression = archive.get('compression_level', 5)
         
         os.makedirs(self.output_dir, exist_ok=True)
     
     def load_previous_ndvi(self):
-        """Load previous week's NDVI"""
-        prev_ndvi_path = os.path.join(self.output_dir, "ndvi_previous.npy")
-        if os.path.exists(prev_ndvi_path):
-            return np.load(prev_ndvi_path)
+        """Load previous week's NDVI (memory-mapped)"""
+        if os.path.exists(self.previous_ndvi_path):
+            return np.load(self.previous_ndvi_path, mmap_mode='r')
         return None
     
     def save_current_ndvi(self, ndvi):
-        """Save current NDVI as previous for next week"""
-        prev_ndvi_path = os.path.join(self.output_dir, "ndvi_previous.npy")
-        np.save(prev_ndvi_path, ndvi)
+        """
+        Save current NDVI as previous for next week
+        
+        Copied block by block into a new file that then replaces the old
+        one, so a memory-mapped previous NDVI is never overwritten in place.
+        """
+        tmp_path = f"{self.previous_ndvi_path}.tmp"
+        saved = open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=ndvi.shape)
+        for row in range(0, ndvi.shape[0], self.zone_size):
+            saved[row:row + self.zone_size] = ndvi[row:row + self.zone_size]
+        saved.flush()
+        del saved
+        os.replace(tmp_path, self.previous_ndvi_path)
+    
+    def archive_week(self, ndvi, ndre=None, when=None):
+        """
+        Append this week's NDVI (and NDRE) to the time-series archive
+        
+        Unlike ndvi_previous.npy, which only holds the last triggering week,
+        the archive keeps every week for trend queries.
+        
+        Returns:
+            The NDVIArchive, or None if archiving is disabled or failed
+        """
+        if not self.archive_enabled:
+            return None
+        
+        arrays = {'ndvi': ndvi}
+        if ndre is not None:
+            arrays['ndre'] = ndre
+        try:
+            archive = NDVIArchive(self.archive_path, shape=ndvi.shape, chunks=self.archive_chunks,
+                                  compression_level=self.archive_compression)
+            archive.append(when or datetime.now(), **arrays)
+        except ValueError as e:
+            print(f"Warning: NDVI not archived: {e}")
+            return None
+        
+        print(f"NDVI archived to {self.archive_path} ({len(archive.dates)} dates)")
+        return archive
+    
+    def iter_change_blocks(self, current_ndvi, previous_ndvi):
+        """
+        Yield (row_start, change block) over the scene, zone_size rows at a time
+        
+        A previous NDVI on another grid is resampled linearly per block,
+        reading only the source rows the block needs.
+        """
+        h, w = current_ndvi.shape
+        resample = current_ndvi.shape != previous_ndvi.shape
+        if resample:
+            row_lo, row_hi, row_frac = _linear_coords(h, previous_ndvi.shape[0])
+            col_lo, col_hi, col_frac = _linear_coords(w, previous_ndvi.shape[1])
+        
+        for row in range(0, h, self.zone_size):
+            stop = min(row + self.zone_size, h)
+            current = np.asarray(current_ndvi[row:stop], dtype=np.float32)
+            
+            if resample:
+                lo, hi, frac = row_lo[row:stop], row_hi[row:stop], row_frac[row:stop, None]
+                first = lo.min()
+                source = np.asarray(previous_ndvi[first:hi.max() + 1], dtype=np.float32)
+                rows = source[lo - first] * (1 - frac) + source[hi - first] * frac
+                previous = rows[:, col_lo] * (1 - col_frac) + rows[:, col_hi] * col_frac
+            else:
+                previous = np.asarray(previous_ndvi[row:stop], dtype=np.float32)
+            
+            yield row, current - previous
     
     def calculate_ndvi_change(self, current_ndvi, previous_ndvi):
         """
         Calculate NDVI change between current and previous week
         
+        Both inputs may be memory-mapped: the change is computed and
+        accumulated block by block, so peak memory is a few blocks of
+        zone_size rows whatever the scene size.
+        
         Returns:
             mean_change: Mean absolute change
-            change_map: Pixel-wise change map
+            summary: ChangeStatistics.summary() (percentiles, histogram, zones)
         """
         if previous_ndvi is None:
             return None, None
         
-        # Resize if shapes don't match
-        if current_ndvi.shape != previous_ndvi.shape:
-            from scipy.ndimage import zoom
-            zoom_factors = (current_ndvi.shape[0] / previous_ndvi.shape[0],
-                          current_ndvi.shape[1] / previous_ndvi.shape[1])
-            previous_ndvi = zoom(previous_ndvi, zoom_factors, order=1)
+        statistics = ChangeStatistics(current_ndvi.shape, self.zone_size, self.threshold,
+                                      bins=self.histogram_bins)
+        for row, change in self.iter_change_blocks(current_ndvi, previous_ndvi):
+            statistics.update(row, change)
         
-        # Calculate change
-        change_map = current_ndvi - previous_ndvi
-        mean_change = np.nanmean(np.abs(change_map))
-        
-        return mean_change, change_map
+        summary = statistics.summary()
+        if summary is None:
+            return None, None
+        return summary["mean_abs_change"], summary
     
     def should_trigger(self, mean_change):
         """
@@ -96,6 +301,17 @@ class MCPTrigger:
         print(f"Dashboard updated: {self.dashboard_path}")
         return dashboard_data
     
+    def _summary_info(self, summary):
+        """Headline change statistics for change_info (full summary is on disk)"""
+        if summary is None:
+            return {}
+        return {
+            "abs_change_percentiles": summary["abs_change_percentiles"],
+            "changed_fraction": summary["changed_fraction"],
+            "zones_over_threshold": summary["zones_over_threshold"],
+            "summary_path": self.summary_path
+        }
+    
     def trigger_classification(self, current_ndvi, report_data):
         """
         MCP trigger logic: Check NDVI change and trigger updates if needed
@@ -116,11 +332,15 @@ class MCPTrigger:
         previous_ndvi = self.load_previous_ndvi()
         
         # Calculate change
-        mean_change, change_map = self.calculate_ndvi_change(current_ndvi, previous_ndvi)
+        mean_change, summary = self.calculate_ndvi_change(current_ndvi, previous_ndvi)
         
         if mean_change is not None:
             print(f"Mean NDVI change: {mean_change:.4f}")
             print(f"Threshold: {self.threshold}")
+            print(f"Zones over threshold: {summary['zones_over_threshold']}/{len(summary['zones'])}")
+            
+            with open(self.summary_path, 'w') as f:
+                json.dump(summary, f, indent=2)
         
         # Check if should trigger
         should_trigger = self.should_trigger(mean_change)
@@ -138,6 +358,7 @@ class MCPTrigger:
                 "triggered": True,
                 "mean_change": float(mean_change) if mean_change is not None else None,
                 "threshold": self.threshold,
+                **self._summary_info(summary),
                 "timestamp": datetime.now().isoformat()
             }
             
@@ -149,6 +370,7 @@ class MCPTrigger:
                 "triggered": False,
                 "mean_change": float(mean_change) if mean_change is not None else None,
                 "threshold": self.threshold,
+                **self._summary_info(summary),
                 "timestamp": datetime.now().isoformat()
             }
             
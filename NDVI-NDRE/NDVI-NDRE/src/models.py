@@ -9,13 +9,18 @@ import pandas as pd
 from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report, r2_score, mean_squared_error
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
 import pickle
 import os
+import json
 import yaml
 from pathlib import Path
+from src.forest_inference import FlatForest
+from src.cnn_runtime import LiteClassifier, TFLITE_QUANTIZATIONS
+from src.shards import read_manifest, open_shard, write_shards
+from src.generate_data import N_BANDS, fill_patches, load_soil_data
+
+# TensorFlow is imported inside the methods that need it: importing it costs
+# seconds and hundreds of MB, and exported models are served without it.
 
 class GrowthStageClassifier:
     """CNN model for classifying potato crop growth stages"""
@@ -27,6 +32,10 @@ class GrowthStageClassifier:
         self.model_path = self.config['models']['cnn']['model_path']
         self.input_shape = tuple(self.config['models']['cnn']['input_shape'])
         self.num_classes = self.config['models']['cnn'].get('num_classes', 3)  # Default to 3 stages
+        self.runtime = self.config['models']['cnn'].get('runtime', 'keras')
+        self.tflite_quantization = self.config['models']['cnn'].get('tflite_quantization', 'int8')
+        self.inference_threads = self.config['models']['cnn'].get('inference_threads')
+        self.training_config = self.config['models']['cnn'].get('training', {})
         self.model = None
         
         # Ensure models directory exists
@@ -34,6 +43,9 @@ class GrowthStageClassifier:
     
     def build_model(self):
         """Build CNN architecture"""
+        from tensorflow import keras
+        from tensorflow.keras import layers
+        
         model = keras.Sequential([
             layers.Conv2D(32, (3, 3), activation='relu', input_shape=self.input_shape),
             layers.MaxPooling2D((2, 2)),
@@ -45,7 +57,8 @@ class GrowthStageClassifier:
             layers.Dropout(0.5),
             layers.Dense(256, activation='relu'),
             layers.Dropout(0.5),
-            layers.Dense(self.num_classes, activation='softmax')
+            # Softmax stays float32 under mixed precision for stable probabilities
+            layers.Dense(self.num_classes, activation='softmax', dtype='float32')
         ])
         
         model.compile(
@@ -68,7 +81,9 @@ class GrowthStageClassifier:
             batch_size: Batch size
             validation_split: Validation split ratio
         """
-        if self.model is None:
+        from tensorflow import keras
+        
+        if self.model is None or isinstance(self.model, LiteClassifier):
             self.build_model()
         
         # Callbacks
@@ -94,20 +109,257 @@ class GrowthStageClassifier:
         print(f"Best validation accuracy: {max(history.history['val_accuracy']):.4f}")
         return history
     
-    def predict(self, X):
+    def _shard_blocks(self, manifest, block_size):
+        """(shard index, start, stop) of every block of samples in a sharded dataset"""
+        blocks = []
+        for index, shard in enumerate(manifest['shards']):
+            for start in range(0, shard['n_samples'], block_size):
+                blocks.append((index, start, min(start + block_size, shard['n_samples'])))
+        return np.array(blocks, dtype=np.int64).reshape(-1, 3)
+    
+    def streaming_dataset(self, shard_dir, blocks, batch_size=32, training=True, cache=None):
+        """
+        tf.data pipeline over a sharded patch dataset (see src/shards.py)
+        
+        Blocks of patches are sliced from memory-mapped shards and cast to
+        float32 by parallel map calls, so only the shuffle buffer and the
+        prefetched batches are ever resident.
+        
+        Args:
+            shard_dir: Directory written by ShardWriter with `patches` and
+                integer `labels` fields
+            blocks: (shard index, start, stop) rows to read
+            batch_size: Training batch size
+            training: Shuffle blocks and samples every epoch
+            cache: None (off), "memory", or a file path prefix for
+                tf.data's on-disk cache of decoded blocks
+        
+        Returns:
+            tf.data.Dataset of (patches, one-hot labels) batches
+        """
+        import tensorflow as tf
+        
+        manifest = read_manifest(shard_dir)
+        shards = manifest['shards']
+        patch_shape = tuple(manifest['fields']['patches']['shape'])
+        shuffle_buffer = self.training_config.get('shuffle_buffer', 8192)
+        eye = np.eye(self.num_classes, dtype=np.float32)
+        handles = {}  # shard index -> memmaps, opened on first use
+        
+        def load_block(shard_index, start, stop):
+            shard_index = int(shard_index)
+            if shard_index not in handles:
+                handles[shard_index] = open_shard(shard_dir, shards[shard_index],
+                                                  fields=('patches', 'labels'))
+            shard = handles[shard_index]
+            patches = np.asarray(shard['patches'][start:stop], dtype=np.float32)
+            return patches, eye[shard['labels'][start:stop]]
+        
+        def read(shard_index, start, stop):
+            patches, labels = tf.numpy_function(load_block, [shard_index, start, stop],
+                                                (tf.float32, tf.float32))
+            patches.set_shape((None,) + patch_shape)
+            labels.set_shape((None, self.num_classes))
+            return patches, labels
+        
+        dataset = tf.data.Dataset.from_tensor_slices((blocks[:, 0], blocks[:, 1], blocks[:, 2]))
+        if training and not cache:
+            # Cached blocks come back in cache order; the sample shuffle below still applies
+            dataset = dataset.shuffle(len(blocks), reshuffle_each_iteration=True)
+        dataset = dataset.map(read, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not training)
+        if cache:
+            dataset = dataset.cache('' if cache == 'memory' else cache)
+        dataset = dataset.unbatch()
+        if training:
+            dataset = dataset.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+        return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    
+    def train_streaming(self, shard_dir, epochs=50, batch_size=32, validation_fraction=None,
+                        mixed_precision=None):
+        """
+        Train the CNN from sharded on-disk patches instead of one in-memory array
+        
+        Validation holds out whole blocks, so no copy of the data is made.
+        
+        Args:
+            shard_dir: Sharded patch dataset (see src/shards.py)
+            epochs: Training epochs
+            batch_size: Batch size
+            validation_fraction: Fraction of blocks held out for validation
+            mixed_precision: Train with float16 compute / float32 weights
+                (defaults to models.cnn.training.mixed_precision)
+        """
+        from tensorflow import keras
+        
+        if validation_fraction is None:
+            validation_fraction = self.training_config.get('validation_fraction', 0.2)
+        if mixed_precision is None:
+            mixed_precision = self.training_config.get('mixed_precision', False)
+        cache = self.training_config.get('cache') or None
+        
+        manifest = read_manifest(shard_dir)
+        blocks = self._shard_blocks(manifest, self.training_config.get('block_size', 256))
+        np.random.default_rng(42).shuffle(blocks)
+        n_val = int(round(len(blocks) * validation_fraction))
+        val_blocks, train_blocks = blocks[:n_val], blocks[n_val:]
+        print(f"Streaming {manifest['n_samples']} patches from {len(manifest['shards'])} shards "
+              f"({len(train_blocks)} train / {len(val_blocks)} validation blocks)")
+        
+        train_ds = self.streaming_dataset(shard_dir, train_blocks, batch_size, training=True,
+                                          cache=cache)
+        val_ds = None
+        if n_val:
+            val_ds = self.streaming_dataset(shard_dir, val_blocks, batch_size, training=False,
+                                            cache=f"{cache}_val" if cache and cache != 'memory' else cache)
+        
+        policy = keras.mixed_precision.global_policy()
+        if mixed_precision:
+            keras.mixed_precision.set_global_policy('mixed_float16')
+        try:
+            self.build_model()
+        finally:
+            keras.mixed_precision.set_global_policy(policy)
+        
+        monitor = 'val_accuracy' if val_ds is not None else 'accuracy'
+        callbacks = [
+            keras.callbacks.EarlyStopping(monitor='val_loss' if val_ds is not None else 'loss',
+                                          patience=10, restore_best_weights=True),
+            keras.callbacks.ModelCheckpoint(
+                self.model_path,
+                save_best_only=True,
+                monitor=monitor
+            )
+        ]
+        
+        history = self.model.fit(
+            train_ds,
+            epochs=epochs,
+            validation_data=val_ds,
+            callbacks=callbacks,
+            verbose=1
+        )
+        
+        print(f"Best {monitor}: {max(history.history[monitor]):.4f}")
+        return history
+    
+    def export_path(self, fmt, quantization=None):
+        """Path of an exported model, e.g. models/potato_growth_cnn.int8.tflite"""
+        base = os.path.splitext(self.model_path)[0]
+        if fmt == 'tflite':
+            return f"{base}.{quantization or self.tflite_quantization}.tflite"
+        return f"{base}.{fmt}"
+    
+    def _exported_model_path(self):
+        """Exported model to serve for the configured runtime, or None for Keras"""
+        if self.runtime == 'keras':
+            return None
+        if self.runtime not in ('auto', 'tflite', 'onnx'):
+            raise ValueError(f"Unknown cnn runtime '{self.runtime}'")
+        
+        formats = ['tflite', 'onnx'] if self.runtime == 'auto' else [self.runtime]
+        for fmt in formats:
+            path = self.export_path(fmt)
+            if not os.path.exists(path):
+                continue
+            if os.path.exists(self.model_path) and \
+                    os.path.getmtime(self.model_path) > os.path.getmtime(path):
+                print(f"Warning: {path} is older than {self.model_path}, skipping it")
+                continue
+            return path
+        
+        if self.runtime != 'auto':
+            print(f"Warning: no current {self.runtime} export found. Falling back to Keras.")
+        return None
+    
+    def _load(self):
+        """
+        Load the exported model if available, else the Keras model
+        
+        Raises:
+            ValueError: If the model was trained on patches with another
+                number of bands than the pipeline stacks
+        """
+        path = self._exported_model_path()
+        if path:
+            print(f"Loading exported CNN {path}")
+            model = LiteClassifier(path, num_threads=self.inference_threads)
+        else:
+            from tensorflow import keras
+            path = self.model_path
+            model = keras.models.load_model(path)
+        
+        channels = model.input_shape[-1]
+        if channels != N_BANDS:
+            raise ValueError(f"CNN {path} expects {channels}-band patches but the pipeline "
+                             f"stacks {N_BANDS} bands; retrain it (python -m src.models --train)")
+        return model
+    
+    def predict(self, X, batch_size=32, verbose='auto'):
         """Predict growth stages"""
         if self.model is None:
-            self.model = keras.models.load_model(self.model_path)
+            self.model = self._load()
         
-        predictions = self.model.predict(X)
+        predictions = self.model.predict(X, batch_size=batch_size, verbose=verbose)
         return np.argmax(predictions, axis=1), predictions
     
     def load_model(self):
         """Load trained model"""
-        if os.path.exists(self.model_path):
-            self.model = keras.models.load_model(self.model_path)
+        if os.path.exists(self.model_path) or self._exported_model_path():
+            self.model = self._load()
             return True
         return False
+    
+    def export(self, X_calibration, X_eval=None, y_eval=None,
+               quantizations=('float16', 'int8'), onnx=False):
+        """
+        Export the trained Keras model for the lightweight runtime
+        
+        Args:
+            X_calibration: Patches used to calibrate int8 quantization
+            X_eval, y_eval: Patches and integer labels for the accuracy report
+                (defaults to the calibration patches, without accuracy)
+            quantizations: TFLite variants to write
+            onnx: Also write an ONNX model (requires tf2onnx)
+        
+        Returns:
+            Report dict of exported paths and accuracy deltas vs. Keras
+        """
+        from tensorflow import keras
+        from src.cnn_runtime import export_tflite, export_onnx, compare_models
+        
+        keras_model = keras.models.load_model(self.model_path)
+        exported = {}
+        
+        for quantization in quantizations:
+            if quantization not in TFLITE_QUANTIZATIONS:
+                raise ValueError(f"Unknown quantization '{quantization}'")
+            path = export_tflite(keras_model, self.export_path('tflite', quantization),
+                                 quantization=quantization, representative_data=X_calibration)
+            exported[f"tflite_{quantization}"] = path
+            print(f"Exported {path}")
+        
+        if onnx:
+            try:
+                path = export_onnx(keras_model, self.export_path('onnx'))
+                exported["onnx"] = path
+                print(f"Exported {path}")
+            except ImportError:
+                print("Warning: tf2onnx not available. Skipping ONNX export.")
+        
+        if X_eval is None:
+            X_eval = X_calibration
+        
+        print("Accuracy vs. Keras:")
+        candidates = {name: LiteClassifier(path, num_threads=self.inference_threads)
+                      for name, path in exported.items()}
+        report = compare_models(keras_model, candidates, X_eval, y_eval)
+        
+        report_path = f"{os.path.splitext(self.model_path)[0]}_export_report.json"
+        with open(report_path, 'w') as f:
+            json.dump({"exported": exported, "metrics": report}, f, indent=2)
+        print(f"Export report saved to {report_path}")
+        
+        return {"exported": exported, "metrics": report}
 
 
 class NitrogenPredictor:
@@ -118,8 +370,13 @@ class NitrogenPredictor:
             self.config = yaml.safe_load(f)
         
         self.model_path = self.config['models']['random_forest']['model_path']
+        self.artifact_path = self.config['models']['random_forest'].get('artifact_path')
         self.n_estimators = self.config['models']['random_forest']['n_estimators']
         self.max_depth = self.config['models']['random_forest']['max_depth']
+        self.backend = self.config['models']['random_forest'].get('backend', 'sklearn')
+        self.inference_threads = self.config['models']['random_forest'].get('inference_threads', 1)
+        self.feature_percentiles = self.config['models']['random_forest'].get(
+            'features', {}).get('percentiles', [10, 50, 90])
         self.model = None
         
         os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
@@ -163,126 +420,193 @@ class NitrogenPredictor:
         with open(self.model_path, 'wb') as f:
             pickle.dump(self.model, f)
         
+        if self.artifact_path:
+            FlatForest.from_sklearn(self.model).save(
+                self.artifact_path,
+                metadata={"source": self.model_path, "train_r2": train_r2, "test_r2": test_r2}
+            )
+            print(f"Flat forest artifact saved to {self.artifact_path}")
+        
+        self.model = self._inference_model(self.model)
+        
         return train_r2, test_r2
     
+    def patch_features(self, patches, ndvi=None, ndre=None):
+        """Features of (N, H, W, C) patches with the configured percentiles"""
+        return extract_patch_features(patches, ndvi=ndvi, ndre=ndre,
+                                      percentiles=self.feature_percentiles)
+    
+    def _inference_model(self, model):
+        """Wrap the fitted forest in the configured inference backend"""
+        if self.backend == 'flat':
+            return FlatForest.from_sklearn(model, n_threads=self.inference_threads)
+        if self.backend != 'sklearn':
+            raise ValueError(f"Unknown random_forest backend '{self.backend}'")
+        return model
+    
+    def _artifact_is_current(self):
+        """True if the flat artifact exists and is not older than the pickle"""
+        if not (self.artifact_path and os.path.exists(os.path.join(self.artifact_path, "manifest.json"))):
+            return False
+        if os.path.exists(self.model_path):
+            manifest_mtime = os.path.getmtime(os.path.join(self.artifact_path, "manifest.json"))
+            if os.path.getmtime(self.model_path) > manifest_mtime:
+                print(f"Warning: {self.artifact_path} is older than {self.model_path}, "
+                      f"loading the pickle instead")
+                return False
+        return True
+    
+    def _load(self):
+        """
+        Load the trained model, preferring the memory-mapped flat artifact
+        
+        The artifact loads in milliseconds and its pages are shared between
+        processes; the pickle is only deserialised for the sklearn backend
+        or when no current artifact exists.
+        
+        Raises:
+            ValueError: If a patch-feature model was trained on patches with
+                another number of bands than the pipeline stacks
+        """
+        model = None
+        if self.backend == 'flat' and self._artifact_is_current():
+            try:
+                model = FlatForest.load(self.artifact_path, n_threads=self.inference_threads)
+            except ValueError as e:
+                print(f"Warning: {e}. Loading the pickle instead")
+        
+        if model is None:
+            with open(self.model_path, 'rb') as f:
+                model = self._inference_model(pickle.load(f))
+        
+        # Pixel models take (NDVI, NDRE); patch-feature models depend on the band count
+        n_features = 2 + N_BANDS * (2 + len(self.feature_percentiles))
+        if model.n_features_in_ not in (2, n_features):
+            raise ValueError(f"Nitrogen model {self.model_path} expects {model.n_features_in_} "
+                             f"features but {N_BANDS}-band patches give {n_features}; "
+                             f"retrain it (python -m src.models --train)")
+        return model
+    
     def predict(self, X):
         """Predict Nitrogen levels"""
         if self.model is None:
-            with open(self.model_path, 'rb') as f:
-                self.model = pickle.load(f)
+            self.model = self._load()
         
         predictions = self.model.predict(X)
         return predictions
     
     def load_model(self):
         """Load trained model"""
-        if os.path.exists(self.model_path):
-            with open(self.model_path, 'rb') as f:
-                self.model = pickle.load(f)
+        if os.path.exists(self.model_path) or self._artifact_is_current():
+            self.model = self._load()
             return True
         return False
 
 
-def create_synthetic_dataset(n_samples=200, patch_size=64, data_dir="data"):
+def extract_patch_features(patches, ndvi=None, ndre=None, percentiles=(10, 50, 90),
+                           red=2, nir=3, rededge=4, batch_size=256):
+    """
+    Nitrogen model features for a batch of patches
+    
+    Each batch is reduced over its pixel axis in one pass: per-band mean,
+    std and percentiles, plus patch-level NDVI/NDRE (mean of the per-pixel
+    indices). Training and WeeklyPipeline.predict_nitrogen both use this
+    function, so the feature layout cannot drift between them.
+    
+    Args:
+        patches: (N, H, W, C) array or memmap of band DNs
+        ndvi, ndre: Optional (N,) patch-level values replacing the computed ones
+        percentiles: Per-band percentiles to include
+        red, nir, rededge: Channel positions of B04, B08 and B05
+        batch_size: Patches reduced at a time (bounds float32 temporaries)
+    
+    Returns:
+        (N, 2 + C * (2 + len(percentiles))) float32 array laid out as
+        [ndvi, ndre, mean per band, std per band, each percentile per band]
     """
-    Create synthetic training dataset from generated CSV data
-    Uses synthetic_soil_data.csv for realistic correlations
+    n, h, w, c = patches.shape
+    percentiles = list(percentiles)
+    features = np.empty((n, 2 + c * (2 + len(percentiles))), dtype=np.float32)
+    
+    def mean_index(a, b):
+        """Per-patch mean of (a - b) / (a + b), ignoring undefined pixels"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index = (a - b) / (a + b)
+            valid = np.isfinite(index)
+            return np.where(valid, index, 0).sum(axis=1) / valid.sum(axis=1)
+    
+    for start in range(0, n, batch_size):
+        stop = min(start + batch_size, n)
+        pixels = np.asarray(patches[start:stop], dtype=np.float32).reshape(stop - start, h * w, c)
+        
+        features[start:stop, 0] = mean_index(pixels[:, :, nir], pixels[:, :, red])
+        features[start:stop, 1] = mean_index(pixels[:, :, nir], pixels[:, :, rededge])
+        features[start:stop, 2:2 + c] = pixels.mean(axis=1)
+        features[start:stop, 2 + c:2 + 2 * c] = pixels.std(axis=1)
+        if percentiles:
+            # (P, B, C) -> (B, P * C), percentile-major like the docstring layout
+            values = np.percentile(pixels, percentiles, axis=1)
+            features[start:stop, 2 + 2 * c:] = values.transpose(1, 0, 2).reshape(stop - start, -1)
+    
+    if ndvi is not None:
+        features[:, 0] = ndvi
+    if ndre is not None:
+        features[:, 1] = ndre
+    
+    return features
+
+
+def create_synthetic_dataset(n_samples=200, patch_size=64, data_dir="data", seed=42):
+    """
+    Create synthetic training dataset from generated soil data
+    Uses synthetic_soil_data (.parquet or .csv) for realistic correlations
     In production, use real labeled data from field surveys
+    
+    Patches are generated vectorized into one preallocated float32 array
+    (see generate_data.fill_patches).
     """
     print(f"Loading synthetic dataset from {data_dir}...")
     
     import pandas as pd
     
-    # Try to load from CSV first
-    csv_path = os.path.join(data_dir, "synthetic_soil_data.csv")
-    if os.path.exists(csv_path):
-        print(f"Loading data from {csv_path}")
-        df = pd.read_csv(csv_path)
-        
-        # Map growth stages to integers
-        stage_map = {
-            'Vegetative': 0,
-            'Tuber Initiation': 1,
-            'Bulking': 2
-        }
+    rng = np.random.default_rng(seed)
+    
+    # Try to load the soil data first
+    df = load_soil_data(data_dir, columns=['growth_stage', 'N', 'NDVI'])
+    if df is not None:
+        print(f"Loaded {len(df)} soil data rows from {data_dir}")
         
         # Limit to available samples
         n_samples = min(n_samples, len(df))
-        df = df.sample(n=n_samples, random_state=42).reset_index(drop=True)
-        
-        patches = []
-        labels = []
-        nitrogen_values = []
-        
-        np.random.seed(42)
-        
-        for i in range(n_samples):
-            row = df.iloc[i]
-            
-            # Generate patch (13 bands for Sentinel-2)
-            patch = np.random.rand(patch_size, patch_size, 13) * 10000
-            
-            # Adjust patch based on NDVI and growth stage
-            ndvi_factor = row['NDVI']
-            stage = row['growth_stage']
-            nitrogen = row['N']
-            
-            # Simulate realistic band values based on NDVI
-            # NIR (B08) - higher for vegetation
-            patch[:, :, 3] = patch[:, :, 3] * (1 + ndvi_factor * 2)
-            # Red (B04) - lower for vegetation
-            patch[:, :, 2] = patch[:, :, 2] * (1 - ndvi_factor * 0.5)
-            
-            # Add stage-specific characteristics
-            if stage == 'Vegetative':
-                patch[:, :, 1] = patch[:, :, 1] * 1.2  # More green
-            elif stage == 'Bulking':
-                patch[:, :, 4] = patch[:, :, 4] * 1.3  # More red edge
-            
-            patches.append(patch)
-            labels.append(stage_map[stage])
-            nitrogen_values.append(nitrogen)
-        
-        patches = np.array(patches)
-        labels = np.array(labels)
-        nitrogen_values = np.array(nitrogen_values)
+        df = df.sample(n=n_samples, random_state=seed).reset_index(drop=True)
+        
+        # Map growth stages to integers
+        labels = df['growth_stage'].cat.codes.to_numpy(dtype=np.int64)
+        nitrogen_values = df['N'].to_numpy()
+        # Patches are adjusted by NDVI and growth stage
+        ndvi = df['NDVI'].to_numpy(dtype=np.float32)
         
     else:
-        # Fallback: Generate synthetic patches without CSV
-        print("CSV not found. Generating synthetic patches...")
-        patches = []
-        labels = []
-        nitrogen_values = []
-        
-        np.random.seed(42)
-        
-        for i in range(n_samples):
-            # Random patch (simulating 13-band Sentinel-2 data)
-            patch = np.random.rand(patch_size, patch_size, 13) * 10000
-            
-            # Simulate growth stage (0-2 for 3 stages)
-            stage = np.random.randint(0, 3)
-            labels.append(stage)
-            
-            # Simulate Nitrogen based on stage and NDVI
-            ndvi = np.random.uniform(0.3, 0.8)
-            if stage == 0:  # Vegetative
-                nitrogen = 120 + ndvi * 40 + np.random.normal(0, 10)
-            elif stage == 1:  # Tuber Initiation
-                nitrogen = 140 + ndvi * 50 + np.random.normal(0, 10)
-            else:  # Bulking
-                nitrogen = 160 + ndvi * 60 + np.random.normal(0, 10)
-            
-            nitrogen_values.append(max(60, min(200, nitrogen)))  # Clip to realistic range
-            patches.append(patch)
-        
-        patches = np.array(patches)
-        labels = np.array(labels)
-        nitrogen_values = np.array(nitrogen_values)
+        # Fallback: Generate synthetic patches without soil data
+        print("Soil data not found. Generating synthetic patches...")
+        
+        # Simulate growth stage (0-2 for 3 stages) and Nitrogen based on stage and NDVI
+        labels = rng.integers(0, 3, n_samples)
+        simulated_ndvi = rng.uniform(0.3, 0.8, n_samples)
+        base = np.array([120, 140, 160])[labels]
+        slope = np.array([40, 50, 60])[labels]
+        nitrogen = base + simulated_ndvi * slope + rng.normal(0, 10, n_samples)
+        nitrogen_values = np.clip(nitrogen, 60, 200)  # Clip to realistic range
+        # Random patches, not adjusted
+        ndvi = np.full(n_samples, np.nan, dtype=np.float32)
+    
+    # Generate patches with the pipeline's band stack (ImageProcessor.BAND_SPECS)
+    patches = np.empty((n_samples, patch_size, patch_size, N_BANDS), dtype=np.float32)
+    fill_patches(patches, ndvi, labels, rng)
     
     # One-hot encode labels (3 classes: Vegetative, Tuber Initiation, Bulking)
     num_classes = 3
-    labels_onehot = keras.utils.to_categorical(labels, num_classes)
+    labels_onehot = np.eye(num_classes, dtype=np.float32)[labels]
     
     return patches, labels_onehot, labels, nitrogen_values
 
@@ -295,9 +619,36 @@ if __name__ == "__main__":
     parser.add_argument("--samples", type=int, default=200, help="Number of training samples")
     parser.add_argument("--epochs", type=int, default=50, help="Training epochs for CNN")
     parser.add_argument("--data-dir", type=str, default="data", help="Data directory")
+    parser.add_argument("--export", action="store_true",
+                        help="Export the trained CNN to TFLite (float16 + int8) and report accuracy deltas")
+    parser.add_argument("--onnx", action="store_true", help="Also export the CNN to ONNX")
+    parser.add_argument("--shard-dir", type=str, default=None,
+                        help="Stream CNN training from a sharded patch dataset "
+                             "(written from the synthetic dataset if it has no manifest)")
+    parser.add_argument("--mixed-precision", action="store_true",
+                        help="Train the CNN with mixed float16 precision")
     
     args = parser.parse_args()
     
+    if args.export:
+        print("="*50)
+        print("Exporting Growth Stage CNN")
+        print("="*50)
+        
+        X_patches, _, y_labels, _ = create_synthetic_dataset(
+            n_samples=args.samples,
+            data_dir=args.data_dir
+        )
+        # Calibrate on half of the patches, report accuracy on the other half
+        split = len(X_patches) // 2
+        GrowthStageClassifier().export(
+            X_patches[:split],
+            X_eval=X_patches[split:],
+            y_eval=y_labels[split:],
+            onnx=args.onnx
+        )
+        raise SystemExit(0)
+    
     # Example usage
     print("="*50)
     print("Training ML Models")
@@ -312,41 +663,23 @@ if __name__ == "__main__":
     # Train Growth Stage Classifier
     print("\n1. Training CNN for Growth Stage Classification...")
     stage_classifier = GrowthStageClassifier()
-    stage_classifier.build_model()
-    stage_classifier.train(X_patches, y_onehot, epochs=args.epochs, batch_size=16)
+    if args.shard_dir:
+        if not os.path.exists(os.path.join(args.shard_dir, "manifest.json")):
+            print(f"Writing patch shards to {args.shard_dir}...")
+            write_shards(args.shard_dir,
+                         shard_size=stage_classifier.training_config.get('shard_size', 4096),
+                         patches=X_patches, labels=y_labels)
+        stage_classifier.train_streaming(args.shard_dir, epochs=args.epochs, batch_size=16,
+                                         mixed_precision=args.mixed_precision or None)
+    else:
+        stage_classifier.build_model()
+        stage_classifier.train(X_patches, y_onehot, epochs=args.epochs, batch_size=16)
     
     # Train Nitrogen Predictor
     print("\n2. Training Random Forest for Nitrogen Prediction...")
-    # Extract features from patches (mean NDVI, NDRE, band statistics)
-    # If CSV exists, use actual NDVI/NDRE values
-    csv_path = os.path.join(args.data_dir, "synthetic_soil_data.csv")
-    if os.path.exists(csv_path):
-        import pandas as pd
-        df = pd.read_csv(csv_path)
-        features = []
-        for i in range(len(X_patches)):
-            if i < len(df):
-                row = df.iloc[i]
-                ndvi = row['NDVI']
-                ndre = row['NDRE']
-            else:
-                ndvi = np.random.uniform(0.3, 0.8)
-                ndre = np.random.uniform(0.2, 0.7)
-            # Add band statistics
-            band_stats = [np.mean(X_patches[i][:, :, j]) for j in range(13)]
-            features.append([ndvi, ndre] + band_stats)
-    else:
-        # Simulate feature extraction
-        features = []
-        for patch in X_patches:
-            ndvi = np.random.uniform(0.3, 0.8)
-            ndre = np.random.uniform(0.2, 0.7)
-            band_stats = [np.mean(patch[:, :, i]) for i in range(13)]
-            features.append([ndvi, ndre] + band_stats)
-    
-    X_features = np.array(features)
-    
+    # Patch NDVI/NDRE and per-band statistics, computed exactly as in the weekly pipeline
     nitrogen_predictor = NitrogenPredictor()
+    X_features = nitrogen_predictor.patch_features(X_patches)
     nitrogen_predictor.train(X_features, nitrogen)
     
     print("\nModel training complete!")
@@ -0,0 +1,310 @@
+"""
+NDVI Time-Series Archive
+Append-only (time, y, x) NDVI/NDRE history in compressed chunk files, read chunk-selectively
+"""
+
+import os
+import json
+import zlib
+from datetime import date, datetime
+import numpy as np
+
+ARCHIVE_FORMAT = "ndvi-archive"
+ARCHIVE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+def _as_date(value):
+    """ISO date string (YYYY-MM-DD) for a date, datetime or string"""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return datetime.fromisoformat(str(value)).date().isoformat()
+
+
+def _write_atomic(path, data, mode='wb'):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class NDVIArchive:
+    """
+    Chunked time series of index rasters on local disk (Zarr-style layout)
+    
+    Each variable is split into chunks of (weeks, rows, cols); a chunk is one
+    file <variable>/<t>.<y>.<x> holding float32 values, byte-shuffled and
+    zlib-compressed. Small spatial chunks with several weeks each keep both
+    access patterns cheap: a pixel's history touches one chunk per block of
+    weeks, a zone touches only the chunks it overlaps. Dates are only ever
+    appended; chunks are written before the manifest, so an interrupted
+    append leaves the archive at its previous state.
+    
+    Usage:
+        archive = NDVIArchive("outputs/ndvi_archive", shape=ndvi.shape)
+        archive.append("2024-06-03", ndvi=ndvi, ndre=ndre)
+        dates, values = archive.pixel_history(120, 340)
+    """
+    
+    def __init__(self, path, shape=None, chunks=(8, 256, 256), variables=('ndvi', 'ndre'),
+                 compression_level=5, metadata=None):
+        """
+        Open an archive, creating it if it does not exist
+        
+        Args:
+            path: Archive directory
+            shape: (H, W) of the rasters; required to create an archive
+            chunks: (weeks, rows, cols) per chunk (creation only)
+            variables: Stored variables (creation only)
+            compression_level: zlib level (creation only)
+            metadata: Extra JSON-serialisable fields, e.g. transform and CRS
+                (creation only)
+        
+        Raises:
+            ValueError: If shape is given and differs from an existing archive
+        """
+        self.path = path
+        manifest_path = os.path.join(path, MANIFEST_NAME)
+        
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+            if self.manifest.get("format") != ARCHIVE_FORMAT:
+                raise ValueError(f"{path} is not an {ARCHIVE_FORMAT}")
+            if self.manifest.get("version") != ARCHIVE_VERSION:
+                raise ValueError(f"Unsupported {ARCHIVE_FORMAT} version {self.manifest.get('version')} "
+                                 f"(expected {ARCHIVE_VERSION})")
+            if shape is not None and tuple(shape) != self.shape:
+                raise ValueError(f"Archive {path} holds {self.shape} rasters, got {tuple(shape)}")
+        else:
+            if shape is None:
+                raise FileNotFoundError(f"No archive at {path} (pass shape to create one)")
+            self.manifest = {
+                "format": ARCHIVE_FORMAT,
+                "version": ARCHIVE_VERSION,
+                "shape": [int(n) for n in shape],
+                "chunks": [int(n) for n in chunks],
+                "dtype": np.dtype(np.float32).str,
+                "compression": {"codec": "zlib", "level": int(compression_level), "shuffle": True},
+                "variables": list(variables),
+                "dates": [],
+                "metadata": metadata or {}
+            }
+            for variable in variables:
+                os.makedirs(os.path.join(path, variable), exist_ok=True)
+            self._write_manifest()
+    
+    @property
+    def shape(self):
+        return tuple(self.manifest["shape"])
+    
+    @property
+    def chunks(self):
+        return tuple(self.manifest["chunks"])
+    
+    @property
+    def dates(self):
+        return list(self.manifest["dates"])
+    
+    @property
+    def variables(self):
+        return list(self.manifest["variables"])
+    
+    def _write_manifest(self):
+        _write_atomic(os.path.join(self.path, MANIFEST_NAME),
+                      json.dumps(self.manifest, indent=2), mode='w')
+    
+    def _chunk_path(self, variable, t, y, x):
+        return os.path.join(self.path, variable, f"{t}.{y}.{x}")
+    
+    def _chunk_shape(self, y, x):
+        """Shape of spatial chunk (y, x); edge chunks are smaller"""
+        weeks, rows, cols = self.chunks
+        h, w = self.shape
+        return (weeks, min(rows, h - y * rows), min(cols, w - x * cols))
+    
+    def _encode(self, chunk):
+        data = np.ascontiguousarray(chunk, dtype=np.float32)
+        # Byte shuffle: exponent bytes of neighbouring values end up adjacent
+        shuffled = data.view(np.uint8).reshape(-1, data.itemsize).T.tobytes()
+        return zlib.compress(shuffled, self.manifest["compression"]["level"])
+    
+    def _decode(self, raw, shape):
+        itemsize = np.dtype(np.float32).itemsize
+        shuffled = np.frombuffer(zlib.decompress(raw), dtype=np.uint8)
+        data = shuffled.reshape(itemsize, -1).T.copy().view(np.float32)
+        return data.reshape(shape)
+    
+    def _read_chunk(self, variable, t, y, x):
+        """Decoded chunk; NaN if it was never written"""
+        shape = self._chunk_shape(y, x)
+        path = self._chunk_path(variable, t, y, x)
+        if not os.path.exists(path):
+            return np.full(shape, np.nan, dtype=np.float32)
+        with open(path, 'rb') as f:
+            return self._decode(f.read(), shape)
+    
+    def _check_variable(self, variable):
+        if variable not in self.manifest["variables"]:
+            raise ValueError(f"Unknown variable '{variable}'. Archive has {self.variables}")
+    
+    def append(self, when, **arrays):
+        """
+        Append one date
+        
+        Args:
+            when: Acquisition date (date, datetime or ISO string), later than
+                every date already archived
+            **arrays: variable -> (H, W) array or memmap; variables left out
+                are stored as NaN
+        
+        Raises:
+            ValueError: On an unknown variable, a shape mismatch or a date
+                that is not after the last archived one
+        """
+        when = _as_date(when)
+        dates = self.manifest["dates"]
+        if dates and when <= dates[-1]:
+            raise ValueError(f"Archive is append-only: {when} is not after {dates[-1]}")
+        for variable, array in arrays.items():
+            self._check_variable(variable)
+            if tuple(array.shape) != self.shape:
+                raise ValueError(f"{variable} has shape {tuple(array.shape)}, archive holds {self.shape}")
+        
+        weeks, rows, cols = self.chunks
+        t, slot = divmod(len(dates), weeks)
+        n_y, n_x = -(-self.shape[0] // rows), -(-self.shape[1] // cols)
+        
+        # Variables left out keep NaN in their slot (missing chunks read as NaN)
+        for variable, array in arrays.items():
+            for y in range(n_y):
+                # One band of chunk rows at a time (bounded reads from memmaps)
+                band = np.asarray(array[y * rows:(y + 1) * rows], dtype=np.float32)
+                for x in range(n_x):
+                    if slot == 0:
+                        chunk = np.full(self._chunk_shape(y, x), np.nan, dtype=np.float32)
+                    else:
+                        chunk = self._read_chunk(variable, t, y, x)
+                    chunk[slot] = band[:, x * cols:(x + 1) * cols]
+                    _write_atomic(self._chunk_path(variable, t, y, x), self._encode(chunk))
+        
+        dates.append(when)
+        self._write_manifest()
+    
+    def _date_range(self, start=None, end=None):
+        """Indices [first, stop) of the archived dates within [start, end]"""
+        dates = self.manifest["dates"]
+        first = 0 if start is None else int(np.searchsorted(dates, _as_date(start), side='left'))
+        stop = len(dates) if end is None else int(np.searchsorted(dates, _as_date(end), side='right'))
+        return first, max(first, stop)
+    
+    def _read_series(self, variable, first, stop, rows, cols):
+        """
+        Values of dates [first, stop) over a pixel window, reading only the
+        chunks it overlaps
+        
+        Yields:
+            (row slice, col slice, (stop - first, r, c) array) per spatial chunk
+        """
+        weeks, chunk_rows, chunk_cols = self.chunks
+        for y in range(rows.start // chunk_rows, -(-rows.stop // chunk_rows)):
+            for x in range(cols.start // chunk_cols, -(-cols.stop // chunk_cols)):
+                row_slice = slice(max(rows.start, y * chunk_rows) - y * chunk_rows,
+                                  min(rows.stop, (y + 1) * chunk_rows) - y * chunk_rows)
+                col_slice = slice(max(cols.start, x * chunk_cols) - x * chunk_cols,
+                                  min(cols.stop, (x + 1) * chunk_cols) - x * chunk_cols)
+                parts = []
+                for t in range(first // weeks, -(-stop // weeks)):
+                    chunk = self._read_chunk(variable, t, y, x)
+                    parts.append(chunk[max(first - t * weeks, 0):stop - t * weeks,
+                                       row_slice, col_slice])
+                yield row_slice, col_slice, np.concatenate(parts)
+    
+    def _window(self, bounds):
+        """(row slice, col slice) for bounds (row_start, row_stop, col_start, col_stop)"""
+        h, w = self.shape
+        if bounds is None:
+            return slice(0, h), slice(0, w)
+        row_start, row_stop, col_start, col_stop = bounds
+        if not (0 <= row_start < row_stop <= h and 0 <= col_start < col_stop <= w):
+            raise ValueError(f"Bounds {bounds} are outside the {self.shape} archive")
+        return slice(row_start, row_stop), slice(col_start, col_stop)
+    
+    def pixel_history(self, row, col, variable='ndvi', start=None, end=None):
+        """
+        Time series of one pixel
+        
+        Returns:
+            dates (list of ISO strings), values (float32 array, NaN where invalid)
+        """
+        self._check_variable(variable)
+        first, stop = self._date_range(start, end)
+        if first == stop:
+            return [], np.empty(0, dtype=np.float32)
+        
+        (_, _, series), = self._read_series(variable, first, stop, *self._window(
+            (row, row + 1, col, col + 1)))
+        return self.manifest["dates"][first:stop], series[:, 0, 0]
+    
+    def zone_mean_over_time(self, bounds=None, variable='ndvi', start=None, end=None):
+        """
+        Mean of a pixel window per date, accumulated chunk by chunk
+        
+        Args:
+            bounds: (row_start, row_stop, col_start, col_stop), default the
+                whole scene
+        
+        Returns:
+            dates, means (float64 array, NaN for dates without valid pixels)
+        """
+        self._check_variable(variable)
+        first, stop = self._date_range(start, end)
+        total = np.zeros(stop - first)
+        count = np.zeros(stop - first)
+        
+        for _, _, series in self._read_series(variable, first, stop, *self._window(bounds)):
+            valid = np.isfinite(series)
+            total += np.where(valid, series, 0).sum(axis=(1, 2))
+            count += valid.sum(axis=(1, 2))
+        
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(count > 0, total / count, np.nan)
+        return self.manifest["dates"][first:stop], means
+    
+    def rolling_change(self, k, bounds=None, variable='ndvi', start=None, end=None):
+        """
+        k-week change of every pixel, averaged over a window per date
+        
+        For each date t (from the k-th on), compares each pixel with its value
+        k archived dates earlier; pixels invalid at either date are skipped.
+        
+        Returns:
+            dates (t), mean change and mean absolute change (float64 arrays)
+        """
+        self._check_variable(variable)
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        
+        first, stop = self._date_range(start, end)
+        first_read = max(first - k, 0)  # Earlier dates needed as the baseline
+        n = stop - max(first, k)
+        if n <= 0:
+            return [], np.empty(0), np.empty(0)
+        
+        total = np.zeros(n)
+        total_abs = np.zeros(n)
+        count = np.zeros(n)
+        for _, _, series in self._read_series(variable, first_read, stop, *self._window(bounds)):
+            change = (series[k:] - series[:-k])[-n:]
+            valid = np.isfinite(change)
+            change = np.where(valid, change, 0)
+            total += change.sum(axis=(1, 2))
+            total_abs += np.abs(change).sum(axis=(1, 2))
+            count += valid.sum(axis=(1, 2))
+        
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_change = np.where(count > 0, total / count, np.nan)
+            mean_abs_change = np.where(count > 0, total_abs / count, np.nan)
+        return self.manifest["dates"][stop - n:stop], mean_change, mean_abs_change
@@ -0,0 +1,164 @@
+"""
+Raster Lookup Service
+Point and polygon queries against the precomputed, georeferenced pipeline outputs
+"""
+
+import os
+import threading
+import yaml
+import numpy as np
+import rasterio
+from rasterio.errors import WindowError
+from rasterio.features import geometry_mask, geometry_window
+from rasterio.warp import transform as transform_coords
+from rasterio.warp import transform_geom
+from rasterio.windows import Window
+
+
+class RasterLookup:
+    """Map lat/lon or GeoJSON polygons onto the NDVI/NDRE/nitrogen COGs"""
+    
+    LAYERS = ('ndvi', 'ndre', 'nitrogen')
+    
+    def __init__(self, config_path="config.yaml"):
+        with open(config_path, 'r') as f:
+            self.config = yaml.safe_load(f)
+        
+        self.output_dir = self.config['paths']['output_dir']
+        self.buffer_pixels = self.config.get('lookup', {}).get('buffer_pixels', 1)
+        
+        # rasterio datasets are not thread-safe: one set of handles per thread
+        self._local = threading.local()
+    
+    def layer_path(self, layer):
+        """COG path written by the pipeline for a layer"""
+        return os.path.join(self.output_dir, f"{layer}.tif")
+    
+    def available_layers(self):
+        """Layers whose COG output exists"""
+        return [layer for layer in self.LAYERS if os.path.exists(self.layer_path(layer))]
+    
+    def _dataset(self, layer):
+        """Open (or reuse) this thread's handle, reopening if the file was rewritten"""
+        path = self.layer_path(layer)
+        if not os.path.exists(path):
+            return None
+        
+        handles = getattr(self._local, 'handles', None)
+        if handles is None:
+            handles = self._local.handles = {}
+        
+        mtime = os.stat(path).st_mtime_ns
+        cached = handles.get(layer)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        if cached is not None:
+            cached[1].close()
+        
+        dataset = rasterio.open(path)
+        handles[layer] = (mtime, dataset)
+        return dataset
+    
+    @staticmethod
+    def _stats(values):
+        """NaN-aware summary statistics of a value array"""
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return {"mean": None, "std": None, "min": None, "max": None, "count": 0}
+        return {
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "count": int(values.size)
+        }
+    
+    def sample(self, latitude, longitude, buffer_pixels=None, layers=None):
+        """
+        Look up a coordinate in each layer
+        
+        Only the (2 * buffer + 1)^2 window around the pixel is read, so a
+        lookup costs a few internal COG blocks regardless of scene size.
+        
+        Args:
+            latitude, longitude: WGS84 coordinate
+            buffer_pixels: Half-width of the statistics window (0 = pixel only)
+            layers: Layers to query (defaults to all available)
+        
+        Returns:
+            Dict of layer -> {"value", "row", "col", "window": stats}
+        
+        Raises:
+            ValueError: If the coordinate falls outside the raster extent
+        """
+        buffer_pixels = self.buffer_pixels if buffer_pixels is None else int(buffer_pixels)
+        results = {}
+        
+        for layer in layers or self.available_layers():
+            dataset = self._dataset(layer)
+            if dataset is None:
+                continue
+            
+            try:
+                xs, ys = transform_coords('EPSG:4326', dataset.crs, [longitude], [latitude])
+            except Exception as e:  # GDAL/PROJ projection errors
+                raise ValueError(f"Coordinate ({latitude}, {longitude}) cannot be "
+                                 f"projected to the raster CRS: {e}")
+            row, col = dataset.index(xs[0], ys[0])
+            if not (0 <= row < dataset.height and 0 <= col < dataset.width):
+                raise ValueError(f"Coordinate ({latitude}, {longitude}) is outside "
+                                 f"the {layer} raster extent")
+            
+            window = Window(col - buffer_pixels, row - buffer_pixels,
+                            2 * buffer_pixels + 1, 2 * buffer_pixels + 1)
+            window = window.intersection(Window(0, 0, dataset.width, dataset.height))
+            data = dataset.read(1, window=window).astype(np.float64)
+            if dataset.nodata is not None and not np.isnan(dataset.nodata):
+                data[data == dataset.nodata] = np.nan
+            
+            value = data[row - int(window.row_off), col - int(window.col_off)]
+            results[layer] = {
+                "value": float(value) if np.isfinite(value) else None,
+                "row": int(row),
+                "col": int(col),
+                "window": self._stats(data)
+            }
+        
+        return results
+    
+    def polygon_stats(self, geometry, layers=None):
+        """
+        Statistics of each layer inside a GeoJSON polygon (WGS84)
+        
+        Only the polygon's bounding window is read.
+        
+        Args:
+            geometry: GeoJSON geometry dict (Polygon / MultiPolygon)
+            layers: Layers to query (defaults to all available)
+        
+        Returns:
+            Dict of layer -> stats
+        """
+        results = {}
+        
+        for layer in layers or self.available_layers():
+            dataset = self._dataset(layer)
+            if dataset is None:
+                continue
+            
+            geom = transform_geom('EPSG:4326', dataset.crs, geometry)
+            try:
+                window = geometry_window(dataset, [geom])
+            except WindowError:
+                raise ValueError(f"Polygon does not intersect the {layer} raster")
+            
+            data = dataset.read(1, window=window).astype(np.float64)
+            if dataset.nodata is not None and not np.isnan(dataset.nodata):
+                data[data == dataset.nodata] = np.nan
+            
+            inside = geometry_mask([geom], out_shape=data.shape,
+                                   transform=dataset.window_transform(window),
+                                   invert=True)
+            results[layer] = self._stats(data[inside])
+        
+        return results
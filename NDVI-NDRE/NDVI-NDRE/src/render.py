@@ -0,0 +1,147 @@
+"""
+Raster Rendering
+Class maps and palette-indexed PNGs through lookup tables, without matplotlib
+"""
+
+import io
+import os
+import hashlib
+import numpy as np
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+NODATA_CLASS = 255
+
+# Low (red), medium (yellow), high (green), as in the original matplotlib colormap
+NUTRIENT_PALETTE = [(255, 0, 0), (255, 255, 0), (0, 128, 0)]
+
+
+def content_hash(array, extra="", block_rows=1024):
+    """
+    Hash of an array's shape, dtype and values, read block by block
+    
+    Args:
+        array: Array or memmap
+        extra: String mixed into the hash (e.g. thresholds)
+        block_rows: Rows hashed per step (bounds memory on memmaps)
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{array.shape}:{array.dtype.str}:{extra};".encode())
+    for row in range(0, array.shape[0], block_rows):
+        block = np.ascontiguousarray(array[row:row + block_rows])
+        digest.update(memoryview(block).cast('B'))
+    return digest.hexdigest()
+
+
+def classify(values, edges, block_rows=1024):
+    """
+    Class index of every pixel in one np.digitize pass
+    
+    Args:
+        values: (H, W) array or memmap
+        edges: Increasing class boundaries; class k covers [edges[k-1], edges[k])
+        block_rows: Rows classified per step
+    
+    Returns:
+        (H, W) uint8 classes, NODATA_CLASS where values are not finite
+    """
+    edges = np.asarray(edges, dtype=np.float64)
+    classes = np.empty(values.shape, dtype=np.uint8)
+    for row in range(0, values.shape[0], block_rows):
+        block = np.asarray(values[row:row + block_rows])
+        out = classes[row:row + block_rows]
+        out[...] = np.digitize(block, edges)
+        out[~np.isfinite(block)] = NODATA_CLASS
+    return classes
+
+
+def ramp_palette(stops, n=255):
+    """
+    n RGB colours interpolated linearly between evenly spaced colour stops
+    
+    Args:
+        stops: RGB tuples, e.g. NUTRIENT_PALETTE for red -> yellow -> green
+        n: Number of colours (at most 255, index 255 stays no data)
+    """
+    stops = np.asarray(stops, dtype=np.float64)
+    positions = np.linspace(0, len(stops) - 1, n)
+    colours = [np.interp(positions, np.arange(len(stops)), stops[:, channel])
+               for channel in range(3)]
+    return [tuple(colour) for colour in np.rint(np.stack(colours, axis=1)).astype(np.uint8).tolist()]
+
+
+def scale_to_index(values, vmin, vmax, n=255):
+    """
+    Palette index 0..n-1 of continuous values clipped to [vmin, vmax]
+    
+    Returns:
+        uint8 array, NODATA_CLASS where values are not finite
+    """
+    values = np.asarray(values, dtype=np.float32)
+    valid = np.isfinite(values)
+    scaled = (np.where(valid, values, vmin) - vmin) * ((n - 1) / (vmax - vmin))
+    index = np.clip(np.rint(scaled), 0, n - 1).astype(np.uint8)
+    index[~valid] = NODATA_CLASS
+    return index
+
+
+def read_png_hash(path):
+    """
+    Content hash stored in a PNG written by write_palette_png, or None
+    
+    Only the header chunks are read: the hash is written before the image
+    data, so it is in image.info right after Image.open (image.text would
+    decode the whole image).
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with Image.open(path) as image:
+            return image.info.get("content_hash")
+    except OSError:
+        return None
+
+
+def _palette_image(classes, palette):
+    image = Image.fromarray(np.ascontiguousarray(classes, dtype=np.uint8))
+    flat = np.zeros((256, 3), dtype=np.uint8)
+    flat[:len(palette)] = palette
+    image.putpalette(flat.ravel().tolist())  # 'L' -> 'P'
+    return image
+
+
+def encode_palette_png(classes, palette, compress_level=1):
+    """Palette-indexed PNG bytes of a class map (NODATA_CLASS transparent)"""
+    buffer = io.BytesIO()
+    _palette_image(classes, palette).save(buffer, format='PNG', transparency=NODATA_CLASS,
+                                          compress_level=compress_level)
+    return buffer.getvalue()
+
+
+def write_palette_png(classes, path, palette, content_key=None, compress_level=1):
+    """
+    Write a class map as a palette-indexed PNG (one byte per pixel)
+    
+    Args:
+        classes: (H, W) uint8 class map
+        path: Output .png path
+        palette: RGB colours of classes 0..n-1; NODATA_CLASS is transparent
+        content_key: Hash stored in the PNG (read back by read_png_hash)
+        compress_level: zlib level; class maps compress well even at 1,
+            which is several times faster than PIL's default on a full scene
+    
+    Returns:
+        Output path
+    """
+    image = _palette_image(classes, palette)
+    
+    info = PngInfo()
+    if content_key:
+        info.add_text("content_hash", content_key)
+    
+    # Write beside the target and swap in, so readers never see a partial PNG
+    tmp_path = f"{path}.tmp"
+    image.save(tmp_path, format='PNG', transparency=NODATA_CLASS, pnginfo=info,
+               compress_level=compress_level)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,173 @@
+"""
+Sharded Patch Datasets
+On-disk training data as fixed-size .npy shards plus a JSON manifest, read back via memory maps
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+from numpy.lib.format import open_memmap
+
+SHARD_FORMAT = "patch-shards"
+SHARD_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+class ShardWriter:
+    """
+    Stream arrays into fixed-size shards
+    
+    Every field (e.g. patches, labels, nitrogen) gets one uncompressed .npy
+    file per shard, written through a memory map so a shard never has to be
+    assembled in memory. The manifest is written last by close(); a
+    directory without a manifest is an incomplete dataset.
+    
+    Usage:
+        with ShardWriter("data/patch_shards", {"patches": ((64, 64, 7), "float32"),
+                                               "labels": ((), "int64")}) as writer:
+            writer.add(patches=batch, labels=batch_labels)
+    """
+    
+    def __init__(self, out_dir, fields, shard_size=4096, metadata=None):
+        """
+        Args:
+            out_dir: Output directory (replaced if it exists)
+            fields: Dict of field name -> (per-sample shape, dtype)
+            shard_size: Samples per shard
+            metadata: Extra JSON-serialisable fields for the manifest
+        """
+        self.out_dir = out_dir
+        self.fields = {name: (tuple(shape), np.dtype(dtype)) for name, (shape, dtype) in fields.items()}
+        self.shard_size = int(shard_size)
+        self.metadata = metadata or {}
+        
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir)
+        
+        self.shards = []
+        self.n_samples = 0
+        self._open = None  # field -> memmap of the shard being filled
+        self._filled = 0
+    
+    def _new_shard(self):
+        index = len(self.shards)
+        files = {name: f"shard-{index:05d}.{name}.npy" for name in self.fields}
+        self._open = {
+            name: open_memmap(os.path.join(self.out_dir, files[name]), mode='w+',
+                              dtype=dtype, shape=(self.shard_size,) + shape)
+            for name, (shape, dtype) in self.fields.items()
+        }
+        self.shards.append({"files": files, "n_samples": 0})
+        self._filled = 0
+    
+    def _finish_shard(self):
+        """Flush the open shard, truncating it if it is partially filled"""
+        if self._open is None:
+            return
+        shard = self.shards[-1]
+        shard["n_samples"] = self._filled
+        partial = {}
+        for name in self.fields:
+            self._open[name].flush()
+            if self._filled < self.shard_size:
+                partial[name] = np.array(self._open[name][:self._filled])
+        # Release every map of the shard before its files are rewritten
+        # (a mapped file cannot be replaced on Windows)
+        self._open = None
+        for name, data in partial.items():
+            path = os.path.join(self.out_dir, shard["files"][name])
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp_path, path)
+    
+    def add(self, **arrays):
+        """Append a batch; every field must be given with the same length"""
+        if set(arrays) != set(self.fields):
+            raise ValueError(f"Expected fields {sorted(self.fields)}, got {sorted(arrays)}")
+        n = len(next(iter(arrays.values())))
+        if any(len(array) != n for array in arrays.values()):
+            raise ValueError("All fields must have the same number of samples")
+        
+        done = 0
+        while done < n:
+            if self._open is None:
+                self._new_shard()
+            count = min(n - done, self.shard_size - self._filled)
+            for name, array in arrays.items():
+                self._open[name][self._filled:self._filled + count] = array[done:done + count]
+            self._filled += count
+            done += count
+            if self._filled == self.shard_size:
+                self._finish_shard()
+        
+        self.n_samples += n
+    
+    def close(self):
+        """Finish the last shard and write the manifest"""
+        self._finish_shard()
+        manifest = {
+            "format": SHARD_FORMAT,
+            "version": SHARD_VERSION,
+            "n_samples": self.n_samples,
+            "shard_size": self.shard_size,
+            "fields": {name: {"shape": list(shape), "dtype": dtype.str}
+                       for name, (shape, dtype) in self.fields.items()},
+            "shards": self.shards,
+            "metadata": self.metadata
+        }
+        with open(os.path.join(self.out_dir, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+def write_shards(out_dir, shard_size=4096, metadata=None, **arrays):
+    """Write in-memory arrays (same first dimension) as a sharded dataset"""
+    fields = {name: (np.shape(array)[1:], np.asarray(array[:0]).dtype) for name, array in arrays.items()}
+    with ShardWriter(out_dir, fields, shard_size=shard_size, metadata=metadata) as writer:
+        writer.add(**arrays)
+    return read_manifest(out_dir)
+
+
+def read_manifest(shard_dir):
+    """
+    Manifest of a sharded dataset
+    
+    Raises:
+        FileNotFoundError: If the directory has no manifest (missing or incomplete)
+        ValueError: If the manifest format/version is not supported
+    """
+    with open(os.path.join(shard_dir, MANIFEST_NAME), 'r') as f:
+        manifest = json.load(f)
+    
+    if manifest.get("format") != SHARD_FORMAT:
+        raise ValueError(f"{shard_dir} is not a {SHARD_FORMAT} dataset")
+    if manifest.get("version") != SHARD_VERSION:
+        raise ValueError(f"Unsupported {SHARD_FORMAT} version {manifest.get('version')} "
+                         f"(expected {SHARD_VERSION})")
+    return manifest
+
+
+def open_shard(shard_dir, shard, fields=None):
+    """
+    Memory-map one shard
+    
+    Args:
+        shard_dir: Dataset directory
+        shard: Shard entry from the manifest
+        fields: Fields to open (defaults to all)
+    
+    Returns:
+        Dict of field -> read-only memmap
+    """
+    return {name: np.load(os.path.join(shard_dir, file), mmap_mode='r')
+            for name, file in shard["files"].items()
+            if fields is None or name in fields}
@@ -0,0 +1,212 @@
+"""
+Tile Cache for Incremental Processing
+Per-tile input hashes and NDVI drift, so tiles that did not change (much) reuse their outputs
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from numpy.lib.format import open_memmap
+
+CACHE_FORMAT = "tile-cache"
+CACHE_VERSION = 1
+
+
+def tile_key(window):
+    """Cache key of a window on the 10m grid ("row_off:col_off")"""
+    return f"{int(window.row_off)}:{int(window.col_off)}"
+
+
+def hash_tile(tile):
+    """
+    Content hash of one tile's decoded bands
+    
+    Args:
+        tile: Dict of band -> (rows, cols) array
+    
+    Returns:
+        Hex digest over band names, shapes, dtypes and pixel bytes
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for band in sorted(tile):
+        data = np.ascontiguousarray(tile[band])
+        digest.update(f"{band}:{data.shape}:{data.dtype.str};".encode())
+        digest.update(memoryview(data).cast('B'))
+    return digest.hexdigest()
+
+
+class TileCache:
+    """
+    State of the last incremental run, stored as one JSON file
+    
+    Outputs themselves stay in their usual .npy files (opened r+ and only
+    rewritten tile by tile); the state records, per tile, the content hash
+    of its input bands and the NDVI change accumulated since the models last
+    ran on it. The size and mtime of every output are recorded too, so an
+    output rewritten by a non-incremental run invalidates the whole cache.
+    
+    Usage:
+        cache = TileCache("outputs/tile_cache.json")
+        cache.begin(scene)
+        ndvi = cache.open_array("outputs/ndvi.npy", (h, w), np.float32, group="inputs")
+        ...
+        cache.finish({"outputs/ndvi.npy": ndvi, ...}, input_fingerprint, model_fingerprint)
+    """
+    
+    GROUPS = ('inputs', 'models')
+    
+    def __init__(self, path):
+        self.path = path
+        self.state = self._read()
+        self.valid = False
+        self.stale = set()  # Groups whose outputs were (re)created this run
+    
+    def _read(self):
+        """Previous state, or None if missing, unreadable or another format"""
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("format") != CACHE_FORMAT or state.get("version") != CACHE_VERSION:
+            return None
+        return state
+    
+    @staticmethod
+    def _stat(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+    
+    def begin(self, scene):
+        """
+        Start a run on a scene
+        
+        Args:
+            scene: JSON-serialisable description of everything that changes the
+                tile layout or the meaning of the outputs (shape, bands,
+                indices, tile grid)
+        
+        Returns:
+            True if the previous outputs can be reused
+        """
+        previous = self.state
+        self.valid = (
+            previous is not None
+            and previous.get("scene") == scene
+            and all(os.path.exists(path) and self._stat(path) == stat
+                    for path, stat in previous.get("arrays", {}).items())
+        )
+        
+        self.state = {
+            "format": CACHE_FORMAT,
+            "version": CACHE_VERSION,
+            "scene": scene,
+            "input_fingerprint": previous.get("input_fingerprint") if self.valid else None,
+            "model_fingerprint": previous.get("model_fingerprint") if self.valid else None,
+            "arrays": previous.get("arrays", {}) if self.valid else {},
+            "tiles": previous.get("tiles", {}) if self.valid else {}
+        }
+        self.stale = set()
+        return self.valid
+    
+    def open_array(self, path, shape, dtype, group):
+        """
+        Open an output for in-place tile updates
+        
+        The previous file is reused (r+) when the cache is valid and the file
+        matches shape and dtype; otherwise it is created and every tile of its
+        group is treated as dirty.
+        
+        Args:
+            path: .npy path
+            shape: Full output shape
+            dtype: Output dtype
+            group: 'inputs' (band math outputs) or 'models' (CNN/RF outputs)
+        """
+        if group not in self.GROUPS:
+            raise ValueError(f"Unknown group '{group}'. Use one of {self.GROUPS}")
+        
+        if self.valid and path in self.state["arrays"]:
+            array = np.load(path, mmap_mode='r+')
+            if array.shape == tuple(shape) and array.dtype == np.dtype(dtype):
+                return array
+            del array
+        
+        self.stale.add(group)
+        if group == 'inputs':
+            self.state["tiles"] = {}
+        return open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+    
+    def inputs_unchanged(self, input_fingerprint):
+        """True if the band files are the ones the cached outputs were computed from"""
+        return ('inputs' not in self.stale and self.valid
+                and self.state["input_fingerprint"] == input_fingerprint)
+    
+    def tile_hash(self, key):
+        """Input hash recorded for a tile, or None for a new tile"""
+        entry = self.state["tiles"].get(key)
+        return entry["hash"] if entry else None
+    
+    def record_inputs(self, key, input_hash, ndvi_change):
+        """
+        Record recomputed inputs of a tile
+        
+        Args:
+            key: tile_key() of the window
+            input_hash: hash_tile() of its bands
+            ndvi_change: Mean absolute NDVI change against the previous
+                outputs, or None when there were none
+        """
+        entry = self.state["tiles"].setdefault(key, {"drift": None})
+        entry["hash"] = input_hash
+        if ndvi_change is None or entry["drift"] is None or not np.isfinite(ndvi_change):
+            entry["drift"] = None
+        else:
+            entry["drift"] += float(ndvi_change)
+    
+    def needs_models(self, key, threshold, model_fingerprint):
+        """
+        True if the CNN/RF outputs of a tile must be recomputed
+        
+        That is the case for new tiles, after a model change, and once the
+        NDVI change accumulated since the tile's last model run exceeds
+        threshold (the sum bounds the mean absolute change from that run).
+        A tile whose inputs changed by less keeps its cached outputs.
+        
+        Args:
+            key: tile_key() of the window
+            threshold: NDVI drift that forces a rerun
+            model_fingerprint: Identity of the models used this run
+        """
+        entry = self.state["tiles"].get(key)
+        if entry is None or entry["drift"] is None or 'models' in self.stale:
+            return True
+        if self.state["model_fingerprint"] != model_fingerprint:
+            return True
+        return entry["drift"] > threshold
+    
+    def record_models(self, key):
+        """Record that the CNN/RF outputs of a tile are current"""
+        self.state["tiles"][key]["drift"] = 0.0
+    
+    def finish(self, arrays, input_fingerprint, model_fingerprint):
+        """
+        Flush the outputs and write the state atomically
+        
+        Args:
+            arrays: Dict of path -> memmap opened through open_array
+            input_fingerprint: ImageProcessor.input_fingerprint() of this run
+            model_fingerprint: Identity of the models used this run
+        """
+        for array in arrays.values():
+            array.flush()
+        
+        self.state["arrays"] = {path: self._stat(path) for path in arrays}
+        self.state["input_fingerprint"] = input_fingerprint
+        self.state["model_fingerprint"] = model_fingerprint
+        
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,236 @@
+"""
+XYZ Tile Server
+256x256 web-mercator PNG tiles cut on demand from the pipeline COGs, cached on disk
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import yaml
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+from src.render import (NODATA_CLASS, NUTRIENT_PALETTE, encode_palette_png, ramp_palette,
+                        scale_to_index)
+
+TILE_SIZE = 256
+WEB_MERCATOR = 'EPSG:3857'
+# Half the width of the web-mercator world in metres
+MERCATOR_EXTENT = 20037508.342789244
+
+# Layer -> (value range for the colour ramp, or None for class maps)
+LAYER_STYLES = {
+    'ndvi': (-0.2, 1.0),
+    'ndre': (-0.2, 0.8),
+    'nitrogen': (80.0, 220.0),
+    'nutrient_map': None
+}
+
+
+def tile_bounds(z, x, y):
+    """(left, bottom, right, top) of an XYZ tile in web-mercator metres"""
+    size = 2 * MERCATOR_EXTENT / (1 << z)
+    left = -MERCATOR_EXTENT + x * size
+    top = MERCATOR_EXTENT - y * size
+    return left, top - size, left + size, top
+
+
+class TileCacheLRU:
+    """
+    Rendered tiles on disk with a total size cap
+    
+    Recency is kept in memory (seeded from file mtimes on start-up) and
+    persisted by touching files on hit, so eviction order survives restarts.
+    """
+    
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # path -> size, oldest first
+        self._lock = threading.Lock()
+        
+        files = []
+        for root, _, names in os.walk(cache_dir):
+            for name in names:
+                if name.endswith('.png'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime_ns, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self.current_bytes += size
+    
+    def get(self, path):
+        """Cached tile bytes or None"""
+        with self._lock:
+            if path not in self._entries:
+                return None
+            self._entries.move_to_end(path)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            with self._lock:
+                self.current_bytes -= self._entries.pop(path, 0)
+            return None
+    
+    def put(self, path, data):
+        """Store a tile, evicting least recently used tiles over the cap"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        
+        evicted = []
+        with self._lock:
+            self.current_bytes -= self._entries.pop(path, 0)
+            self._entries[path] = len(data)
+            self.current_bytes += len(data)
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                old_path, size = self._entries.popitem(last=False)
+                self.current_bytes -= size
+                evicted.append(old_path)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+
+class TileServer:
+    """
+    Cut XYZ tiles from the NDVI, NDRE, nutrient map and nitrogen COGs
+    
+    Each tile is warped from the coarsest overview that still has at least
+    the tile's resolution, so a zoomed-out tile reads a few overview blocks
+    instead of the full-resolution raster. Tiles are keyed by the COG's size
+    and mtime: a rewritten COG gets new ETags and cache entries.
+    """
+    
+    def __init__(self, config_path="config.yaml"):
+        with open(config_path, 'r') as f:
+            self.config = yaml.safe_load(f)
+        
+        self.output_dir = self.config['paths']['output_dir']
+        tiles = self.config.get('tiles', {})
+        self.max_zoom = tiles.get('max_zoom', 18)
+        self.styles = dict(LAYER_STYLES)
+        for layer, value_range in tiles.get('value_ranges', {}).items():
+            if layer in self.styles and self.styles[layer] is not None:
+                self.styles[layer] = tuple(value_range)
+        
+        self.cache = TileCacheLRU(tiles.get('cache_dir', os.path.join(self.output_dir, "tiles")),
+                                  tiles.get('max_cache_mb', 512) * 1024 * 1024)
+        self.ramp = ramp_palette(NUTRIENT_PALETTE)
+        self._bounds = {}  # (layer, version) -> web-mercator bounds of the COG
+    
+    @property
+    def layers(self):
+        return tuple(self.styles)
+    
+    def layer_path(self, layer):
+        """COG path written by the pipeline for a layer"""
+        return os.path.join(self.output_dir, f"{layer}.tif")
+    
+    def _version(self, layer):
+        """Identity of the layer's current COG"""
+        if layer not in self.styles:
+            raise ValueError(f"Unknown layer '{layer}'. Use one of {self.layers}")
+        path = self.layer_path(layer)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Layer '{layer}' has not been generated yet")
+        stat = os.stat(path)
+        return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    
+    def _check_tile(self, z, x, y):
+        if not 0 <= z <= self.max_zoom:
+            raise ValueError(f"Zoom must be between 0 and {self.max_zoom}")
+        if not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+            raise ValueError(f"Tile {z}/{x}/{y} does not exist")
+    
+    def etag(self, layer, z, x, y):
+        """ETag of a tile, derived without rendering it"""
+        self._check_tile(z, x, y)
+        version = self._version(layer)
+        return hashlib.blake2b(f"{layer}/{version}/{z}/{x}/{y}".encode(),
+                               digest_size=12).hexdigest()
+    
+    def _cache_path(self, layer, version, z, x, y):
+        return os.path.join(self.cache.cache_dir, layer, version, str(z), str(x), f"{y}.png")
+    
+    def tile(self, layer, z, x, y):
+        """
+        PNG bytes of one tile, from the disk cache or rendered
+        
+        Raises:
+            ValueError: Unknown layer or tile coordinates
+            FileNotFoundError: If the layer's COG does not exist
+        """
+        self._check_tile(z, x, y)
+        version = self._version(layer)
+        path = self._cache_path(layer, version, z, x, y)
+        
+        data = self.cache.get(path)
+        if data is None:
+            data = self.render(layer, version, z, x, y)
+            self.cache.put(path, data)
+        return data
+    
+    def _source_overview(self, src, bounds):
+        """Index of the coarsest overview at least as fine as the tile (None = full resolution)"""
+        left, bottom, right, top = transform_bounds(WEB_MERCATOR, src.crs, *bounds)
+        tile_resolution = min(right - left, top - bottom) / TILE_SIZE
+        ratio = tile_resolution / min(abs(src.res[0]), abs(src.res[1]))
+        
+        level = None
+        for index, factor in enumerate(src.overviews(1)):
+            if factor <= ratio:
+                level = index
+        return level
+    
+    def render(self, layer, version, z, x, y):
+        """Warp one tile from the COG and encode it as a palette PNG"""
+        path = self.layer_path(layer)
+        bounds = tile_bounds(z, x, y)
+        style = self.styles[layer]
+        
+        with rasterio.open(path) as src:
+            key = (layer, version)
+            if key not in self._bounds:
+                self._bounds[key] = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds)
+            layer_bounds = self._bounds[key]
+            level = self._source_overview(src, bounds)
+            nodata = src.nodata
+        
+        palette = NUTRIENT_PALETTE if style is None else self.ramp
+        if (bounds[2] <= layer_bounds[0] or bounds[0] >= layer_bounds[2] or
+                bounds[3] <= layer_bounds[1] or bounds[1] >= layer_bounds[3]):
+            # Outside the field: fully transparent
+            return encode_palette_png(np.full((TILE_SIZE, TILE_SIZE), NODATA_CLASS, np.uint8), palette)
+        
+        open_kwargs = {} if level is None else {'overview_level': level}
+        resolution = (bounds[2] - bounds[0]) / TILE_SIZE
+        with rasterio.open(path, **open_kwargs) as src:
+            with WarpedVRT(src, crs=WEB_MERCATOR,
+                           transform=from_origin(bounds[0], bounds[3], resolution, resolution),
+                           width=TILE_SIZE, height=TILE_SIZE,
+                           resampling=Resampling.nearest if style is None else Resampling.bilinear,
+                           src_nodata=nodata, nodata=nodata) as vrt:
+                data = vrt.read(1)
+        
+        if style is None:
+            return encode_palette_png(data.astype(np.uint8), palette)
+        
+        data = data.astype(np.float32)
+        if nodata is not None and not np.isnan(nodata):
+            data[data == nodata] = np.nan
+        return encode_palette_png(scale_to_index(data, *style), palette)
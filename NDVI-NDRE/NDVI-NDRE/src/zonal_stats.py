@@ -0,0 +1,324 @@
+"""
+Zonal Statistics Engine
+Per-field NDVI/NDRE/nitrogen statistics and stage mix from a cached zone label raster
+"""
+
+import os
+import json
+import hashlib
+from datetime import datetime
+import yaml
+import numpy as np
+import rasterio
+from rasterio.errors import WindowError
+from rasterio.features import geometry_window, rasterize
+from rasterio.warp import transform_geom
+from rasterio.windows import union
+
+# Layer -> (low, high, bins) of the per-zone histograms used for percentiles
+LAYER_BINS = {
+    'ndvi': (-1.0, 1.0, 200),
+    'ndre': (-1.0, 1.0, 200),
+    'nitrogen': (0.0, 400.0, 400)
+}
+
+
+def load_zones(geojson, id_property="zone_id"):
+    """
+    Zones from a GeoJSON FeatureCollection (WGS84)
+    
+    Args:
+        geojson: Path to a .geojson file or an already parsed dict
+        id_property: Feature property holding the zone id (defaults to the
+            feature id, then its 1-based position)
+    
+    Returns:
+        List of {"zone_id", "geometry", "properties"}
+    """
+    if isinstance(geojson, (str, os.PathLike)):
+        with open(geojson, 'r') as f:
+            geojson = json.load(f)
+    
+    features = geojson.get("features", []) if geojson.get("type") == "FeatureCollection" else [geojson]
+    zones = []
+    for position, feature in enumerate(features, start=1):
+        geometry = feature.get("geometry")
+        if not geometry or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+            raise ValueError(f"Zone {position} is not a Polygon/MultiPolygon")
+        properties = feature.get("properties") or {}
+        zone_id = properties.get(id_property, feature.get("id", position))
+        zones.append({"zone_id": zone_id, "geometry": geometry, "properties": properties})
+    
+    if not zones:
+        raise ValueError("No zones found in GeoJSON")
+    return zones
+
+
+class ZonalStatistics:
+    """
+    Rasterize zone polygons once and aggregate every layer per zone
+    
+    The label raster (0 = outside every zone, k = k-th zone) is cached on
+    disk per zone set and grid, except for one-off zone sets (API requests).
+    Statistics come from one pass over row
+    blocks: np.bincount on the labels gives counts, sums and sums of squares
+    (mean/std), a (zone, bin) bincount gives histograms (percentiles to one
+    bin width) and a (zone, stage) bincount gives the stage mix. Where zones
+    overlap, the later zone owns the pixel.
+    """
+    
+    def __init__(self, config_path="config.yaml"):
+        with open(config_path, 'r') as f:
+            self.config = yaml.safe_load(f)
+        
+        self.output_dir = self.config['paths']['output_dir']
+        zones = self.config.get('zones', {})
+        self.geojson_path = zones.get('geojson')
+        self.id_property = zones.get('id_property', 'zone_id')
+        self.percentiles = list(zones.get('percentiles', [10, 50, 90]))
+        self.block_rows = zones.get('block_rows', 1024)
+        self.cache_dir = zones.get('cache_dir', os.path.join(self.output_dir, "zone_labels"))
+        self.stats_path = os.path.join(self.output_dir, "zone_stats.json")
+        self.stage_names = self.config['growth_stages']
+    
+    def configured_zones(self):
+        """Zones from zones.geojson in config.yaml, or None if not configured"""
+        if not self.geojson_path or not os.path.exists(self.geojson_path):
+            return None
+        return load_zones(self.geojson_path, self.id_property)
+    
+    @staticmethod
+    def rasterize_zones(zones, shape, transform, crs):
+        """(H, W) int32 zone labels on a grid, in memory"""
+        shapes = [(transform_geom('EPSG:4326', crs, zone["geometry"]), label)
+                  for label, zone in enumerate(zones, start=1)]
+        return rasterize(shapes, out_shape=tuple(shape), transform=transform,
+                         fill=0, dtype='int32')
+    
+    def label_raster(self, zones, shape, transform, crs):
+        """
+        (H, W) int32 zone labels on a grid, rasterized once per zone set and grid
+        
+        Returns:
+            Read-only memmap of the cached labels
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([zone["geometry"] for zone in zones], sort_keys=True).encode())
+        digest.update(f"{tuple(shape)}:{tuple(transform)[:6]}:{crs}".encode())
+        path = os.path.join(self.cache_dir, f"labels_{digest.hexdigest()}.npy")
+        
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            labels = self.rasterize_zones(zones, shape, transform, crs)
+            tmp_path = f"{path}.tmp.npy"
+            np.save(tmp_path, labels)
+            os.replace(tmp_path, path)
+        
+        return np.load(path, mmap_mode='r')
+    
+    def _percentiles(self, histogram, low, high):
+        """Percentiles from per-zone histograms (upper edge of the bin reached)"""
+        bins = histogram.shape[1]
+        width = (high - low) / bins
+        cumulative = np.cumsum(histogram, axis=1)
+        totals = cumulative[:, -1:]
+        result = {}
+        for q in self.percentiles:
+            index = (cumulative < q / 100 * np.maximum(totals, 1)).sum(axis=1)
+            result[f"p{q}"] = low + (np.minimum(index, bins - 1) + 1) * width
+        return result
+    
+    def compute(self, zones, layers, transform, crs, stages=None, patch_size=64, labels=None):
+        """
+        Statistics of every layer per zone
+        
+        Args:
+            zones: load_zones() output
+            layers: Dict of layer name -> (H, W) array/memmap on the same grid
+            transform, crs: Georeferencing of that grid
+            stages: Optional (H // p, W // p) growth stage grid; pixels take
+                the stage of their patch (partial edge patches the nearest one)
+            patch_size: Patch edge of the stage grid
+            labels: Precomputed label raster (defaults to label_raster())
+        
+        Returns:
+            List of per-zone dicts (zone_id, area_ha, pixels, layer stats,
+            stage fractions and dominant stage)
+        """
+        shape = next(iter(layers.values())).shape
+        if labels is None:
+            labels = self.label_raster(zones, shape, transform, crs)
+        n = len(zones) + 1
+        n_stages = len(self.stage_names)
+        
+        pixels = np.zeros(n, dtype=np.int64)
+        sums = {name: np.zeros((3, n)) for name in layers}  # count, sum, sum of squares
+        histograms = {name: np.zeros((n, LAYER_BINS.get(name, (-1.0, 1.0, 200))[2]), dtype=np.int64)
+                      for name in layers}
+        stage_counts = np.zeros((n, n_stages), dtype=np.int64)
+        
+        if stages is not None:
+            stage_rows = np.minimum(np.arange(shape[0]) // patch_size, stages.shape[0] - 1)
+            stage_cols = np.minimum(np.arange(shape[1]) // patch_size, stages.shape[1] - 1)
+        
+        for row in range(0, shape[0], self.block_rows):
+            block_labels = np.asarray(labels[row:row + self.block_rows])
+            inside = block_labels > 0
+            if not inside.any():
+                continue
+            zone_labels = block_labels[inside]
+            pixels += np.bincount(zone_labels, minlength=n)
+            
+            for name, layer in layers.items():
+                values = np.asarray(layer[row:row + self.block_rows], dtype=np.float64)[inside]
+                valid = np.isfinite(values)
+                values, value_labels = values[valid], zone_labels[valid]
+                
+                sums[name][0] += np.bincount(value_labels, minlength=n)
+                sums[name][1] += np.bincount(value_labels, weights=values, minlength=n)
+                sums[name][2] += np.bincount(value_labels, weights=values * values, minlength=n)
+                
+                low, high, bins = LAYER_BINS.get(name, (-1.0, 1.0, 200))
+                value_bins = np.clip(((values - low) * (bins / (high - low))).astype(np.int64),
+                                     0, bins - 1)
+                histograms[name] += np.bincount(value_labels * bins + value_bins,
+                                                minlength=n * bins).reshape(n, bins)
+            
+            if stages is not None:
+                rows = stage_rows[row:row + self.block_rows]
+                block_stages = stages[rows[:, None], stage_cols[None, :]][inside]
+                known = (block_stages >= 0) & (block_stages < n_stages)
+                stage_counts += np.bincount(zone_labels[known] * n_stages + block_stages[known],
+                                            minlength=n * n_stages).reshape(n, n_stages)
+        
+        pixel_area_ha = abs(transform.a * transform.e) / 10000.0
+        layer_stats = {}
+        for name in layers:
+            count, total, total_sq = sums[name]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total / count
+                std = np.sqrt(np.maximum(total_sq / count - mean * mean, 0))
+            low, high, _ = LAYER_BINS.get(name, (-1.0, 1.0, 200))
+            layer_stats[name] = (count, mean, std, self._percentiles(histograms[name], low, high))
+        
+        results = []
+        for label, zone in enumerate(zones, start=1):
+            entry = {
+                "zone_id": zone["zone_id"],
+                "pixels": int(pixels[label]),
+                "area_ha": round(float(pixels[label] * pixel_area_ha), 4)
+            }
+            for name, (count, mean, std, percentiles) in layer_stats.items():
+                if count[label] == 0:
+                    entry[name] = {"count": 0, "mean": None, "std": None,
+                                   **{key: None for key in percentiles}}
+                    continue
+                entry[name] = {
+                    "count": int(count[label]),
+                    "mean": round(float(mean[label]), 4),
+                    "std": round(float(std[label]), 4),
+                    **{key: round(float(values[label]), 4) for key, values in percentiles.items()}
+                }
+            if stages is not None:
+                total = stage_counts[label].sum()
+                entry["stages"] = {stage: round(float(stage_counts[label, k] / total), 4) if total else 0.0
+                                   for k, stage in enumerate(self.stage_names)}
+                entry["dominant_stage"] = self.stage_names[int(np.argmax(stage_counts[label]))] \
+                    if total else None
+            results.append(entry)
+        
+        return results
+    
+    def save(self, zone_stats):
+        """Write zone statistics to outputs/zone_stats.json"""
+        output = {"generated_at": datetime.now().isoformat(), "zones": zone_stats}
+        # Atomic: the API reads this file while the pipeline rewrites it
+        tmp_path = f"{self.stats_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(output, f, indent=2)
+        os.replace(tmp_path, self.stats_path)
+        print(f"Zone statistics saved to {self.stats_path}")
+        return output
+    
+    def load_latest(self):
+        """Last saved zone statistics, or None"""
+        if not os.path.exists(self.stats_path):
+            return None
+        with open(self.stats_path, 'r') as f:
+            return json.load(f)
+    
+    def from_outputs(self, zones, layers=('ndvi', 'ndre', 'nitrogen'), cache_labels=True):
+        """
+        Zone statistics straight from the pipeline COGs
+        
+        Only the window covering the zones is read and rasterized. The stage
+        mix uses outputs/growth_stages.npy when the last run left one.
+        
+        Args:
+            zones: load_zones() output
+            layers: Pipeline COGs to summarise
+            cache_labels: Keep the label raster in cache_dir (False for
+                one-off zone sets such as API requests, rasterized in memory)
+        """
+        paths = {name: os.path.join(self.output_dir, f"{name}.tif") for name in layers}
+        paths = {name: path for name, path in paths.items() if os.path.exists(path)}
+        if not paths:
+            raise FileNotFoundError("No pipeline outputs found. Run the pipeline first.")
+        
+        arrays = {}
+        with rasterio.open(next(iter(paths.values()))) as ref:
+            windows = []
+            for zone in zones:
+                try:
+                    windows.append(geometry_window(
+                        ref, [transform_geom('EPSG:4326', ref.crs, zone["geometry"])]))
+                except WindowError:
+                    continue  # Outside the scene: reported with zero pixels
+            if not windows:
+                raise ValueError("No zone intersects the pipeline outputs")
+            window = union(*windows).round_offsets().round_lengths()
+            transform, crs = ref.window_transform(window), ref.crs
+        
+        for name, path in paths.items():
+            with rasterio.open(path) as src:
+                data = src.read(1, window=window).astype(np.float32)
+                if src.nodata is not None and not np.isnan(src.nodata):
+                    data[data == src.nodata] = np.nan
+                arrays[name] = data
+        
+        stages = None
+        patch_size = self.config['models']['cnn']['input_shape'][0]
+        stages_path = os.path.join(self.output_dir, "growth_stages.npy")
+        if os.path.exists(stages_path):
+            grid = np.load(stages_path, mmap_mode='r')
+            row_off, col_off = int(window.row_off), int(window.col_off)
+            rows = np.minimum((row_off + np.arange(int(window.height))) // patch_size, grid.shape[0] - 1)
+            cols = np.minimum((col_off + np.arange(int(window.width))) // patch_size, grid.shape[1] - 1)
+            # Per-pixel stages of the window, as a 1-pixel "patch" grid
+            stages = np.asarray(grid)[rows[:, None], cols[None, :]]
+            patch_size = 1
+        
+        shape = (int(window.height), int(window.width))
+        if cache_labels:
+            labels = self.label_raster(zones, shape, transform, crs)
+        else:
+            labels = self.rasterize_zones(zones, shape, transform, crs)
+        return self.compute(zones, arrays, transform, crs, stages=stages, patch_size=patch_size,
+                            labels=labels)
+    
+    @staticmethod
+    def recommendation_inputs(zone_stats):
+        """Zone dicts in the shape RecommendationAgent.generate_zone_recommendations expects"""
+        inputs = []
+        for zone in zone_stats:
+            if zone.get("ndvi", {}).get("mean") is None:
+                continue  # No valid pixels
+            nitrogen = zone.get("nitrogen", {}).get("mean")
+            inputs.append({
+                "zone_id": zone["zone_id"],
+                "stage": zone.get("dominant_stage") or "Vegetative",
+                "nitrogen": nitrogen if nitrogen is not None else 150.0,
+                "ndvi": zone["ndvi"]["mean"],
+                "area_ha": zone["area_ha"]
+            })
+        return inputs
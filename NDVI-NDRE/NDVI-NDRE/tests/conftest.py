@@ -0,0 +1,16 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Temporary working directory holding a copy of config.yaml (relative paths land in it)"""
+    shutil.copy(os.path.join(PROJECT_DIR, "config.yaml"), tmp_path / "config.yaml")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from src.image_processor import ImageProcessor
+from src.indices import SpectralIndexEngine
+
+
+def test_explicit_empty_index_list_evaluates_nothing():
+    engine = SpectralIndexEngine({'ndvi': None, 'ndre': None, 'evi': None})
+    bands = {band: np.full((4, 4), 3000, dtype=np.uint16) for band in engine.required_bands()}
+    
+    assert engine.required_bands([]) == []
+    assert engine.evaluate(bands, []) == {}
+    assert sorted(engine.evaluate(bands)) == ['evi', 'ndre', 'ndvi']
+
+
+def test_missing_red_edge_band_is_reported_up_front(workdir):
+    for band in ('B04', 'B08'):
+        (workdir / "r10").mkdir(exist_ok=True)
+        (workdir / "r10" / f"T_{band}_10m.jp2").touch()
+    
+    processor = ImageProcessor("config.yaml")
+    with pytest.raises(ValueError, match=r"NDRE .*B05"):
+        processor.check_required_indices()
+    
+    processor.check_required_indices(['B04', 'B05', 'B08'])
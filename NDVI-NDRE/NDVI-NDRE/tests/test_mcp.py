@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+import yaml
+
+from src.mcp import ChangeStatistics, MCPTrigger
+
+
+def test_change_statistics_rejects_odd_bin_count():
+    with pytest.raises(ValueError, match="even"):
+        ChangeStatistics((64, 64), zone_size=32, threshold=0.1, bins=401)
+
+
+def test_mcp_trigger_rejects_odd_histogram_bins_from_config(workdir):
+    with open("config.yaml") as f:
+        config = yaml.safe_load(f)
+    config['pipeline'].setdefault('change_detection', {})['histogram_bins'] = 399
+    with open("config.yaml", "w") as f:
+        yaml.safe_dump(config, f)
+    
+    with pytest.raises(ValueError, match="histogram_bins"):
+        MCPTrigger("config.yaml")
+
+
+def test_change_percentiles_match_numpy():
+    rng = np.random.default_rng(0)
+    change = rng.normal(0, 0.2, (128, 96)).astype(np.float32)
+    statistics = ChangeStatistics(change.shape, zone_size=32, threshold=0.1, bins=400)
+    for row in range(0, 128, 40):
+        statistics.update(row, change[row:row + 40])
+    
+    for q in (50, 90, 99):
+        assert abs(statistics.percentile(q) - np.percentile(np.abs(change), q)) <= statistics.bin_width
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from src.generate_data import fill_patches
+from src.image_processor import ImageProcessor
+from src.models import NitrogenPredictor, create_synthetic_dataset
+
+
+def _pipeline_scene(rng):
+    """Pipeline-shaped scene: (H, W, C) stack in BAND_SPECS order (3x3 patches), NDVI, NDRE"""
+    patch_grid = np.empty((9, 64, 64, len(ImageProcessor.BAND_SPECS)), dtype=np.float32)
+    fill_patches(patch_grid, rng.uniform(0.3, 0.8, 9).astype(np.float32), rng.integers(0, 3, 9), rng)
+    stacked = patch_grid.reshape(3, 3, 64, 64, -1).transpose(0, 2, 1, 3, 4).reshape(192, 192, -1)
+    red, nir = stacked[..., 2], stacked[..., 3]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndvi = (nir - red) / (nir + red)
+        ndre = (nir - stacked[..., 4]) / (nir + stacked[..., 4])
+    return stacked, ndvi, ndre
+
+
+def _train_patch_model(workdir):
+    patches, _, _, nitrogen = create_synthetic_dataset(n_samples=60, data_dir=str(workdir / "data"))
+    assert patches.shape[-1] == len(ImageProcessor.BAND_SPECS)
+    predictor = NitrogenPredictor("config.yaml")
+    predictor.train(predictor.patch_features(patches), nitrogen)
+
+
+def test_nitrogen_model_trained_on_synthetic_data_scores_pipeline_stack(workdir, capsys):
+    from main import WeeklyPipeline
+    
+    _train_patch_model(workdir)
+    stacked, ndvi, ndre = _pipeline_scene(np.random.default_rng(0))
+    
+    pipeline = WeeklyPipeline("config.yaml")
+    capsys.readouterr()
+    nitrogen_map = pipeline.predict_nitrogen(ndvi, ndre, stacked)
+    
+    assert "NDVI-based estimation" not in capsys.readouterr().out
+    assert nitrogen_map.shape == ndvi.shape
+    assert not np.allclose(nitrogen_map, 100 + ndvi * 100)
+    assert np.all((nitrogen_map >= 60) & (nitrogen_map <= 200))
+
+
+def test_nitrogen_model_trained_on_other_band_count_fails_to_load(workdir):
+    rng = np.random.default_rng(0)
+    patches = rng.uniform(500, 3000, (40, 8, 8, 13)).astype(np.float32)
+    predictor = NitrogenPredictor("config.yaml")
+    predictor.train(predictor.patch_features(patches), rng.uniform(60, 200, 40))
+    
+    with pytest.raises(ValueError, match="retrain"):
+        NitrogenPredictor("config.yaml").load_model()
+
+
+def test_synthetic_dataset_rejects_unknown_growth_stages(workdir):
+    from src.generate_data import generate_synthetic_soil_data
+    
+    df = generate_synthetic_soil_data(n_samples=30, output_path=str(workdir / "soil.csv"))
+    df['growth_stage'] = df['growth_stage'].astype(str).replace('Bulking', 'Tuber Bulking')
+    (workdir / "data").mkdir(exist_ok=True)
+    df.to_csv(workdir / "data" / "synthetic_soil_data.csv", index=False)
+    
+    with pytest.raises(ValueError, match="Tuber Bulking"):
+        create_synthetic_dataset(n_samples=30, data_dir=str(workdir / "data"))
+
+
+def test_patches_with_non_finite_features_get_nan_nitrogen(workdir):
+    from main import WeeklyPipeline
+    
+    _train_patch_model(workdir)
+    stacked, _, _ = _pipeline_scene(np.random.default_rng(1))
+    stacked[64:96, 64:128] = np.nan  # Half cloud-masked patch: NaN band statistics
+    stacked[0:64, 128:192] = 0       # Nodata patch: NDVI/NDRE features are 0/0
+    red, nir = stacked[..., 2], stacked[..., 3]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndvi = (nir - red) / (nir + red)
+        ndre = (nir - stacked[..., 4]) / (nir + stacked[..., 4])
+    
+    nitrogen_map = WeeklyPipeline("config.yaml").predict_nitrogen(ndvi, ndre, stacked)
+    
+    assert np.isnan(nitrogen_map[64:128, 64:128]).all()
+    assert np.isnan(nitrogen_map[0:64, 128:192]).all()
+    assert np.isfinite(nitrogen_map[0:64, 0:128]).all()
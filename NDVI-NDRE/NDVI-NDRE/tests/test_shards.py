@@ -0,0 +1,20 @@
+import os
+
+import numpy as np
+
+from src.shards import open_shard, write_shards
+
+
+def test_partial_last_shard_is_truncated(tmp_path):
+    patches = np.arange(10 * 4 * 4 * 7, dtype=np.float32).reshape(10, 4, 4, 7)
+    labels = np.arange(10)
+    manifest = write_shards(str(tmp_path / "shards"), shard_size=4,
+                            patches=patches, labels=labels)
+    
+    assert [shard["n_samples"] for shard in manifest["shards"]] == [4, 4, 2]
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path / "shards"))
+    
+    last = open_shard(str(tmp_path / "shards"), manifest["shards"][-1])
+    assert last["patches"].shape == (2, 4, 4, 7)
+    np.testing.assert_array_equal(last["patches"], patches[8:])
+    np.testing.assert_array_equal(last["labels"], labels[8:])
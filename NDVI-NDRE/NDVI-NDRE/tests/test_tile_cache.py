@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.tile_cache import TileCache
+
+
+def _run(path, changes, threshold=0.1):
+    """One cache run recording the given key -> ndvi_change, returns the tiles to rerun"""
+    cache = TileCache(path)
+    cache.begin({"shape": [128, 128]})
+    for key, change in changes.items():
+        cache.record_inputs(key, f"hash-{change}", change)
+    rerun = [key for key in ("0:0", "0:64") if cache.needs_models(key, threshold, "models-v1")]
+    for key in rerun:
+        cache.record_models(key)
+    cache.finish({}, "inputs", "models-v1")
+    return rerun
+
+
+def test_models_rerun_only_once_ndvi_drift_exceeds_threshold(tmp_path):
+    path = str(tmp_path / "tile_cache.json")
+    assert _run(path, {"0:0": None, "0:64": None}) == ["0:0", "0:64"]  # New tiles
+    assert _run(path, {}) == []
+    assert _run(path, {"0:0": 0.06}) == []           # Inputs changed, drift below threshold
+    assert _run(path, {"0:0": 0.06}) == ["0:0"]      # Accumulated drift 0.12
+    assert _run(path, {"0:0": 0.06}) == []           # Drift reset by the model run
+
+
+def test_models_rerun_after_model_change(tmp_path):
+    path = str(tmp_path / "tile_cache.json")
+    _run(path, {"0:0": None, "0:64": None})
+    cache = TileCache(path)
+    cache.begin({"shape": [128, 128]})
+    assert cache.needs_models("0:0", 0.1, "models-v2")
+    assert not cache.needs_models("0:0", np.inf, "models-v1")